@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк хранилищ FSM: задержка get/set состояния и данных
+Сравнивает MemoryStorage, SQLiteStorage с тёплым кэшем, SQLiteStorage
+с промахами кэша (каждый запрос читает БД) и, если задан --redis-url, RedisStorage.
+
+Запуск:
+    python -m benchmarks.bench_fsm_storage
+    python -m benchmarks.bench_fsm_storage --users 50000 --redis-url redis://localhost:6379/15
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from benchmarks.timing import timed
+from services.fsm_storage import SQLiteStorage, create_fsm_storage
+from states import OrderStates
+
+BOT_ID = 1
+
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+
+
+async def run_benchmark(name: str, storage: BaseStorage, users: int, rounds: int) -> None:
+    print(name)
+    rnd = random.Random(1)
+    states = [OrderStates.choosing_category, OrderStates.choosing_subcategory, OrderStates.choosing_product]
+    # Заполняем состояния всех пользователей
+    for user_id in range(users):
+        await storage.set_state(_key(user_id), OrderStates.choosing_category)
+    await timed("  set_state", rounds, lambda i: storage.set_state(_key(rnd.randrange(users)), rnd.choice(states)))
+    await timed("  get_state", rounds, lambda i: storage.get_state(_key(rnd.randrange(users))))
+    await timed(
+        "  update_data",
+        rounds,
+        lambda i: storage.update_data(_key(rnd.randrange(users)), {"category": "pizza", "subcategory": "hot"}),
+    )
+    await timed("  get_data", rounds, lambda i: storage.get_data(_key(rnd.randrange(users))))
+    await storage.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилищ FSM")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5000)
+    parser.add_argument("--redis-url", help="Redis-совместимый сервер (например, redis://localhost:6379/15)")
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark("MemoryStorage", MemoryStorage(), args.users, args.rounds))
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(os.path.join(tmp, "warm.db"), cache_size=args.users)
+        asyncio.run(run_benchmark("SQLiteStorage (кэш)", storage, args.users, args.rounds))
+        print(f"  попаданий в кэш: {storage.hits}, промахов: {storage.misses}")
+        # Кэш на одну запись: почти каждое обращение читает БД
+        storage = SQLiteStorage(os.path.join(tmp, "cold.db"), cache_size=1)
+        asyncio.run(run_benchmark("SQLiteStorage (без кэша)", storage, args.users, args.rounds))
+        print(f"  попаданий в кэш: {storage.hits}, промахов: {storage.misses}")
+    if args.redis_url:
+        storage = create_fsm_storage("redis", "", args.redis_url, 0)
+        asyncio.run(run_benchmark("RedisStorage", storage, args.users, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
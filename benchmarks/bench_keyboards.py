@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Микро-бенчмарк клавиатур меню: построение на каждое нажатие
+против готовых клавиатур, закэшированных для версии каталога
+
+Одно «обновление» — набор клавиатур горячего пути: главное меню
+(/start, back_to_menu, add_more, clear_cart), подкатегории и товары категории.
+
+Запуск:
+    python -m benchmarks.bench_keyboards --products 3000 --updates 2000
+"""
+import argparse
+import time
+from typing import Callable, List, Tuple
+
+import data
+import keyboards
+from benchmarks.bench_menu_query import synthetic_menu
+from services.catalog import Catalog, build_catalog
+
+
+def _hot_path(catalog: Catalog) -> List[Tuple[str, str]]:
+    """Пары (category, subcategory) для клавиатур товаров, по кругу"""
+    pairs = []
+    for category in catalog.categories:
+        subcategories = catalog.get_subcategories(category)
+        if subcategories:
+            pairs.extend((category, sub) for sub in subcategories)
+        else:
+            pairs.append((category, None))
+    return pairs
+
+
+def _run(updates: int, pairs: List[Tuple[str, str]], update: Callable) -> float:
+    """Среднее время одного обновления, мкс"""
+    started = time.perf_counter()
+    for i in range(updates):
+        update(*pairs[i % len(pairs)])
+    return (time.perf_counter() - started) / updates * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк клавиатур меню")
+    parser.add_argument("--products", type=int, default=3000)
+    parser.add_argument("--updates", type=int, default=2000)
+    args = parser.parse_args()
+
+    menu = synthetic_menu(args.products)
+    catalog = build_catalog(menu["products"], menu["categories"], version=1)
+    data._swap_catalog(catalog)
+    pairs = _hot_path(catalog)
+
+    def uncached(category: str, subcategory: str) -> None:
+        keyboards._build_main_menu_keyboard(catalog, 0)
+        if subcategory is not None:
+            keyboards._build_subcategories_keyboard(category, catalog, 0)
+        keyboards._build_products_keyboard(category, subcategory, catalog, 0)
+
+    def cached(category: str, subcategory: str) -> None:
+        keyboards.get_main_menu_keyboard()
+        if subcategory is not None:
+            keyboards.get_subcategories_keyboard(category)
+        keyboards.get_products_keyboard(category, subcategory)
+
+    before = _run(args.updates, pairs, uncached)
+    # Кэш заполняется один раз на версию каталога
+    for pair in pairs:
+        cached(*pair)
+    after = _run(args.updates, pairs, cached)
+
+    print(f"Товаров: {catalog.product_count()}, обновлений: {args.updates}")
+    print(f"Построение на каждое нажатие: {before:10.1f} мкс/обновление")
+    print(f"Кэш по версии каталога:       {after:10.1f} мкс/обновление")
+    print(f"Ускорение: x{before / after:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Сравнение загрузки меню: два запроса с полной проекцией (прежний вариант)
+против одного объединённого запроса MENU_QUERY с минимальной проекцией
+
+Ответы строятся по записанным документам Sanity и отдаются локальным
+HTTP-сервером с искусственной задержкой на запрос (имитация сети).
+
+Запуск:
+    python -m benchmarks.bench_menu_query                       # синтетическое меню
+    python -m benchmarks.bench_menu_query --record docs.json    # записать документы из Sanity
+    python -m benchmarks.bench_menu_query --documents docs.json --latency 80
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+import aiohttp
+from aiohttp import web
+
+from services.catalog import build_catalog
+from tools.sanity_standin import SanityStandIn
+
+RECORD_QUERY = '*[_type in ["category", "product"]]'
+
+
+def synthetic_documents(count: int) -> List[Dict[str, Any]]:
+    """Документы, похожие на настоящее меню: с описаниями, картинками и рекомендациями"""
+    rnd = random.Random(42)
+    categories = ["sets", "rolls", "sushi", "wok", "burgers", "pizza", "drinks", "utensils"]
+    subcategories = {
+        "rolls": ["philadelphia", "california", "maki", "baked-rolls", ""],
+        "drinks": ["coffee", "tea", "lemonade", "cold-drinks"],
+    }
+    stamp = "2026-01-01T00:00:00Z"
+    documents: List[Dict[str, Any]] = [
+        {
+            "_id": f"category-{slug}",
+            "_type": "category",
+            "_updatedAt": stamp,
+            "slug": {"_type": "slug", "current": slug},
+            "name": {"ru": slug, "en": slug},
+            "order": order,
+        }
+        for order, slug in enumerate(categories)
+    ]
+    for i in range(count):
+        category = rnd.choice(categories[:-1])
+        doc = {
+            "_id": f"product-{i:06d}",
+            "_type": "product",
+            "_updatedAt": stamp,
+            "slug": {"_type": "slug", "current": f"{category}-{i:06d}"},
+            "name": {"ru": f"Блюдо {i}", "en": f"Dish {i}"},
+            "description": {"ru": "Лосось, сливочный сыр, огурец, рис, нори. " * 3, "en": "Salmon, cream cheese. " * 3},
+            "category": {"_type": "reference", "_ref": f"category-{category}"},
+            "price": rnd.randint(50, 900),
+            "weight": rnd.randint(100, 900),
+            "image": {"_type": "image", "asset": {"_type": "reference", "_ref": f"image-{i:040x}-800x600-jpg"}},
+            "badge": rnd.choice([None, "new", "hit"]),
+            "recommendations": [{"_type": "reference", "_ref": f"product-{rnd.randrange(count):06d}"} for _ in range(3)],
+        }
+        subcategory = rnd.choice(subcategories.get(category, [""]))
+        if subcategory:
+            doc["subcategory"] = subcategory
+        documents.append(doc)
+    return documents
+
+
+class _StaticStore:
+    """Хранилище документов для SanityStandIn без файла"""
+
+    def __init__(self, documents: List[Dict[str, Any]]):
+        self._documents = documents
+
+    def documents(self) -> List[Dict[str, Any]]:
+        return self._documents
+
+
+def synthetic_menu(count: int) -> Dict[str, Any]:
+    """Синтетическое меню в виде ответа на MENU_QUERY: {"categories", "products"}"""
+    return SanityStandIn(_StaticStore(synthetic_documents(count))).menu()
+
+
+def _legacy_responses(documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Ответы на прежние CATEGORIES_QUERY и PRODUCTS_QUERY (полная проекция, разыменование ссылок)"""
+    categories = [d for d in documents if d.get("_type") == "category"]
+    products = [d for d in documents if d.get("_type") == "product"]
+    categories_by_id = {c["_id"]: c for c in categories}
+    slugs_by_id = {p["_id"]: p.get("slug") for p in products}
+
+    def product_key(p: Dict[str, Any]):
+        category = categories_by_id.get((p.get("category") or {}).get("_ref")) or {}
+        return (category.get("order") or 0, (category.get("slug") or {}).get("current", ""))
+
+    legacy_categories = [
+        {key: c.get(key) for key in ("_id", "_updatedAt", "slug", "name", "order")}
+        for c in sorted(categories, key=lambda c: c.get("order") or 0)
+    ]
+    legacy_products = []
+    for p in sorted(products, key=product_key):
+        category = categories_by_id.get((p.get("category") or {}).get("_ref")) or {}
+        legacy_products.append({
+            **{key: p.get(key) for key in (
+                "_id", "_updatedAt", "slug", "name", "description", "subcategory",
+                "price", "weight", "image", "badge",
+            )},
+            "category": category.get("slug"),
+            "recommendations": [slugs_by_id.get(r.get("_ref")) for r in p.get("recommendations") or []],
+        })
+    return {"categories": legacy_categories, "products": legacy_products}
+
+
+def _body(result: Any) -> bytes:
+    return json.dumps({"ms": 1, "result": result}, ensure_ascii=False).encode("utf-8")
+
+
+async def _serve(bodies: Dict[str, bytes], latency: float) -> web.AppRunner:
+    """Локальный сервер: GET /{name} -> заранее подготовленный ответ после задержки"""
+    async def handle(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency)
+        return web.Response(body=bodies[request.match_info["name"]], content_type="application/json")
+
+    app = web.Application()
+    app.router.add_get("/{name}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+
+async def _measure(rounds: int, run: Callable) -> Dict[str, float]:
+    """Медианы полного времени и времени сборки каталога"""
+    totals, builds = [], []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        build_ms = await run()
+        totals.append((time.perf_counter() - started) * 1000)
+        builds.append(build_ms)
+    return {"total": statistics.median(totals), "build": statistics.median(builds)}
+
+
+async def run_benchmark(documents: List[Dict[str, Any]], latency_ms: float, rounds: int) -> None:
+    legacy = _legacy_responses(documents)
+    combined = SanityStandIn(_StaticStore(documents)).menu()
+    bodies = {
+        "categories": _body(legacy["categories"]),
+        "products": _body(legacy["products"]),
+        "menu": _body(combined),
+    }
+    runner = await _serve(bodies, latency_ms / 1000)
+    port = runner.addresses[0][1]
+    base_url = f"http://127.0.0.1:{port}"
+
+    async with aiohttp.ClientSession() as session:
+        async def get(name: str) -> Any:
+            async with session.get(f"{base_url}/{name}") as response:
+                return (await response.json())["result"]
+
+        def build(raw_products: List[Dict], raw_categories: List[Dict]) -> float:
+            started = time.perf_counter()
+            build_catalog(raw_products, raw_categories, version=1)
+            return (time.perf_counter() - started) * 1000
+
+        async def legacy_sequential() -> float:
+            raw_categories = await get("categories")
+            raw_products = await get("products")
+            return build(raw_products, raw_categories)
+
+        async def legacy_concurrent() -> float:
+            raw_categories, raw_products = await asyncio.gather(get("categories"), get("products"))
+            return build(raw_products, raw_categories)
+
+        async def single_query() -> float:
+            result = await get("menu")
+            return build(result["products"], result["categories"])
+
+        # Прогрев соединения
+        await single_query()
+        results = [
+            ("2 запроса, последовательно", 2, len(bodies["categories"]) + len(bodies["products"]),
+             await _measure(rounds, legacy_sequential)),
+            ("2 запроса, параллельно", 2, len(bodies["categories"]) + len(bodies["products"]),
+             await _measure(rounds, legacy_concurrent)),
+            ("1 запрос MENU_QUERY", 1, len(bodies["menu"]), await _measure(rounds, single_query)),
+        ]
+    await runner.cleanup()
+
+    products = sum(1 for d in documents if d.get("_type") == "product")
+    print(f"Товаров: {products}, задержка: {latency_ms:.0f} мс на запрос, повторов: {rounds}")
+    print(f"{'Вариант':<28} {'Запросов':>8} {'Ответ, КБ':>10} {'Всего, мс':>10} {'Сборка, мс':>11}")
+    for title, requests_count, size, timing in results:
+        print(
+            f"{title:<28} {requests_count:>8} {size / 1024:>10.1f} "
+            f"{timing['total']:>10.1f} {timing['build']:>11.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк запросов меню к Sanity")
+    parser.add_argument("--documents", help="JSON-файл с записанными документами Sanity")
+    parser.add_argument("--record", help="Записать документы из настроенного Sanity в файл и выйти")
+    parser.add_argument("--products", type=int, default=3000, help="Размер синтетического меню")
+    parser.add_argument("--latency", type=float, default=50.0, help="Задержка на запрос, мс")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.record:
+        from services.sanity import _fetch_result
+        documents = _fetch_result(RECORD_QUERY) or []
+        with open(args.record, "w", encoding="utf-8") as f:
+            json.dump(documents, f, ensure_ascii=False)
+        print(f"Записано документов: {len(documents)}")
+        return
+
+    if args.documents:
+        with open(args.documents, encoding="utf-8") as f:
+            documents = json.load(f)
+    else:
+        documents = synthetic_documents(args.products)
+    asyncio.run(run_benchmark(documents, args.latency, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк хранилища заказов SQLite: вставка и запросы на 1M заказов
+
+Измеряет пакетную вставку, одиночные create (как в боте), выборки по индексам
+и задержку event loop во время записи (запись идёт в потоке БД).
+
+Запуск:
+    python -m benchmarks.bench_orders                    # 1M заказов во временном файле
+    python -m benchmarks.bench_orders --orders 100000 --path /tmp/orders.db
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from benchmarks.timing import timed
+from services.order_store import ORDER_STATUSES, SQLiteOrderStore
+
+BATCH = 10000
+
+
+def synthetic_orders(count: int, users: int, seed: int = 42) -> List[Dict]:
+    """Заказы за последний год: 1–4 позиции, случайный статус"""
+    rnd = random.Random(seed)
+    start = datetime.now() - timedelta(days=365)
+    step = 365 * 86400 / max(count, 1)
+    orders = []
+    for i in range(count):
+        items = [
+            (f"Блюдо {rnd.randrange(3000)}", quantity, 150 * quantity)
+            for quantity in (rnd.randint(1, 3) for _ in range(rnd.randint(1, 4)))
+        ]
+        orders.append({
+            'user_id': rnd.randrange(users),
+            'username': f"user{i % users}",
+            'first_name': "Имя",
+            'phone': "+900000000000",
+            'items': items,
+            'total_sum': sum(total for _, _, total in items),
+            'timestamp': start + timedelta(seconds=i * step),
+            'status': rnd.choice(ORDER_STATUSES),
+        })
+    return orders
+
+
+async def _loop_lag(stop: asyncio.Event) -> float:
+    """Максимальная задержка event loop, мс (тик раз в 1 мс)"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, (time.perf_counter() - started - 0.001) * 1000)
+    return worst
+
+
+async def run_benchmark(store: SQLiteOrderStore, count: int, users: int, rounds: int) -> None:
+    rnd = random.Random(7)
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(_loop_lag(stop))
+    started = time.perf_counter()
+    for offset in range(0, count, BATCH):
+        # Генерация тоже вне event loop, чтобы задержка отражала только работу с БД
+        batch = await asyncio.to_thread(synthetic_orders, min(BATCH, count - offset), users, offset)
+        await store.add_many(batch)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    print(f"Пакетная вставка {count} заказов: {elapsed:.1f} с ({count / elapsed:,.0f} заказов/с)")
+    print(f"Задержка event loop во время вставки: не более {await lag:.1f} мс")
+
+    samples = synthetic_orders(rounds, users, seed=count)
+    await timed("create (одиночный заказ)", rounds, lambda i: store.add(samples[i]))
+    total = await store.count()
+    await timed("get (по order_id)", rounds, lambda i: store.get(rnd.randint(1, total)))
+    await timed("get_by_user (10 последних)", rounds, lambda i: store.get_by_user(rnd.randrange(users)))
+    await timed(
+        "set_status",
+        rounds,
+        lambda i: store.set_status(rnd.randint(1, total), rnd.choice(ORDER_STATUSES), ORDER_STATUSES),
+    )
+    for status in ORDER_STATUSES:
+        await timed(f"count(status={status})", 5, lambda i: store.count(status))
+        await timed(f"get_page(status={status})", rounds, lambda i: store.get_page(status=status))
+        await timed(
+            f"get_page(status={status}, before)",
+            rounds,
+            lambda i: store.get_page(before=rnd.randint(1, total), status=status),
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилища заказов")
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--path", help="Файл БД (по умолчанию временный)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.path or os.path.join(tmp, "orders.db")
+        store = SQLiteOrderStore(path)
+        try:
+            asyncio.run(run_benchmark(store, args.orders, args.users, args.rounds))
+        finally:
+            store.close()
+        print(f"Размер БД: {os.path.getsize(path) / 1e6:.0f} МБ")
+
+
+if __name__ == "__main__":
+    main()
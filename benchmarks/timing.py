@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""Общие замеры для бенчмарков"""
+import statistics
+import time
+from typing import Awaitable, Callable, List
+
+
+async def timed(label: str, rounds: int, call: Callable[[int], Awaitable], width: int = 34) -> None:
+    """Среднее и p95 времени вызова call(i), мкс"""
+    timings: List[float] = []
+    for i in range(rounds):
+        started = time.perf_counter()
+        await call(i)
+        timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+    p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+    print(f"{label:<{width}} {statistics.mean(timings):10.1f} мкс  p95 {p95:10.1f} мкс")
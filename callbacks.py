@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Кодек callback_data для inline-кнопок
+Формат: действие:версия:аргументы, например "s:1k:3:0:2"
+Целые числа записываются в base36, версия каталога помечает кнопки меню,
+чтобы распознать нажатие на клавиатуре от старого меню
+"""
+from typing import Any, Dict, NamedTuple, Optional, Tuple, Union
+
+from aiogram.filters import BaseFilter
+from aiogram.types import CallbackQuery
+
+# Действия
+MENU = "m"            # страница главного меню: page
+CATEGORY = "c"        # категория: cat_idx, page
+SUBCATEGORY = "s"     # подкатегория: cat_idx, sub_idx, page
+PRODUCT = "p"         # товар: product_id (из _id документа, версия не нужна)
+CART_ADD = "ca"       # +1 к строке корзины: product_id
+CART_REMOVE = "cr"    # −1 от строки корзины: product_id
+CART_DELETE = "cd"    # удалить строку корзины: product_id
+# Фильтр списка заказов (status_filter): 0 — все, иначе индекс статуса + 1
+ORDERS_PAGE = "ol"    # страница /orders: direction (0 — старше курсора, 1 — новее), cursor, status_filter
+ORDER_DETAIL = "od"   # детали заказа: order_id, status_filter
+ORDER_STATUS = "os"   # смена статуса заказа: order_id, status_idx, status_filter
+
+SEPARATOR = ":"
+# Ограничение Telegram на длину callback_data в байтах
+MAX_LENGTH = 64
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+class CallbackPayload(NamedTuple):
+    """Разобранная callback_data"""
+    action: str
+    version: Optional[int]  # None — кнопка не привязана к версии каталога
+    args: Tuple[int, ...]
+
+
+def _encode_int(value: int) -> str:
+    """Целое число в base36"""
+    if value < 0:
+        return "-" + _encode_int(-value)
+    if value < 36:
+        return _DIGITS[value]
+    digits = []
+    while value:
+        value, rest = divmod(value, 36)
+        digits.append(_DIGITS[rest])
+    return "".join(reversed(digits))
+
+
+def pack(action: str, *args: int, version: Optional[int] = None) -> str:
+    """Упаковать действие, версию каталога и целые аргументы в callback_data"""
+    parts = [action, "" if version is None else _encode_int(version)]
+    parts.extend(_encode_int(arg) for arg in args)
+    data = SEPARATOR.join(parts)
+    if len(data) > MAX_LENGTH:
+        raise ValueError(f"callback_data длиннее {MAX_LENGTH} байт: {data}")
+    return data
+
+
+def unpack(data: Optional[str]) -> Optional[CallbackPayload]:
+    """Разобрать callback_data; None — не наш формат"""
+    if not data or SEPARATOR not in data:
+        return None
+    action, version, *args = data.split(SEPARATOR)
+    try:
+        return CallbackPayload(
+            action,
+            int(version, 36) if version else None,
+            tuple(int(arg, 36) for arg in args),
+        )
+    except ValueError:
+        return None
+
+
+def is_stale(payload: CallbackPayload, version: int) -> bool:
+    """Кнопка создана для другой версии каталога"""
+    return payload.version is not None and payload.version != version
+
+
+class Callback(BaseFilter):
+    """
+    Фильтр по действию callback_data
+    Передаёт обработчику разобранные данные в аргументе payload
+    """
+
+    def __init__(self, action: str, arity: int):
+        self.action = action
+        self.arity = arity
+
+    async def __call__(self, callback: CallbackQuery) -> Union[bool, Dict[str, Any]]:
+        payload = unpack(callback.data)
+        if payload is None or payload.action != self.action or len(payload.args) != self.arity:
+            return False
+        return {"payload": payload}
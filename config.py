@@ -48,3 +48,150 @@ ADMIN_ID = ADMIN_IDS[0] if ADMIN_IDS else 0
 SANITY_PROJECT_ID = os.getenv("SANITY_PROJECT_ID", "").strip()
 SANITY_DATASET = os.getenv("SANITY_DATASET", "").strip()
 SANITY_API_VERSION = os.getenv("SANITY_API_VERSION", "").strip()
+
+# Таймаут запросов к Sanity (секунды) и размер пула keep-alive соединений
+try:
+    SANITY_TIMEOUT = float(os.getenv("SANITY_TIMEOUT", "30").strip())
+except ValueError:
+    SANITY_TIMEOUT = 30.0
+
+try:
+    SANITY_POOL_SIZE = int(os.getenv("SANITY_POOL_SIZE", "4").strip())
+except ValueError:
+    SANITY_POOL_SIZE = 4
+
+# Локальный снимок меню для быстрого старта без сети (пустое значение — отключить)
+MENU_SNAPSHOT_PATH = os.getenv("MENU_SNAPSHOT_PATH", "menu_snapshot.json").strip()
+
+# Базовый URL API Sanity (например, http://127.0.0.1:8765 для локальной замены);
+# по умолчанию https://<SANITY_PROJECT_ID>.api.sanity.io
+SANITY_API_URL = os.getenv("SANITY_API_URL", "").strip().rstrip("/")
+
+# Интервал фонового обновления меню из Sanity (секунды, 0 — отключить)
+try:
+    MENU_REFRESH_INTERVAL = float(os.getenv("MENU_REFRESH_INTERVAL", "300").strip())
+except ValueError:
+    MENU_REFRESH_INTERVAL = 300.0
+
+# Размер страницы клавиатур: категорий/подкатегорий и товаров
+try:
+    MENU_PAGE_SIZE = max(1, int(os.getenv("MENU_PAGE_SIZE", "10").strip()))
+except ValueError:
+    MENU_PAGE_SIZE = 10
+
+try:
+    PRODUCTS_PAGE_SIZE = max(1, int(os.getenv("PRODUCTS_PAGE_SIZE", "8").strip()))
+except ValueError:
+    PRODUCTS_PAGE_SIZE = 8
+
+# Хранилище корзин: sqlite (сохраняются между перезапусками) или memory
+CART_BACKEND = os.getenv("CART_BACKEND", "sqlite").strip().lower()
+CART_DB_PATH = os.getenv("CART_DB_PATH", "carts.db").strip()
+
+# Как часто записывать накопленные изменения корзин (секунды)
+try:
+    CART_FLUSH_INTERVAL = max(0.1, float(os.getenv("CART_FLUSH_INTERVAL", "2").strip()))
+except ValueError:
+    CART_FLUSH_INTERVAL = 2.0
+
+# Пользователи, не активные дольше CART_IDLE_TTL секунд, вытесняются из памяти;
+# в памяти держится не больше CART_MAX_RESIDENT пользователей
+try:
+    CART_IDLE_TTL = max(1.0, float(os.getenv("CART_IDLE_TTL", "3600").strip()))
+except ValueError:
+    CART_IDLE_TTL = 3600.0
+
+try:
+    CART_MAX_RESIDENT = max(1, int(os.getenv("CART_MAX_RESIDENT", "10000").strip()))
+except ValueError:
+    CART_MAX_RESIDENT = 10000
+
+# Окно склейки правок сообщения корзины при частых нажатиях +/− (секунды)
+try:
+    CART_EDIT_DELAY = max(0.0, float(os.getenv("CART_EDIT_DELAY", "0.7").strip()))
+except ValueError:
+    CART_EDIT_DELAY = 0.7
+
+# Файл БД заказов (SQLite)
+ORDER_DB_PATH = os.getenv("ORDER_DB_PATH", "orders.db").strip()
+
+# Заказов на странице /orders
+try:
+    ORDERS_PAGE_SIZE = max(1, int(os.getenv("ORDERS_PAGE_SIZE", "10").strip()))
+except ValueError:
+    ORDERS_PAGE_SIZE = 10
+
+# Заказов в одной пачке при выгрузке /export
+try:
+    EXPORT_CHUNK_SIZE = max(1, int(os.getenv("EXPORT_CHUNK_SIZE", "1000").strip()))
+except ValueError:
+    EXPORT_CHUNK_SIZE = 1000
+
+# Блюд в топе /stats
+try:
+    STATS_TOP_N = max(1, int(os.getenv("STATS_TOP_N", "5").strip()))
+except ValueError:
+    STATS_TOP_N = 5
+
+# Уведомления администраторам о заказах: сообщений в секунду, одновременных отправок
+# и попыток до отказа от доставки
+try:
+    NOTIFY_RATE = max(0.1, float(os.getenv("NOTIFY_RATE", "20").strip()))
+except ValueError:
+    NOTIFY_RATE = 20.0
+
+try:
+    NOTIFY_CONCURRENCY = max(1, int(os.getenv("NOTIFY_CONCURRENCY", "5").strip()))
+except ValueError:
+    NOTIFY_CONCURRENCY = 5
+
+try:
+    NOTIFY_MAX_ATTEMPTS = max(1, int(os.getenv("NOTIFY_MAX_ATTEMPTS", "10").strip()))
+except ValueError:
+    NOTIFY_MAX_ATTEMPTS = 10
+
+# Окно склейки правок карточек заказа у администраторов при смене статуса (секунды)
+try:
+    ORDER_CARD_EDIT_DELAY = max(0.0, float(os.getenv("ORDER_CARD_EDIT_DELAY", "1").strip()))
+except ValueError:
+    ORDER_CARD_EDIT_DELAY = 1.0
+
+# Повтор той же попытки оформления в пределах окна (секунды) не создаёт новый заказ
+try:
+    ORDER_DEDUP_WINDOW = max(0.0, float(os.getenv("ORDER_DEDUP_WINDOW", "120").strip()))
+except ValueError:
+    ORDER_DEDUP_WINDOW = 120.0
+
+# Получение обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+
+# Webhook: публичный HTTPS-адрес бота (без пути), путь, секрет (обязателен, один
+# для всех экземпляров) и адрес встроенного HTTP-сервера
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook").strip()
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0").strip()
+try:
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080").strip())
+except ValueError:
+    WEBHOOK_PORT = 8080
+
+# Обрабатывать обновления фоновыми задачами: Telegram получает ответ сразу,
+# медленный обработчик не задерживает приём следующих обновлений
+WEBHOOK_HANDLE_IN_BACKGROUND = os.getenv("WEBHOOK_HANDLE_IN_BACKGROUND", "true").strip().lower() not in (
+    "0", "false", "no",
+)
+
+# Путь проверки работоспособности во встроенном HTTP-сервере
+HEALTH_PATH = os.getenv("HEALTH_PATH", "/health").strip()
+
+# Хранилище состояний диалога (FSM): memory, sqlite (по умолчанию) или redis
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").strip().lower()
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "fsm.db").strip()
+FSM_REDIS_URL = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0").strip()
+
+# Записей FSM в кэше процесса (sqlite)
+try:
+    FSM_CACHE_SIZE = max(1, int(os.getenv("FSM_CACHE_SIZE", "10000").strip()))
+except ValueError:
+    FSM_CACHE_SIZE = 10000
@@ -2,16 +2,39 @@
 """
 Данные о товарах
 Загружает products из Sanity CMS
+При старте меню читается из локального снимка (если он есть),
+а затем сверяется с Sanity в фоне
+Обновление по умолчанию инкрементальное — по изменениям _updatedAt,
+при полной загрузке неизменившийся ответ Sanity (по хэшу) не пересобирается
+Меню хранится как неизменяемый каталог (services.catalog.Catalog),
+который при обновлении подменяется целиком
 Структура: категории с подкатегориями, товары с slug, name, price
 Язык меню: ru
 """
+import asyncio
+import json
+import logging
+import os
+import time
 from collections import OrderedDict
-from typing import Any, Dict, List, Union
+from datetime import datetime
+from typing import Dict, List, Mapping, Optional, Sequence
 
-from services.sanity import fetch_products, fetch_categories
+from config import MENU_SNAPSHOT_PATH
+from services.catalog import (
+    Catalog,
+    EMPTY_CATALOG,
+    apply_delta,
+    build_catalog,
+    catalog_from_dict,
+    hash_payload,
+)
+from services.sanity import fetch_menu, fetch_menu_async, fetch_menu_delta_async
 
-# Язык для меню
-LANG = "ru"
+logger = logging.getLogger(__name__)
+
+# Версия формата снимка меню на диске
+SNAPSHOT_FORMAT = 7
 
 # Маппинг slug (category/subcategory из Sanity) -> отображаемое название с иконками
 # Ключи в нижнем регистре для поиска
@@ -58,215 +81,289 @@ def _menu_label(slug: str) -> str:
     return MENU_LABELS.get(key, slug)
 
 
-# Структура: {category: [products]} или {category: {subcategory: [products]}}
-# Каждый product: {slug, name, price, ...}
-PRODUCTS: Dict[str, Union[List[Dict], Dict[str, List[Dict]]]] = {}
+class MenuRefreshStats:
+    """Счётчики обновлений меню"""
+
+    def __init__(self):
+        self.refreshes = 0  # обновления, после которых собрана новая версия каталога
+        self.skipped = 0  # обновления без изменений (совпал хэш или нет изменений)
+        self.failed = 0
+        self.full_builds = 0
+        self.delta_builds = 0
+        self.last_build_ms = 0.0
+        self.total_build_ms = 0.0
+        self.last_refresh_at: Optional[datetime] = None
+
+    def record_build(self, started: float, delta: bool) -> None:
+        """Учесть сборку каталога, начатую в момент started (perf_counter)"""
+        self.last_build_ms = (time.perf_counter() - started) * 1000
+        self.total_build_ms += self.last_build_ms
+        self.refreshes += 1
+        if delta:
+            self.delta_builds += 1
+        else:
+            self.full_builds += 1
+        self.last_refresh_at = datetime.now()
+
+    def record_skip(self) -> None:
+        """Учесть обновление без изменений"""
+        self.skipped += 1
+        self.last_refresh_at = datetime.now()
+
+    @property
+    def avg_build_ms(self) -> float:
+        """Средняя длительность сборки каталога"""
+        return self.total_build_ms / self.refreshes if self.refreshes else 0.0
+
+
+_refresh_stats = MenuRefreshStats()
+
 
-# slug -> цена
-PRODUCT_PRICES: Dict[str, int] = {}
+def get_refresh_stats() -> MenuRefreshStats:
+    """Счётчики обновлений меню"""
+    return _refresh_stats
 
-# slug -> display name (ru)
-SLUG_TO_NAME: Dict[str, str] = {}
 
-# Маппинг индексов категорий
-CATEGORY_INDEXES: Dict[int, str] = {}
-CATEGORY_NAMES_TO_INDEX: Dict[str, int] = {}
+# Текущая версия меню. Заменяется целиком одним присваиванием в _swap_catalog()
+_catalog: Catalog = EMPTY_CATALOG
 
-# Маппинг индексов подкатегорий
-SUBCATEGORY_INDEXES: Dict[int, Dict[int, str]] = {}
-SUBCATEGORY_NAMES_TO_INDEX: Dict[int, Dict[str, int]] = {}
+# Обновления меню выполняются по одному, чтобы не применить изменения к устаревшей версии
+_refresh_lock = asyncio.Lock()
 
 
-def _get_display_name(name_obj: Any) -> str:
-    """Извлекает имя на языке LANG из объекта name Sanity"""
-    if not name_obj:
-        return ""
-    if isinstance(name_obj, str):
-        return name_obj
-    return name_obj.get(LANG) or name_obj.get("ru") or name_obj.get("en") or ""
+def get_catalog() -> Catalog:
+    """Текущий снимок меню (неизменяемый)"""
+    return _catalog
 
 
-def _to_slug(val: Any) -> str:
-    """Извлекает slug-строку из category/subcategory (может быть строка, reference или slug-объект Sanity)"""
-    if val is None:
-        return ""
-    if isinstance(val, str):
-        return val.strip()
-    if isinstance(val, dict):
-        # Sanity slug: {"_type": "slug", "current": "sets"} или reference с полем slug
-        slug = val.get("current") or val.get("slug")
-        if isinstance(slug, dict):
-            slug = slug.get("current") or slug.get("slug")
-        if isinstance(slug, str):
-            return slug.strip()
-    return ""
+def _swap_catalog(catalog: Catalog) -> None:
+    """Атомарно подменить текущий каталог"""
+    global _catalog
+    _catalog = catalog
 
 
-def _build_products_from_sanity(raw_products: List[Dict], raw_categories: List[Dict]) -> None:
+def _apply_menu(raw_products: List[Dict], raw_categories: List[Dict]) -> Optional[Catalog]:
     """
-    Строит PRODUCTS из категорий и продуктов Sanity.
-    Категории берутся из *[_type == "category"], продукты — из products.
-    Все категории из Sanity отображаются, даже без товаров.
+    Собрать новую версию каталога из ответов Sanity и подменить текущую.
+    Если ответ не изменился (совпал хэш), сборка пропускается и возвращается None.
+    Если хэш неизвестен (каталог собран из изменений), но меню совпало,
+    версия не меняется — открытые клавиатуры остаются действительными; тоже None.
     """
-    global PRODUCTS, PRODUCT_PRICES, SLUG_TO_NAME
-
-    # Сначала загружаем категории в порядке из Sanity (исключаем utensils)
-    category_slugs: List[str] = []
-    for c in raw_categories or []:
-        slug = _to_slug(c.get("slug"))
-        if slug and slug != "utensils":
-            category_slugs.append(slug)
-    hierarchy: Dict[str, Union[List, Dict]] = OrderedDict((cat, []) for cat in category_slugs)
-
-    # Обрабатываем продукты
-    for p in raw_products:
-        slug = _to_slug(p.get("slug")) or (p.get("_id") or "")
-        if not slug:
-            continue
-
-        category = _to_slug(p.get("category"))
-        subcategory = _to_slug(p.get("subcategory"))
-        price = int(p.get("price") or 0)
-        name_obj = p.get("name")
-        display_name = _get_display_name(name_obj) or slug
-
-        product = {
-            "slug": slug,
-            "name": display_name,
-            "price": price,
-        }
-        PRODUCT_PRICES[slug] = price
-        SLUG_TO_NAME[slug] = display_name
-
-        if not category:
-            continue
-        if category not in hierarchy:
-            hierarchy[category] = []  # Неизвестная категория — добавляем в конец
-
-        if subcategory:
-            if category not in hierarchy:
-                hierarchy[category] = OrderedDict()
-            subcats = hierarchy[category]
-            if not isinstance(subcats, dict):
-                # Была категория без подкатегорий — переделываем
-                existing_list = subcats if isinstance(subcats, list) else []
-                hierarchy[category] = OrderedDict()
-                hierarchy[category][""] = existing_list
-                subcats = hierarchy[category]
-            if subcategory not in subcats:
-                subcats[subcategory] = []
-            subcats[subcategory].append(product)
-        else:
-            if category not in hierarchy:
-                hierarchy[category] = []
-            subcats = hierarchy[category]
-            if isinstance(subcats, dict):
-                if "" not in subcats:
-                    subcats[""] = []
-                subcats[""].append(product)
-            else:
-                subcats.append(product)
-
-    # Нормализуем: категории только с одной пустой подкатегорией "" -> список (без подкатегорий)
-    for cat in list(hierarchy.keys()):
-        val = hierarchy[cat]
-        if isinstance(val, dict) and len(val) == 1 and "" in val:
-            hierarchy[cat] = val[""]
-
-    PRODUCTS.clear()
-    PRODUCTS.update(hierarchy)
-
-
-def _build_indexes() -> None:
-    """Построить маппинги индексов"""
-    global CATEGORY_INDEXES, CATEGORY_NAMES_TO_INDEX
-    global SUBCATEGORY_INDEXES, SUBCATEGORY_NAMES_TO_INDEX
-
-    CATEGORY_INDEXES.clear()
-    CATEGORY_NAMES_TO_INDEX.clear()
-    SUBCATEGORY_INDEXES.clear()
-    SUBCATEGORY_NAMES_TO_INDEX.clear()
-
-    for cat_idx, (category_name, category_data) in enumerate(PRODUCTS.items()):
-        CATEGORY_INDEXES[cat_idx] = category_name
-        CATEGORY_NAMES_TO_INDEX[category_name] = cat_idx
-
-        if isinstance(category_data, dict):
-            SUBCATEGORY_INDEXES[cat_idx] = {}
-            SUBCATEGORY_NAMES_TO_INDEX[cat_idx] = {}
-            for sub_idx, subcategory_name in enumerate(category_data.keys()):
-                SUBCATEGORY_INDEXES[cat_idx][sub_idx] = subcategory_name
-                SUBCATEGORY_NAMES_TO_INDEX[cat_idx][subcategory_name] = sub_idx
+    payload_hash = hash_payload(raw_products, raw_categories)
+    if payload_hash == _catalog.content_hash:
+        _refresh_stats.record_skip()
+        return None
+    started = time.perf_counter()
+    catalog = build_catalog(
+        raw_products,
+        raw_categories,
+        version=_catalog.version + 1,
+        content_hash=payload_hash,
+        previous=_catalog,
+    )
+    if catalog.same_menu(_catalog):
+        _refresh_stats.record_skip()
+        _swap_catalog(_catalog._replace(content_hash=payload_hash, watermark=catalog.watermark))
+        return None
+    _refresh_stats.record_build(started, delta=False)
+    _swap_catalog(catalog)
+    return catalog
+
+
+_UNCHANGED_MESSAGE = "✅ Меню актуально, изменений нет."
+
+
+def _menu_summary(catalog: Catalog) -> str:
+    """Сообщение об успешном обновлении меню"""
+    return (
+        f"✅ Меню обновлено. Загружено {len(catalog.categories)} категорий, "
+        f"{catalog.product_count()} товаров."
+    )
+
+
+def _snapshot_bytes(catalog: Catalog) -> bytes:
+    """Сериализовать каталог в компактный JSON"""
+    payload = catalog.to_dict()
+    payload["format"] = SNAPSHOT_FORMAT
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _write_snapshot(data: bytes) -> None:
+    """Атомарно записать снимок меню на диск"""
+    if not MENU_SNAPSHOT_PATH:
+        return
+    tmp_path = f"{MENU_SNAPSHOT_PATH}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, MENU_SNAPSHOT_PATH)
+    except OSError as e:
+        logger.error("Не удалось сохранить снимок меню: %s", e)
+
+
+def _load_snapshot() -> bool:
+    """
+    Загрузить меню из локального снимка.
+    В снимке хранятся документы товаров и порядок категорий,
+    иерархия и индексы восстанавливаются при загрузке.
+    Версия каталога продолжается с сохранённой.
+    Возвращает True, если снимок прочитан.
+    """
+    if not MENU_SNAPSHOT_PATH or not os.path.exists(MENU_SNAPSHOT_PATH):
+        return False
+    try:
+        with open(MENU_SNAPSHOT_PATH, "rb") as f:
+            payload = json.loads(f.read(), object_pairs_hook=OrderedDict)
+        if payload.get("format") != SNAPSHOT_FORMAT:
+            logger.warning("Снимок меню устаревшего формата, пропускаем")
+            return False
+        catalog = catalog_from_dict(payload)
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.error("Не удалось прочитать снимок меню: %s", e)
+        return False
+
+    _swap_catalog(catalog)
+    return True
 
 
 def _load_from_sanity() -> None:
     """Загружает данные из Sanity и строит индексы"""
-    raw_categories = fetch_categories()
-    raw_products = fetch_products()
-    _build_products_from_sanity(raw_products, raw_categories)
-    _build_indexes()
+    raw_categories, raw_products = fetch_menu()
+    if not raw_categories and not raw_products:
+        logger.error("Sanity вернул пустое меню")
+        return
+    catalog = _apply_menu(raw_products, raw_categories)
+    if catalog is not None:
+        _write_snapshot(_snapshot_bytes(catalog))
+
+
+# Инициализация при импорте: сначала снимок с диска, без него — синхронно из Sanity
+_loaded_from_snapshot = _load_snapshot()
+if not _loaded_from_snapshot:
+    _load_from_sanity()
 
 
-# Инициализация при импорте
-_load_from_sanity()
+async def _save_snapshot(catalog: Catalog) -> None:
+    """Сохранить снимок каталога, не блокируя event loop"""
+    snapshot = _snapshot_bytes(catalog)
+    await asyncio.to_thread(_write_snapshot, snapshot)
 
 
-def refresh_menu() -> tuple[bool, str]:
+async def _refresh_menu_full() -> tuple[bool, str]:
+    """Полная загрузка меню из Sanity"""
+    raw_categories, raw_products = await fetch_menu_async()
+    if not raw_categories and not raw_products:
+        _refresh_stats.failed += 1
+        return False, "❌ Sanity не вернул данные, меню не изменено"
+    catalog = _apply_menu(raw_products, raw_categories)
+    if catalog is None:
+        return True, _UNCHANGED_MESSAGE
+    await _save_snapshot(catalog)
+    return True, _menu_summary(catalog)
+
+
+async def _refresh_menu_delta() -> Optional[tuple[bool, str]]:
+    """
+    Инкрементальное обновление: загружаются только документы,
+    изменённые после отметки текущего каталога, и список _id для поиска удалённых.
+    Возвращает None, если нужна полная пересборка.
     """
-    Обновить меню из Sanity CMS.
+    current = _catalog
+    delta = await fetch_menu_delta_async(current.watermark)
+    if delta is None:
+        return None
+    started = time.perf_counter()
+    catalog = apply_delta(current, delta, version=current.version + 1)
+    if catalog is None:
+        logger.info("Изменения меню нельзя применить инкрементально, выполняем полную загрузку")
+        return None
+    if catalog is current:
+        _refresh_stats.record_skip()
+        return True, _UNCHANGED_MESSAGE
+    _refresh_stats.record_build(started, delta=True)
+    _swap_catalog(catalog)
+    await _save_snapshot(catalog)
+    return True, _menu_summary(catalog)
+
+
+async def refresh_menu_async(full: bool = False) -> tuple[bool, str]:
+    """
+    Обновить меню из Sanity CMS, не блокируя event loop.
+    По умолчанию применяются только изменения с последней синхронизации;
+    full=True (или отсутствие отметки) — полная загрузка.
+    Новая версия каталога собирается отдельно и подменяет текущую одним присваиванием.
     Возвращает (success, message) — успех и сообщение для пользователя.
     """
-    try:
-        raw_categories = fetch_categories()
-        raw_products = fetch_products()
-        _build_products_from_sanity(raw_products, raw_categories)
-        _build_indexes()
-        total = sum(
-            len(v) if isinstance(v, list) else sum(len(sub) for sub in v.values())
-            for v in PRODUCTS.values()
-        )
-        return True, f"✅ Меню обновлено. Загружено {len(PRODUCTS)} категорий, {total} товаров."
-    except Exception as e:
-        return False, f"❌ Ошибка обновления меню: {e}"
+    async with _refresh_lock:
+        try:
+            if not full and _catalog.watermark:
+                result = await _refresh_menu_delta()
+                if result is not None:
+                    return result
+            return await _refresh_menu_full()
+        except Exception as e:
+            _refresh_stats.failed += 1
+            return False, f"❌ Ошибка обновления меню: {e}"
+
+
+async def revalidate_menu() -> None:
+    """Фоновая сверка меню, загруженного из снимка, с Sanity"""
+    if not _loaded_from_snapshot:
+        return
+    success, text = await refresh_menu_async()
+    if success:
+        logger.info("Меню из снимка сверено с Sanity: %s", text)
+    else:
+        logger.warning("Не удалось сверить меню с Sanity, работаем по снимку: %s", text)
+
+
+async def run_menu_refresher(interval: float) -> None:
+    """
+    Фоновое обновление меню раз в interval секунд.
+    Неизменившееся меню не пересобирается (см. _apply_menu и apply_delta).
+    """
+    while True:
+        await asyncio.sleep(interval)
+        success, text = await refresh_menu_async()
+        if not success:
+            logger.warning("Фоновое обновление меню не удалось: %s", text)
+        elif text != _UNCHANGED_MESSAGE:
+            logger.info("Фоновое обновление меню: %s", text)
 
 
 def get_categories() -> List[str]:
     """Возвращает список всех категорий"""
-    return list(PRODUCTS.keys())
+    return list(_catalog.categories)
 
 
 def get_category_index(category_name: str) -> int:
     """Возвращает индекс категории"""
-    return CATEGORY_NAMES_TO_INDEX.get(category_name, -1)
+    return _catalog.category_indexes.get(category_name, -1)
 
 
 def get_category_name(category_index: int) -> str:
     """Возвращает название категории по индексу"""
-    return CATEGORY_INDEXES.get(category_index, "")
+    return _catalog.get_category_name(category_index)
 
 
 def has_subcategories(category: str) -> bool:
     """Проверяет, имеет ли категория подкатегории"""
-    category_data = PRODUCTS.get(category)
-    return isinstance(category_data, dict)
+    return _catalog.has_subcategories(category)
 
 
 def get_subcategories(category: str) -> List[str]:
     """Возвращает список подкатегорий (включая пустую '' для товаров без подкатегории)"""
-    category_data = PRODUCTS.get(category)
-    if isinstance(category_data, dict):
-        return list(category_data.keys())
-    return []
+    return _catalog.get_subcategories(category)
 
 
 def get_subcategory_index(category_index: int, subcategory_name: str) -> int:
     """Возвращает индекс подкатегории"""
-    return SUBCATEGORY_NAMES_TO_INDEX.get(category_index, {}).get(subcategory_name, -1)
+    return _catalog.subcategory_indexes.get(category_index, {}).get(subcategory_name, -1)
 
 
 def get_subcategory_name(category_index: int, subcategory_index: int) -> str:
     """Возвращает название подкатегории"""
-    return SUBCATEGORY_INDEXES.get(category_index, {}).get(subcategory_index, "")
+    return _catalog.get_subcategory_name(category_index, subcategory_index)
 
 
 def get_category_display_name(category_slug: str) -> str:
@@ -281,37 +378,36 @@ def get_subcategory_display_name(category: str, subcategory: str) -> str:
     return _menu_label(subcategory)
 
 
-def get_products_by_category(category: str) -> List[Dict]:
+def get_products_by_category(category: str) -> Sequence[Mapping]:
     """Товары категории без подкатегорий"""
-    category_data = PRODUCTS.get(category)
-    if isinstance(category_data, list):
-        return category_data
-    return []
+    return _catalog.get_products(category)
 
 
-def get_products_by_subcategory(category: str, subcategory: str) -> List[Dict]:
+def get_products_by_subcategory(category: str, subcategory: str) -> Sequence[Mapping]:
     """Товары подкатегории"""
-    category_data = PRODUCTS.get(category)
-    if isinstance(category_data, dict):
-        return category_data.get(subcategory, [])
-    return []
+    return _catalog.get_products(category, subcategory)
+
+
+def get_product_by_id(product_id: int) -> Optional[Mapping]:
+    """Товар по стабильному числовому ID (None — товара нет в текущем меню)"""
+    return _catalog.by_id.get(product_id)
 
 
 def get_product_price(product_slug: str) -> int:
     """Цена товара по slug"""
-    return PRODUCT_PRICES.get(product_slug, 0)
+    return _catalog.prices.get(product_slug, 0)
 
 
-def get_product_name(product: Dict) -> str:
+def get_product_name(product: Mapping) -> str:
     """Display name товара из словаря"""
     return product.get("name", "")
 
 
 def get_product_name_by_slug(slug: str) -> str:
     """Display name по slug (для корзины/заказов)"""
-    return SLUG_TO_NAME.get(slug, slug)
+    return _catalog.names.get(slug, slug)
 
 
-def get_product_slug(product: Dict) -> str:
+def get_product_slug(product: Mapping) -> str:
     """Slug товара из словаря"""
     return product.get("slug", "")
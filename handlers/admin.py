@@ -2,11 +2,24 @@
 """
 Обработчики команд администратора
 """
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from config import ADMIN_IDS
-from data import refresh_menu
-from services.order import order_service
+from aiogram.types import (
+    Message, CallbackQuery, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton,
+)
+from callbacks import Callback, CallbackPayload, ORDER_DETAIL, ORDER_STATUS, ORDERS_PAGE, pack
+from config import ADMIN_IDS, STATS_TOP_N
+from data import get_catalog, get_refresh_stats, refresh_menu_async
+from services.analytics import PeriodStats, sales_analytics
+from services.cart import cart_service
+from services.notifier import admin_notifier
+from services.order import ORDER_STATUSES, ORDER_TRANSITIONS, OrdersPage, order_service
+from services.order_export import EXPORT_FORMATS, export_orders
 
 router = Router()
 
@@ -16,89 +29,303 @@ def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
 
-def _create_orders_keyboard(orders: list) -> InlineKeyboardMarkup:
-    """Создать клавиатуру со списком заказов"""
+# Направления листания /orders в callback_data
+_OLDER, _NEWER = 0, 1
+
+# Кнопки смены статуса: новый статус -> текст кнопки
+_STATUS_BUTTONS = {
+    'processing': "⏳ В обработку",
+    'completed': "✅ Завершить",
+    'cancelled': "❌ Отменить",
+}
+
+
+def _encode_filter(status: Optional[str]) -> int:
+    """Фильтр списка заказов для callback_data: 0 — все, иначе индекс статуса + 1"""
+    return 0 if status is None else ORDER_STATUSES.index(status) + 1
+
+
+def _decode_filter(payload: CallbackPayload, arity: int) -> Optional[str]:
+    """Фильтр из callback_data; кнопки без фильтра (старого формата) — все заказы"""
+    if len(payload.args) <= arity:
+        return None
+    value = payload.args[arity]
+    return ORDER_STATUSES[value - 1] if 0 < value <= len(ORDER_STATUSES) else None
+
+
+def _create_orders_keyboard(page: OrdersPage, status: Optional[str] = None) -> InlineKeyboardMarkup:
+    """Создать клавиатуру со страницей заказов и кнопками листания"""
+    status_filter = _encode_filter(status)
     keyboard_buttons = []
-    for order in orders[:10]:  # Показываем первые 10 заказов
+    for order in page.orders:
         status_emoji = order_service.get_status_emoji(order['status'])
         keyboard_buttons.append([InlineKeyboardButton(
             text=f"{status_emoji} Заказ #{order['order_id']} - {order['total_sum']}₽",
-            callback_data=f"order_detail_{order['order_id']}"
+            callback_data=pack(ORDER_DETAIL, order['order_id'], status_filter)
         )])
+    
+    # Курсоры — крайние order_id страницы
+    nav_row = []
+    if page.has_newer:
+        nav_row.append(InlineKeyboardButton(
+            text="◀️ Новее",
+            callback_data=pack(ORDERS_PAGE, _NEWER, page.orders[0]['order_id'], status_filter)
+        ))
+    if page.has_older:
+        nav_row.append(InlineKeyboardButton(
+            text="Старее ▶️",
+            callback_data=pack(ORDERS_PAGE, _OLDER, page.orders[-1]['order_id'], status_filter)
+        ))
+    if nav_row:
+        keyboard_buttons.append(nav_row)
     return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
 
-def _create_order_status_keyboard(order_id: int, status: str) -> InlineKeyboardMarkup:
-    """Создать клавиатуру для управления статусом заказа"""
+async def _orders_page_view(
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    status: Optional[str] = None,
+) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Текст и клавиатура страницы заказов (без клавиатуры — заказов нет)"""
+    page = await order_service.get_orders_page(before=before, after=after, status=status)
+    if not page.orders:
+        if status is not None:
+            return f"📭 Заказов в статусе {status} нет", None
+        return "📭 Заказов пока нет", None
+    total = order_service.count_orders(status)
+    text = order_service.format_orders_list(page.orders, total, status)
+    return text, _create_orders_keyboard(page, status)
+
+
+def _create_order_status_keyboard(
+    order_id: int,
+    status: str,
+    list_status: Optional[str] = None,
+) -> InlineKeyboardMarkup:
+    """Создать клавиатуру для управления статусом заказа (list_status — фильтр списка)"""
     keyboard_buttons = []
+    status_filter = _encode_filter(list_status)
     
-    if status == 'new':
+    # Только разрешённые переходы из текущего статуса
+    for new_status in ORDER_TRANSITIONS.get(status, ()):
         keyboard_buttons.append([InlineKeyboardButton(
-            text="⏳ В обработку",
-            callback_data=f"order_status_{order_id}_processing"
-        )])
-    
-    if status in ['new', 'processing']:
-        keyboard_buttons.append([InlineKeyboardButton(
-            text="✅ Завершить",
-            callback_data=f"order_status_{order_id}_completed"
-        )])
-        keyboard_buttons.append([InlineKeyboardButton(
-            text="❌ Отменить",
-            callback_data=f"order_status_{order_id}_cancelled"
+            text=_STATUS_BUTTONS[new_status],
+            callback_data=pack(
+                ORDER_STATUS, order_id, ORDER_STATUSES.index(new_status), status_filter
+            )
         )])
     
+    # Возврат на страницу, которая начинается с этого заказа
     keyboard_buttons.append([InlineKeyboardButton(
         text="◀️ Назад к списку",
-        callback_data="back_to_orders"
+        callback_data=pack(ORDERS_PAGE, _OLDER, order_id + 1, status_filter)
     )])
     
     return InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
 
-@router.message(F.text == "/refresh")
+@router.message(F.text.in_({"/refresh", "/refresh full"}))
 async def cmd_refresh(message: Message):
-    """Обновить меню из Sanity (только для администратора)"""
+    """
+    Обновить меню из Sanity (только для администратора)
+    /refresh — только изменения, /refresh full — полная загрузка
+    """
     if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет доступа к этой команде")
         return
 
     await message.answer("⏳ Загружаю меню из Sanity...")
-    _, text = refresh_menu()
+    _, text = await refresh_menu_async(full=message.text.endswith("full"))
     await message.answer(text)
 
 
-@router.message(F.text == "/orders")
+def _format_status() -> str:
+    """Текст сводки о состоянии бота для /status"""
+    catalog = get_catalog()
+    stats = get_refresh_stats()
+    cart_stats = cart_service.stats
+    last_refresh = (
+        stats.last_refresh_at.strftime('%d.%m.%Y %H:%M:%S') if stats.last_refresh_at else "—"
+    )
+    lines = [
+        "📊 Меню:",
+        f"   Версия каталога: {catalog.version}",
+        f"   Категорий: {len(catalog.categories)}, товаров: {catalog.product_count()}",
+        f"   Обновлений: {stats.refreshes} (полных: {stats.full_builds}, по изменениям: {stats.delta_builds})",
+        f"   Без изменений: {stats.skipped}, ошибок: {stats.failed}",
+        f"   Сборка: последняя {stats.last_build_ms:.1f} мс, средняя {stats.avg_build_ms:.1f} мс",
+        f"   Последнее обновление: {last_refresh}",
+        "",
+        "🛒 Корзины в памяти:",
+        f"   Корзин: {cart_service.resident_count()}, пользователей: {cart_service.tracked_count()}",
+        f"   Вытеснено: по времени {cart_stats.evicted_idle}, по лимиту {cart_stats.evicted_cap}",
+        f"   Загружено из хранилища: {cart_stats.restored}",
+        "",
+        f"📋 Заказы: {order_service.count_orders()}",
+    ]
+    counts = order_service.get_status_counts()
+    lines.extend(
+        f"   {order_service.get_status_emoji(status)} {status}: {counts.get(status, 0)}"
+        for status in ORDER_STATUSES
+    )
+    return "\n".join(lines)
+
+
+@router.message(F.text == "/status")
+async def cmd_status(message: Message):
+    """Показать состояние меню и счётчики обновлений (только для администратора)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде")
+        return
+
+    await message.answer(_format_status())
+
+
+def _format_period(title: str, stats: PeriodStats) -> List[str]:
+    """Строки /stats за один период"""
+    lines = [
+        title,
+        f"   Выручка: {stats.revenue} TL, заказов: {stats.orders}, средний чек: {stats.average:.0f} TL",
+    ]
+    for place, (name, quantity) in enumerate(stats.top, 1):
+        lines.append(f"   {place}. {name} — {quantity} шт.")
+    return lines
+
+
+def _format_stats() -> str:
+    """Текст /stats: выручка, заказы и топ блюд (без отменённых заказов)"""
+    summary = sales_analytics.summary(STATS_TOP_N)
+    last_day = sales_analytics.last_hours(24)
+    lines = ["📈 Продажи (без отменённых заказов)", ""]
+    lines += _format_period("📅 Сегодня:", summary['today'])
+    lines.append(f"   За последние 24 часа: {last_day.revenue} TL, заказов: {last_day.orders}")
+    lines.append("")
+    lines += _format_period("🗓 Эта неделя:", summary['week'])
+    lines.append("")
+    lines += _format_period("📆 Этот месяц:", summary['month'])
+    return "\n".join(lines)
+
+
+@router.message(F.text == "/stats")
+async def cmd_stats(message: Message):
+    """Показать выручку, количество заказов и топ блюд (только для администратора)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде")
+        return
+
+    await message.answer(_format_stats())
+
+
+@router.message(F.text.regexp(r"^/orders(\s|$)"))
 async def cmd_orders(message: Message):
-    """Показать все заказы (только для администратора)"""
+    """
+    Показать заказы (только для администратора)
+    /orders — все, /orders new|processing|completed|cancelled — только в этом статусе
+    """
     if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет доступа к этой команде")
         return
     
-    # Получаем все заказы
-    orders = order_service.get_all_orders()
+    args = message.text.split()[1:]
+    status = args[0].lower() if args else None
+    if len(args) > 1 or (status is not None and status not in ORDER_STATUSES):
+        await message.answer("Использование: /orders [" + "|".join(ORDER_STATUSES) + "]")
+        return
     
-    if not orders:
-        await message.answer("📭 Заказов пока нет")
+    # Первая страница: самые новые заказы
+    text, keyboard = await _orders_page_view(status=status)
+    await message.answer(text, reply_markup=keyboard)
+
+
+# Ограничение Telegram на размер файла, отправляемого ботом
+_MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+_EXPORT_USAGE = (
+    "Использование: /export [csv|jsonl] [статус] [ДД.ММ.ГГГГ [ДД.ММ.ГГГГ]]\n"
+    "Даты — начало и конец периода включительно, одна дата — с этого дня по сегодня\n"
+    "Например: /export csv completed 01.01.2025 31.03.2025"
+)
+
+
+def _parse_export_args(
+    args: List[str],
+) -> Optional[Tuple[str, Optional[str], Optional[datetime], Optional[datetime]]]:
+    """
+    Аргументы /export -> (формат, статус, начало, конец) или None при ошибке
+    Даты включительно: конец периода — начало дня после второй даты
+    """
+    fmt, status, dates = 'csv', None, []
+    for arg in args:
+        arg = arg.lower()
+        if arg in EXPORT_FORMATS:
+            fmt = arg
+        elif arg in ORDER_STATUSES:
+            status = arg
+        else:
+            try:
+                dates.append(datetime.strptime(arg, '%d.%m.%Y'))
+            except ValueError:
+                return None
+    if len(dates) > 2:
+        return None
+    # Одна дата — с этого дня по сегодня
+    start = dates[0] if dates else None
+    end = dates[1] + timedelta(days=1) if len(dates) == 2 else None
+    return fmt, status, start, end
+
+
+@router.message(F.text.regexp(r"^/export(\s|$)"))
+async def cmd_export(message: Message):
+    """
+    Выгрузить заказы файлом CSV или JSONL (только для администратора)
+    /export [csv|jsonl] [статус] [ДД.ММ.ГГГГ [ДД.ММ.ГГГГ]]
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде")
         return
     
-    # Форматируем список заказов
-    text = order_service.format_orders_list(orders)
-    keyboard = _create_orders_keyboard(orders)
+    parsed = _parse_export_args(message.text.split()[1:])
+    if parsed is None:
+        await message.answer(_EXPORT_USAGE)
+        return
+    fmt, status, start, end = parsed
     
-    await message.answer(text, reply_markup=keyboard)
+    await message.answer("⏳ Готовлю выгрузку заказов...")
+    fd, path = tempfile.mkstemp(prefix="orders_", suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        count = await export_orders(path, fmt, start, end, status)
+        if not count:
+            await message.answer("📭 Заказов за выбранный период нет")
+            return
+        if os.path.getsize(path) > _MAX_DOCUMENT_SIZE:
+            await message.answer("❌ Файл больше 50 МБ, выберите период короче")
+            return
+        filename = "orders"
+        if status is not None:
+            filename += f"_{status}"
+        if start is not None:
+            filename += f"_{start:%Y%m%d}"
+        if end is not None:
+            filename += f"-{end - timedelta(days=1):%Y%m%d}"
+        await message.answer_document(
+            FSInputFile(path, filename=f"{filename}.{fmt}"),
+            caption=f"📦 Заказов: {count}",
+        )
+    finally:
+        os.remove(path)
 
 
-@router.callback_query(F.data.startswith("order_detail_"))
-async def show_order_detail(callback: CallbackQuery):
+@router.callback_query(Callback(ORDER_DETAIL, 1))
+@router.callback_query(Callback(ORDER_DETAIL, 2))
+async def show_order_detail(callback: CallbackQuery, payload: CallbackPayload):
     """Показать детали конкретного заказа"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ У вас нет доступа", show_alert=True)
         return
     
-    # Извлекаем ID заказа
-    order_id = int(callback.data.replace("order_detail_", ""))
-    order = order_service.get_order(order_id)
+    order_id = payload.args[0]
+    order = await order_service.get_order(order_id)
     
     if not order:
         await callback.answer("Заказ не найден", show_alert=True)
@@ -106,62 +333,101 @@ async def show_order_detail(callback: CallbackQuery):
     
     # Форматируем детали заказа
     text = order_service.format_order_details(order)
-    keyboard = _create_order_status_keyboard(order['order_id'], order['status'])
+    keyboard = _create_order_status_keyboard(
+        order['order_id'], order['status'], _decode_filter(payload, 1)
+    )
     
     await callback.message.edit_text(text, reply_markup=keyboard)
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("order_status_"))
-async def update_order_status(callback: CallbackQuery):
+@router.callback_query(Callback(ORDER_STATUS, 2))
+@router.callback_query(Callback(ORDER_STATUS, 3))
+async def update_order_status(callback: CallbackQuery, payload: CallbackPayload):
     """Обновить статус заказа"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ У вас нет доступа", show_alert=True)
         return
     
-    # Извлекаем ID заказа и новый статус
-    parts = callback.data.replace("order_status_", "").split("_")
-    if len(parts) != 2:
+    # ID заказа и индекс нового статуса
+    order_id, status_idx = payload.args[:2]
+    list_status = _decode_filter(payload, 2)
+    if not 0 <= status_idx < len(ORDER_STATUSES):
         await callback.answer("Ошибка", show_alert=True)
         return
+    new_status = ORDER_STATUSES[status_idx]
     
-    order_id = int(parts[0])
-    new_status = parts[1]
+    # Обновляем статус; переход проверяется сервисом
+    updated = await order_service.update_order_status(order_id, new_status)
+    order = await order_service.get_order(order_id)
+    if not order:
+        await callback.answer("Заказ не найден", show_alert=True)
+        return
     
-    # Обновляем статус
-    if order_service.update_order_status(order_id, new_status):
-        order = order_service.get_order(order_id)
-        if order:
-            text = order_service.format_order_details(order)
-            text += f"\n\n✅ Статус обновлен на: {new_status}"
-            keyboard = _create_order_status_keyboard(order_id, order['status'])
-            
-            await callback.message.edit_text(text, reply_markup=keyboard)
-            await callback.answer("Статус обновлен")
-        else:
-            await callback.answer("Заказ не найден", show_alert=True)
+    text = order_service.format_order_details(order)
+    keyboard = _create_order_status_keyboard(order_id, order['status'], list_status)
+    if updated:
+        # Уведомления о заказе у всех администраторов показывают новый статус
+        await admin_notifier.update_cards(callback.bot, order_id)
+        text += f"\n\n✅ Статус обновлен на: {new_status}"
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer("Статус обновлен")
     else:
-        await callback.answer("Ошибка обновления статуса", show_alert=True)
+        # Кнопка устарела (статус уже сменили): показываем актуальную карточку
+        await callback.answer(
+            f"Нельзя сменить статус {order['status']} на {new_status}", show_alert=True
+        )
+        await callback.message.edit_text(text, reply_markup=keyboard)
 
 
-@router.callback_query(F.data == "back_to_orders")
-async def back_to_orders(callback: CallbackQuery):
-    """Вернуться к списку заказов"""
+@router.callback_query(Callback(ORDERS_PAGE, 2))
+@router.callback_query(Callback(ORDERS_PAGE, 3))
+async def orders_page(callback: CallbackQuery, payload: CallbackPayload):
+    """Листание списка заказов и возврат к нему из карточки заказа"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ У вас нет доступа", show_alert=True)
         return
     
-    # Получаем все заказы
-    orders = order_service.get_all_orders()
+    direction, cursor = payload.args[:2]
+    status = _decode_filter(payload, 2)
+    if direction == _NEWER:
+        text, keyboard = await _orders_page_view(after=cursor, status=status)
+    else:
+        text, keyboard = await _orders_page_view(before=cursor, status=status)
     
-    if not orders:
-        await callback.message.edit_text("📭 Заказов пока нет")
-        await callback.answer()
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+
+@router.callback_query(F.data.regexp(r"^order_(?:detail|status)_(\d+)").as_("match"))
+async def legacy_order_button(callback: CallbackQuery, match: re.Match):
+    """
+    Кнопки карточки заказа в старом формате (order_detail_<id>, order_status_<id>_<status>):
+    показываем актуальную карточку, статус по устаревшей кнопке не меняем
+    """
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет доступа", show_alert=True)
+        return
+    
+    order_id = int(match.group(1))
+    order = await order_service.get_order(order_id)
+    if not order:
+        await callback.answer("Заказ не найден", show_alert=True)
         return
     
-    # Форматируем список заказов
-    text = order_service.format_orders_list(orders)
-    keyboard = _create_orders_keyboard(orders)
+    text = order_service.format_order_details(order)
+    keyboard = _create_order_status_keyboard(order_id, order['status'])
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer("Кнопка устарела, карточка заказа обновлена")
+
+
+@router.callback_query(F.data == "back_to_orders")
+async def back_to_orders(callback: CallbackQuery):
+    """Вернуться к списку заказов (кнопки старого формата)"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет доступа", show_alert=True)
+        return
     
+    text, keyboard = await _orders_page_view()
     await callback.message.edit_text(text, reply_markup=keyboard)
     await callback.answer()
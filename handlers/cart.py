@@ -1,21 +1,35 @@
 # -*- coding: utf-8 -*-
 """
 Обработчики корзины
+Кнопки +/−/❌ меняют корзину сразу, а сообщение корзины обновляется
+отложенно: частые нажатия склеиваются в одну правку (services/message_editor.py)
 """
+from typing import Optional, Tuple
+
 from aiogram import Router, F
-from aiogram.types import CallbackQuery
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
+from callbacks import Callback, CallbackPayload, CART_ADD, CART_DELETE, CART_REMOVE
 from keyboards import (
     get_main_menu_keyboard,
     get_cart_keyboard,
     get_confirm_order_keyboard,
 )
 from services.cart import cart_service
+from services.message_editor import message_editor
 from states import OrderStates
 
 router = Router()
 
 
+def _render_cart(user_id: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Текст и клавиатура корзины по её текущему состоянию"""
+    lines = cart_service.get_cart_lines(user_id)
+    if not lines:
+        return "🛒 Ваша корзина пуста\n\n🍽️ Выберите категорию:", get_main_menu_keyboard()
+    return cart_service.format_cart_message(user_id), get_cart_keyboard(lines)
+
+
 @router.callback_query(F.data == "view_cart")
 async def view_cart(callback: CallbackQuery, state: FSMContext):
     """Просмотр корзины"""
@@ -30,29 +44,68 @@ async def view_cart(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Корзина пуста")
         return
     
-    # Форматируем корзину
-    text = cart_service.format_cart_message(user_id)
+    # Форматируем корзину с кнопками изменения количества
+    text, keyboard = _render_cart(user_id)
     
     await callback.message.edit_text(
         text=text,
-        reply_markup=get_cart_keyboard()
+        reply_markup=keyboard
     )
     
     await state.set_state(OrderStates.confirming_order)
     await callback.answer()
 
 
+@router.callback_query(Callback(CART_ADD, 1))
+@router.callback_query(Callback(CART_REMOVE, 1))
+@router.callback_query(Callback(CART_DELETE, 1))
+async def change_cart_line(callback: CallbackQuery, state: FSMContext, payload: CallbackPayload):
+    """Кнопки ➕ / ➖ / ❌ в корзине"""
+    user_id = callback.from_user.id
+    product_id, = payload.args
+    delta = {CART_ADD: 1, CART_REMOVE: -1, CART_DELETE: 0}[payload.action]
+    
+    if not cart_service.change_line(user_id, product_id, delta):
+        if delta > 0:
+            await callback.answer("Этого товара больше нет в меню", show_alert=True)
+        else:
+            await callback.answer("Товара уже нет в корзине")
+        return
+    
+    # Корзина уже изменена; сообщение обновится одной правкой после серии нажатий.
+    # Текст собирается сейчас, пока корзина в памяти: к отправке её могут вытеснить,
+    # а отложенная правка идёт вне middleware предзагрузки
+    text, keyboard = _render_cart(user_id)
+    message = callback.message
+    message_editor.schedule(
+        callback.bot,
+        message.chat.id,
+        message.message_id,
+        lambda: (text, keyboard),
+    )
+    if cart_service.is_empty(user_id):
+        await state.set_state(OrderStates.choosing_category)
+    else:
+        await state.set_state(OrderStates.confirming_order)
+    await callback.answer()
+
+
 @router.callback_query(F.data == "checkout")
 async def checkout(callback: CallbackQuery, state: FSMContext):
     """Оформление заказа"""
     user_id = callback.from_user.id
+    # Сообщение корзины сейчас заменится, отложенная правка больше не нужна
+    message_editor.cancel(callback.message.chat.id, callback.message.message_id)
     
     if cart_service.is_empty(user_id):
         await callback.answer("Корзина пуста", show_alert=True)
         return
     
-    # Показываем итоговый заказ
+    # Показываем итоговый заказ и строки, цена которых успела измениться
     text = cart_service.format_cart_message(user_id)
+    price_changes = cart_service.format_price_changes(user_id)
+    if price_changes:
+        text += f"\n\n{price_changes}"
     text += "\n\n✅ Подтвердите заказ:"
     
     await callback.message.edit_text(
@@ -68,6 +121,7 @@ async def checkout(callback: CallbackQuery, state: FSMContext):
 async def clear_cart(callback: CallbackQuery, state: FSMContext):
     """Очистка корзины"""
     user_id = callback.from_user.id
+    message_editor.cancel(callback.message.chat.id, callback.message.message_id)
     cart_service.clear_cart(user_id)
     
     text = "🗑️ Корзина очищена\n\n🍽️ Выберите категорию:"
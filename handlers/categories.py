@@ -2,11 +2,14 @@
 """
 Обработчики выбора категорий и товаров
 Поддерживает категории с подкатегориями
-Использует индексы в callback_data
+Использует индексы категорий и стабильные ID товаров в callback_data
+(кодек callbacks.py); кнопки от старой версии меню заменяются актуальным меню
+Длинные списки категорий, подкатегорий и товаров листаются по страницам
 """
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
+from callbacks import Callback, CallbackPayload, CATEGORY, MENU, PRODUCT, SUBCATEGORY, is_stale
 from keyboards import (
     get_main_menu_keyboard,
     get_subcategories_keyboard,
@@ -14,17 +17,13 @@ from keyboards import (
     get_after_add_product_keyboard,
 )
 from services.cart import cart_service
+from services.message_editor import message_editor
 from states import OrderStates
 from data import (
-    get_product_price,
-    has_subcategories,
-    get_subcategories,
-    get_category_name,
-    get_subcategory_name,
+    get_catalog,
+    get_product_by_id,
     get_category_display_name,
     get_subcategory_display_name,
-    get_products_by_category,
-    get_products_by_subcategory,
     get_product_name,
     get_product_slug,
 )
@@ -36,8 +35,11 @@ router = Router()
 @router.callback_query(F.data == "back_to_menu", OrderStates.choosing_category)
 @router.callback_query(F.data == "back_to_menu", OrderStates.choosing_subcategory)
 @router.callback_query(F.data == "back_to_menu", OrderStates.choosing_product)
+@router.callback_query(F.data == "back_to_menu", OrderStates.confirming_order)
 async def back_to_menu(callback: CallbackQuery, state: FSMContext):
-    """Возврат в главное меню"""
+    """Возврат в главное меню (в том числе из корзины)"""
+    # Отложенная правка корзины не должна перезаписать меню
+    message_editor.cancel(callback.message.chat.id, callback.message.message_id)
     text = "🍽️ Выберите категорию:"
     await callback.message.edit_text(
         text=text,
@@ -47,21 +49,62 @@ async def back_to_menu(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("cat_"), OrderStates.choosing_category)
-@router.callback_query(F.data.startswith("cat_"), OrderStates.choosing_product)
-async def choose_category(callback: CallbackQuery, state: FSMContext):
-    """Обработчик выбора категории"""
+async def _show_updated_menu(callback: CallbackQuery, state: FSMContext):
+    """Кнопка от старой версии меню: показываем актуальное главное меню"""
+    text = "🍽️ Выберите категорию:"
+    await callback.message.edit_text(
+        text=text,
+        reply_markup=get_main_menu_keyboard()
+    )
+    await state.set_state(OrderStates.choosing_category)
+    await callback.answer("Меню обновилось, выберите категорию заново")
+
+
+@router.callback_query(Callback(MENU, 1), OrderStates.choosing_category)
+@router.callback_query(Callback(MENU, 1), OrderStates.choosing_subcategory)
+@router.callback_query(Callback(MENU, 1), OrderStates.choosing_product)
+async def menu_page(callback: CallbackQuery, state: FSMContext, payload: CallbackPayload):
+    """Страница главного меню (листание и возврат из категории)"""
+    # Номер страницы ограничивается клавиатурой, поэтому версия не нужна
+    page, = payload.args
+    
+    text = "🍽️ Выберите категорию:"
+    await callback.message.edit_text(
+        text=text,
+        reply_markup=get_main_menu_keyboard(page=page)
+    )
+    await state.set_state(OrderStates.choosing_category)
+    await callback.answer()
+
+
+@router.callback_query(F.data.regexp(r"^(cat|sub|prod|menu)_"))
+async def legacy_menu_button(callback: CallbackQuery, state: FSMContext):
+    """Кнопка меню в старом формате callback_data (до перехода на кодек)"""
+    await _show_updated_menu(callback, state)
+
+
+@router.callback_query(F.data == "noop")
+async def noop(callback: CallbackQuery):
+    """Кнопка с номером страницы ничего не делает"""
+    await callback.answer()
+
+
+@router.callback_query(Callback(CATEGORY, 2), OrderStates.choosing_category)
+@router.callback_query(Callback(CATEGORY, 2), OrderStates.choosing_subcategory)
+@router.callback_query(Callback(CATEGORY, 2), OrderStates.choosing_product)
+async def choose_category(callback: CallbackQuery, state: FSMContext, payload: CallbackPayload):
+    """Обработчик выбора категории и листания её страниц"""
     try:
-        # Извлекаем индекс категории из callback_data
-        # Формат: cat_0, cat_1, etc.
-        cat_idx_str = callback.data.replace("cat_", "")
-        try:
-            cat_idx = int(cat_idx_str)
-        except ValueError:
-            await callback.answer("Ошибка: неверный формат категории", show_alert=True)
+        # Индекс категории и номер страницы
+        cat_idx, page = payload.args
+        
+        # Все обращения к меню в обработчике идут к одному снимку каталога
+        catalog = get_catalog()
+        # Индексы относятся к версии меню, для которой построена клавиатура
+        if is_stale(payload, catalog.version):
+            await _show_updated_menu(callback, state)
             return
-        
-        category = get_category_name(cat_idx)
+        category = catalog.get_category_name(cat_idx)
         if not category:
             await callback.answer("Ошибка: категория не найдена", show_alert=True)
             return
@@ -76,16 +119,16 @@ async def choose_category(callback: CallbackQuery, state: FSMContext):
         )
         
         # Проверяем, есть ли у категории подкатегории
-        if has_subcategories(category):
+        if catalog.has_subcategories(category):
             # Показываем подкатегории
-            subcategories = get_subcategories(category)
+            subcategories = catalog.get_subcategories(category)
             if not subcategories:
                 await callback.answer("Ошибка: подкатегории не найдены", show_alert=True)
                 return
             
             cat_display = get_category_display_name(category)
             text = f"📋 {cat_display}:\n\nВыберите подкатегорию:"
-            keyboard = get_subcategories_keyboard(category)
+            keyboard = get_subcategories_keyboard(category, catalog=catalog, page=page)
             await callback.message.edit_text(
                 text=text,
                 reply_markup=keyboard
@@ -95,7 +138,7 @@ async def choose_category(callback: CallbackQuery, state: FSMContext):
             # Показываем товары категории напрямую
             cat_display = get_category_display_name(category)
             text = f"📋 {cat_display}:\n\nВыберите товар:"
-            keyboard = get_products_keyboard(category)
+            keyboard = get_products_keyboard(category, catalog=catalog, page=page)
             await callback.message.edit_text(
                 text=text,
                 reply_markup=keyboard
@@ -109,30 +152,26 @@ async def choose_category(callback: CallbackQuery, state: FSMContext):
         await callback.answer(f"Ошибка: {str(e)}", show_alert=True)
 
 
-@router.callback_query(F.data.startswith("sub_"), OrderStates.choosing_subcategory)
-async def choose_subcategory(callback: CallbackQuery, state: FSMContext):
-    """Обработчик выбора подкатегории"""
+@router.callback_query(Callback(SUBCATEGORY, 3), OrderStates.choosing_subcategory)
+@router.callback_query(Callback(SUBCATEGORY, 3), OrderStates.choosing_product)
+async def choose_subcategory(callback: CallbackQuery, state: FSMContext, payload: CallbackPayload):
+    """Обработчик выбора подкатегории и листания её товаров"""
     try:
-        # Извлекаем индексы категории и подкатегории из callback_data
-        # Формат: sub_0_1 (cat_idx_sub_idx)
-        parts = callback.data.replace("sub_", "").split("_")
-        if len(parts) != 2:
-            await callback.answer("Ошибка при выборе подкатегории", show_alert=True)
-            return
+        # Индексы категории, подкатегории и номер страницы
+        cat_idx, sub_idx, page = payload.args
         
-        try:
-            cat_idx = int(parts[0])
-            sub_idx = int(parts[1])
-        except ValueError:
-            await callback.answer("Ошибка: неверный формат подкатегории", show_alert=True)
+        catalog = get_catalog()
+        if is_stale(payload, catalog.version):
+            await _show_updated_menu(callback, state)
             return
+        category = catalog.get_category_name(cat_idx)
+        subcategories = catalog.subcategories.get(cat_idx, ())
         
-        category = get_category_name(cat_idx)
-        subcategory = get_subcategory_name(cat_idx, sub_idx)
-        
-        if not category or not subcategory:
+        # Пустая подкатегория '' ("Прочее") допустима, поэтому проверяем индекс
+        if not category or not 0 <= sub_idx < len(subcategories):
             await callback.answer("Ошибка: подкатегория не найдена", show_alert=True)
             return
+        subcategory = subcategories[sub_idx]
         
         # Сохраняем выбранную подкатегорию в состояние
         await state.update_data(
@@ -148,7 +187,7 @@ async def choose_subcategory(callback: CallbackQuery, state: FSMContext):
         text = f"📋 {cat_display} - {sub_display}:\n\nВыберите товар:"
         await callback.message.edit_text(
             text=text,
-            reply_markup=get_products_keyboard(category, subcategory)
+            reply_markup=get_products_keyboard(category, subcategory, catalog=catalog, page=page)
         )
         
         await state.set_state(OrderStates.choosing_product)
@@ -159,73 +198,18 @@ async def choose_subcategory(callback: CallbackQuery, state: FSMContext):
         await callback.answer(f"Ошибка: {str(e)}", show_alert=True)
 
 
-@router.callback_query(F.data.startswith("prod_"), OrderStates.choosing_product)
-async def choose_product(callback: CallbackQuery, state: FSMContext):
+@router.callback_query(Callback(PRODUCT, 1), OrderStates.choosing_product)
+async def choose_product(callback: CallbackQuery, state: FSMContext, payload: CallbackPayload):
     """Обработчик выбора товара"""
     try:
-        # Получаем данные из состояния
-        state_data = await state.get_data()
-        category = state_data.get("category")
-        subcategory = state_data.get("subcategory")
-        cat_idx = state_data.get("category_index")
-        
-        if not category or cat_idx is None:
-            await callback.answer("Ошибка: категория не выбрана", show_alert=True)
-            return
-        
-        # Извлекаем информацию о товаре из callback_data
-        # Формат с подкатегорией: prod_0_1_2 (cat_idx_sub_idx_prod_idx)
-        # Формат без подкатегории: prod_0_2 (cat_idx_prod_idx)
-        parts = callback.data.replace("prod_", "").split("_")
-        
-        if len(parts) < 2:
-            await callback.answer("Ошибка при выборе товара", show_alert=True)
-            return
+        # Стабильный ID товара в каталоге: кнопка верна и после обновления меню
+        product_id, = payload.args
         
-        try:
-            # Определяем наличие подкатегории по количеству частей в callback_data
-            # Если 3 части - есть подкатегория, если 2 - нет подкатегории
-            if len(parts) == 3:
-                # Есть подкатегория: prod_cat_idx_sub_idx_prod_idx
-                cat_idx_from_callback = int(parts[0])
-                sub_idx = int(parts[1])
-                prod_idx = int(parts[2])
-                
-                # Проверяем, что индекс категории совпадает
-                if cat_idx_from_callback != cat_idx:
-                    await callback.answer("Ошибка: несоответствие категории", show_alert=True)
-                    return
-                
-                # Получаем название подкатегории по индексу
-                subcategory_name = get_subcategory_name(cat_idx, sub_idx)
-                if not subcategory_name:
-                    await callback.answer("Ошибка: подкатегория не найдена", show_alert=True)
-                    return
-                
-                products = get_products_by_subcategory(category, subcategory_name)
-            elif len(parts) == 2:
-                # Нет подкатегории: prod_cat_idx_prod_idx
-                cat_idx_from_callback = int(parts[0])
-                prod_idx = int(parts[1])
-                
-                # Проверяем, что индекс категории совпадает
-                if cat_idx_from_callback != cat_idx:
-                    await callback.answer("Ошибка: несоответствие категории", show_alert=True)
-                    return
-                
-                products = get_products_by_category(category)
-            else:
-                await callback.answer("Ошибка: неверный формат товара", show_alert=True)
-                return
-        except ValueError as e:
-            await callback.answer(f"Ошибка: неверный формат товара ({str(e)})", show_alert=True)
-            return
-        
-        if prod_idx < 0 or prod_idx >= len(products):
+        product = get_product_by_id(product_id)
+        if product is None:
             await callback.answer("Ошибка: товар не найден", show_alert=True)
             return
         
-        product = products[prod_idx]
         product_name = get_product_name(product)
         product_slug = get_product_slug(product)
         
@@ -233,14 +217,11 @@ async def choose_product(callback: CallbackQuery, state: FSMContext):
         user_id = callback.from_user.id
         cart_service.add_product(user_id, product_slug)
         
-        # Получаем цену товара
-        price = get_product_price(product_slug)
-        
         # Показываем сообщение об успешном добавлении
         text = (
             f"✅ Товар добавлен в корзину!\n\n"
             f"📦 {product_name}\n"
-            f"💰 Цена: {price} TL"
+            f"💰 Цена: {product['price']} TL"
         )
         
         await callback.message.edit_text(
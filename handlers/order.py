@@ -7,6 +7,7 @@ from aiogram.types import CallbackQuery, Message, ReplyKeyboardMarkup, KeyboardB
 from aiogram.fsm.context import FSMContext
 from keyboards import get_contact_keyboard, get_main_menu_keyboard
 from services.cart import cart_service
+from services.notifier import admin_notifier
 from services.order import order_service
 from states import OrderStates
 from config import ADMIN_IDS
@@ -25,6 +26,9 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext):
     
     # Показываем итоговый заказ и запрашиваем контакт
     text = cart_service.format_cart_message(user_id)
+    price_changes = cart_service.format_price_changes(user_id)
+    if price_changes:
+        text += f"\n\n{price_changes}"
     text += "\n\n📱 Для оформления заказа отправьте ваш контакт:"
     
     await callback.message.edit_text(
@@ -32,6 +36,8 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext):
         reply_markup=get_contact_keyboard()
     )
     
+    # Токен попытки оформления: повторные сообщения с контактом дадут тот же заказ
+    await state.update_data(checkout_token=order_service.new_checkout_token())
     await state.set_state(OrderStates.waiting_for_contact)
     await callback.answer()
 
@@ -67,37 +73,39 @@ async def _process_order_completion(message: Message, state: FSMContext, phone:
     username = message.from_user.username
     first_name = message.from_user.first_name
     
-    # Создаем заказ в системе
-    order_id = order_service.create_order(
-        user_id=user_id,
-        username=username,
-        first_name=first_name,
-        phone=phone or "Не указан",
-    )
+    # Состояние без токена (подтверждено до обновления бота) — новая попытка
+    data = await state.get_data()
+    checkout_token = data.get("checkout_token") or order_service.new_checkout_token()
     
-    # Формируем заказ для администратора
-    order_text = order_service.format_order_for_admin(
+    # Создаем заказ в системе и очищаем корзину; уведомления администраторам
+    # сохраняются вместе с заказом. Повторные сообщения этой попытки возвращают тот же заказ
+    order_id, created = await order_service.create_order(
         user_id=user_id,
         username=username,
         first_name=first_name,
         phone=phone or "Не указан",
+        checkout_token=checkout_token,
+        notify=ADMIN_IDS,
     )
-    order_text += f"\n\n🆔 ID заказа: #{order_id}"
+    if order_id is None:
+        # Корзина пуста, а заказа этой попытки нет
+        await message.answer(
+            text="🛒 Ваша корзина пуста\n\n🍽️ Выберите категорию:",
+            reply_markup=get_main_menu_keyboard()
+        )
+        await state.set_state(OrderStates.choosing_category)
+        return
     
-    # Отправляем заказ всем администраторам
-    if ADMIN_IDS:
-        for admin_id in ADMIN_IDS:
-            try:
-                await message.bot.send_message(chat_id=admin_id, text=order_text)
-            except Exception as e:
-                print(f"Ошибка отправки заказа администратору {admin_id}: {e}")
-    
-    # Очищаем корзину
-    cart_service.clear_cart(user_id)
+    if created:
+        # Уведомления отправляются в фоне, ответ клиенту их не ждёт
+        admin_notifier.wake()
+        text = f"✅ Заказ #{order_id} принят! Мы свяжемся с вами в ближайшее время."
+    else:
+        text = f"✅ Заказ #{order_id} уже принят, повторно оформлять не нужно."
     
     # Убираем клавиатуру и показываем сообщение
     await message.answer(
-        text="✅ Заказ принят! Мы свяжемся с вами в ближайшее время.",
+        text=text,
         reply_markup=ReplyKeyboardRemove()
     )
     
@@ -3,37 +3,140 @@
 Клавиатуры для бота
 Все кнопки через InlineKeyboard
 Поддерживает категории с подкатегориями
-Использует индексы в callback_data для экономии места
+Использует индексы категорий и ID товаров в callback_data для экономии места
+(формат задаёт callbacks.py, кнопки меню помечены версией каталога)
+Клавиатуры меню разбиты на страницы; каждая страница строится по одному
+снимку каталога при первом показе и кэшируется для его версии;
+статические клавиатуры создаются один раз
 """
+from functools import lru_cache
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+import callbacks
+from config import MENU_PAGE_SIZE, PRODUCTS_PAGE_SIZE
 from data import (
-    get_categories,
-    get_products_by_category,
-    get_subcategories,
-    get_products_by_subcategory,
+    get_catalog,
     get_product_name,
-    has_subcategories,
-    get_category_index,
-    get_subcategory_index,
     get_subcategory_display_name,
     get_category_display_name,
 )
+from services.cart import CartLine
+from services.catalog import Catalog
+
+# Готовые клавиатуры меню для версии каталога _menu_keyboards_version.
+# Объекты общие для всех пользователей и не изменяются после создания
+_menu_keyboards: Dict[Hashable, InlineKeyboardMarkup] = {}
+_menu_keyboards_version = -1
+
+
+def _cached_keyboard(
+    catalog: Catalog,
+    key: Hashable,
+    build: Callable[[], InlineKeyboardMarkup],
+) -> InlineKeyboardMarkup:
+    """
+    Клавиатура из кэша текущей версии каталога.
+    Новая версия каталога сбрасывает кэш; для устаревшей версии
+    (каталог взят обработчиком до обновления) клавиатура строится без кэша.
+    """
+    global _menu_keyboards_version
+    if catalog.version != _menu_keyboards_version:
+        if catalog.version < _menu_keyboards_version:
+            return build()
+        _menu_keyboards.clear()
+        _menu_keyboards_version = catalog.version
+    markup = _menu_keyboards.get(key)
+    if markup is None:
+        markup = build()
+        _menu_keyboards[key] = markup
+    return markup
+
+
+def _clamp_page(page: int, total: int, page_size: int) -> int:
+    """Номер страницы в допустимых границах (меню могло уменьшиться после обновления)"""
+    pages = max(1, -(-total // page_size))
+    return min(max(page, 0), pages - 1)
+
+
+def _page_rows(
+    page: int,
+    total: int,
+    page_size: int,
+    page_callback: Callable[[int], str],
+) -> List[List[InlineKeyboardButton]]:
+    """Строка навигации ◀️ n/m ▶️ (пусто, если страница одна)"""
+    pages = -(-total // page_size)
+    if pages <= 1:
+        return []
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton(text="◀️", callback_data=page_callback(page - 1)))
+    row.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="noop"))
+    if page < pages - 1:
+        row.append(InlineKeyboardButton(text="▶️", callback_data=page_callback(page + 1)))
+    return [row]
 
 
-def get_main_menu_keyboard() -> InlineKeyboardMarkup:
-    """Главное меню с категориями"""
-    categories = get_categories()
+def get_main_menu_keyboard(catalog: Optional[Catalog] = None, page: int = 0) -> InlineKeyboardMarkup:
+    """Главное меню с категориями (страница page)"""
+    catalog = catalog or get_catalog()
+    page = _clamp_page(page, len(catalog.categories), MENU_PAGE_SIZE)
+    return _cached_keyboard(
+        catalog,
+        ("menu", page),
+        lambda: _build_main_menu_keyboard(catalog, page),
+    )
+
+
+def get_subcategories_keyboard(
+    category: str,
+    catalog: Optional[Catalog] = None,
+    page: int = 0,
+) -> InlineKeyboardMarkup:
+    """Клавиатура с подкатегориями категории (страница page)"""
+    catalog = catalog or get_catalog()
+    page = _clamp_page(page, len(catalog.get_subcategories(category)), MENU_PAGE_SIZE)
+    return _cached_keyboard(
+        catalog,
+        ("sub", category, page),
+        lambda: _build_subcategories_keyboard(category, catalog, page),
+    )
+
+
+def get_products_keyboard(
+    category: str,
+    subcategory: str = None,
+    catalog: Optional[Catalog] = None,
+    page: int = 0,
+) -> InlineKeyboardMarkup:
+    """Клавиатура с товарами категории или подкатегории (None — без подкатегорий), страница page"""
+    catalog = catalog or get_catalog()
+    page = _clamp_page(page, len(catalog.get_products(category, subcategory)), PRODUCTS_PAGE_SIZE)
+    return _cached_keyboard(
+        catalog,
+        ("prod", category, subcategory, page),
+        lambda: _build_products_keyboard(category, subcategory, catalog, page),
+    )
+
+
+def _build_main_menu_keyboard(catalog: Catalog, page: int) -> InlineKeyboardMarkup:
+    """Построить страницу главного меню с категориями"""
     buttons = []
     
-    # Создаем кнопки для каждой категории
-    for category in categories:
-        cat_idx = get_category_index(category)
-        display_name = get_category_display_name(category)
+    # Создаем кнопки для категорий текущей страницы
+    start = page * MENU_PAGE_SIZE
+    for cat_idx in range(start, min(start + MENU_PAGE_SIZE, len(catalog.categories))):
+        display_name = get_category_display_name(catalog.categories[cat_idx])
         buttons.append([InlineKeyboardButton(
             text=display_name,
-            callback_data=f"cat_{cat_idx}"
+            callback_data=callbacks.pack(callbacks.CATEGORY, cat_idx, 0, version=catalog.version)
         )])
     
+    buttons.extend(_page_rows(
+        page, len(catalog.categories), MENU_PAGE_SIZE, lambda p: callbacks.pack(callbacks.MENU, p)
+    ))
+    
     # Кнопка корзины (если есть товары)
     buttons.append([InlineKeyboardButton(
         text="🛒 Корзина",
@@ -43,80 +146,97 @@ def get_main_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def get_subcategories_keyboard(category: str) -> InlineKeyboardMarkup:
-    """Клавиатура с подкатегориями категории"""
-    subcategories = get_subcategories(category)
+def _build_subcategories_keyboard(category: str, catalog: Catalog, page: int) -> InlineKeyboardMarkup:
+    """Построить страницу клавиатуры с подкатегориями категории"""
     buttons = []
     
-    cat_idx = get_category_index(category)
+    cat_idx = catalog.category_indexes.get(category, -1)
+    subcategories = catalog.get_subcategories(category)
     
-    # Создаем кнопки для каждой подкатегории
-    for subcategory in subcategories:
-        sub_idx = get_subcategory_index(cat_idx, subcategory)
-        display_name = get_subcategory_display_name(category, subcategory)
+    # Создаем кнопки для подкатегорий текущей страницы
+    start = page * MENU_PAGE_SIZE
+    for sub_idx in range(start, min(start + MENU_PAGE_SIZE, len(subcategories))):
+        display_name = get_subcategory_display_name(category, subcategories[sub_idx])
         buttons.append([InlineKeyboardButton(
             text=display_name,
-            callback_data=f"sub_{cat_idx}_{sub_idx}"
+            callback_data=callbacks.pack(
+                callbacks.SUBCATEGORY, cat_idx, sub_idx, 0, version=catalog.version
+            )
         )])
     
-    # Кнопка "Назад"
+    buttons.extend(_page_rows(
+        page, len(subcategories), MENU_PAGE_SIZE, lambda p: callbacks.pack(
+            callbacks.CATEGORY, cat_idx, p, version=catalog.version
+        )
+    ))
+    
+    # Кнопка "Назад" — на страницу главного меню с этой категорией
     buttons.append([InlineKeyboardButton(
         text="◀️ Назад",
-        callback_data="back_to_menu"
+        callback_data=callbacks.pack(callbacks.MENU, cat_idx // MENU_PAGE_SIZE)
     )])
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def get_products_keyboard(category: str, subcategory: str = None) -> InlineKeyboardMarkup:
-    """Клавиатура с товарами категории или подкатегории"""
-    if subcategory:
-        # Товары подкатегории
-        products = get_products_by_subcategory(category, subcategory)
-    else:
-        # Товары категории (без подкатегорий)
-        products = get_products_by_category(category)
+def _build_products_keyboard(
+    category: str,
+    subcategory: Optional[str],
+    catalog: Catalog,
+    page: int,
+) -> InlineKeyboardMarkup:
+    """Построить страницу клавиатуры с товарами категории или подкатегории"""
+    # Товары подкатегории или категории без подкатегорий
+    products = catalog.get_products(category, subcategory)
     
     buttons = []
     
-    cat_idx = get_category_index(category)
+    cat_idx = catalog.category_indexes.get(category, -1)
     
-    # Создаем кнопки для каждого товара с отображением цены
-    for idx, product in enumerate(products):
+    # Создаем кнопки для товаров текущей страницы с отображением цены
+    # callback_data содержит стабильный ID товара: кнопка остаётся верной после обновления меню
+    for product in products[page * PRODUCTS_PAGE_SIZE:(page + 1) * PRODUCTS_PAGE_SIZE]:
         product_name = get_product_name(product)
         product_price = product.get("price", 0)
         # Форматируем текст кнопки: "Название - Цена TL"
         button_text = f"{product_name} - {product_price} TL"
         
-        # Формируем callback_data в зависимости от наличия подкатегории
-        if subcategory:
-            sub_idx = get_subcategory_index(cat_idx, subcategory)
-            callback_data = f"prod_{cat_idx}_{sub_idx}_{idx}"
-        else:
-            callback_data = f"prod_{cat_idx}_{idx}"
-        
         buttons.append([InlineKeyboardButton(
             text=button_text,
-            callback_data=callback_data
+            callback_data=callbacks.pack(callbacks.PRODUCT, product["id"])
         )])
     
-    # Кнопка "Назад"
-    if subcategory:
-        # Если есть подкатегория, возвращаемся к списку подкатегорий
+    # Навигация по страницам и кнопка "Назад"
+    if subcategory is not None:
+        sub_idx = catalog.subcategory_indexes.get(cat_idx, {}).get(subcategory, -1)
+        buttons.extend(_page_rows(
+            page, len(products), PRODUCTS_PAGE_SIZE, lambda p: callbacks.pack(
+                callbacks.SUBCATEGORY, cat_idx, sub_idx, p, version=catalog.version
+            )
+        ))
+        # Если есть подкатегория, возвращаемся на страницу списка подкатегорий
         buttons.append([InlineKeyboardButton(
             text="◀️ Назад",
-            callback_data=f"cat_{cat_idx}"
+            callback_data=callbacks.pack(
+                callbacks.CATEGORY, cat_idx, sub_idx // MENU_PAGE_SIZE, version=catalog.version
+            )
         )])
     else:
+        buttons.extend(_page_rows(
+            page, len(products), PRODUCTS_PAGE_SIZE, lambda p: callbacks.pack(
+                callbacks.CATEGORY, cat_idx, p, version=catalog.version
+            )
+        ))
         # Если нет подкатегории, возвращаемся в главное меню
         buttons.append([InlineKeyboardButton(
             text="◀️ Назад",
-            callback_data="back_to_menu"
+            callback_data=callbacks.pack(callbacks.MENU, cat_idx // MENU_PAGE_SIZE)
         )])
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@lru_cache(maxsize=None)
 def get_after_add_product_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура после добавления товара в корзину"""
     buttons = [
@@ -140,9 +260,33 @@ def get_after_add_product_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def get_cart_keyboard() -> InlineKeyboardMarkup:
-    """Клавиатура для корзины"""
-    buttons = [
+def get_cart_keyboard(lines: Sequence[CartLine]) -> InlineKeyboardMarkup:
+    """Клавиатура для корзины: ➖ / товар / ➕ / ❌ для каждой строки и действия с заказом"""
+    buttons = []
+    for line in lines:
+        if not line.product_id:
+            continue
+        name = line.name if len(line.name) <= 24 else line.name[:23] + "…"
+        buttons.append([
+            InlineKeyboardButton(
+                text="➖",
+                callback_data=callbacks.pack(callbacks.CART_REMOVE, line.product_id)
+            ),
+            InlineKeyboardButton(
+                text=f"{name} ×{line.quantity}",
+                callback_data="noop"
+            ),
+            InlineKeyboardButton(
+                text="➕",
+                callback_data=callbacks.pack(callbacks.CART_ADD, line.product_id)
+            ),
+            InlineKeyboardButton(
+                text="❌",
+                callback_data=callbacks.pack(callbacks.CART_DELETE, line.product_id)
+            ),
+        ])
+    
+    buttons += [
         [
             InlineKeyboardButton(
                 text="✅ Заказать",
@@ -163,6 +307,7 @@ def get_cart_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@lru_cache(maxsize=None)
 def get_confirm_order_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для подтверждения заказа"""
     buttons = [
@@ -180,6 +325,7 @@ def get_confirm_order_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@lru_cache(maxsize=None)
 def get_contact_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для запроса контакта"""
     buttons = [
@@ -4,9 +4,33 @@
 """
 import asyncio
 import logging
+import time
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from config import (
+    BOT_MODE,
+    BOT_TOKEN,
+    CART_FLUSH_INTERVAL,
+    FSM_CACHE_SIZE,
+    FSM_DB_PATH,
+    FSM_REDIS_URL,
+    FSM_STORAGE,
+    HEALTH_PATH,
+    MENU_REFRESH_INTERVAL,
+    WEBHOOK_HANDLE_IN_BACKGROUND,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+from data import get_catalog, revalidate_menu, run_menu_refresher
+from services.cart import cart_service
+from services.fsm_storage import create_fsm_storage
+from services.notifier import admin_notifier
+from services.order import order_service
+from services.sanity import close_session as close_sanity_session
 
 # Импортируем роутеры
 from handlers import start, categories, cart, order, admin
@@ -19,6 +43,51 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _create_webhook_app(bot: Bot, dp: Dispatcher, secret_token: str) -> web.Application:
+    """HTTP-приложение: приём обновлений на WEBHOOK_PATH и проверка на HEALTH_PATH"""
+    app = web.Application()
+    started_at = time.monotonic()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "mode": "webhook",
+            "uptime": round(time.monotonic() - started_at),
+            "catalog_version": get_catalog().version,
+        })
+
+    app.router.add_get(HEALTH_PATH, health)
+    # Запросы без верного X-Telegram-Bot-Api-Secret-Token отклоняются с 401
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=WEBHOOK_HANDLE_IN_BACKGROUND,
+        secret_token=secret_token,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def _run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    """Принимать обновления через webhook до остановки процесса"""
+    # WEBHOOK_SECRET обязателен (проверяется в main) и общий для всех экземпляров
+    runner = web.AppRunner(_create_webhook_app(bot, dp, WEBHOOK_SECRET))
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info(
+            "Webhook %s, сервер %s:%d", WEBHOOK_URL + WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT
+        )
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
 async def main():
     """Основная функция запуска бота"""
     
@@ -37,6 +106,19 @@ async def main():
         logger.error("💡 Проверьте файл .env и убедитесь, что токен указан правильно")
         return
     
+    # Для webhook нужен публичный адрес, на который Telegram будет слать обновления
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        logger.error("❌ WEBHOOK_URL не установлен для BOT_MODE=webhook!")
+        logger.error("📝 Укажите в .env публичный HTTPS-адрес: WEBHOOK_URL=https://example.com")
+        return
+    
+    # Секрет общий для всех экземпляров: каждый регистрирует webhook заново,
+    # и случайный секрет у каждого оставил бы рабочим только последний запущенный
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        logger.error("❌ WEBHOOK_SECRET не установлен для BOT_MODE=webhook!")
+        logger.error("📝 Укажите в .env одну и ту же длинную случайную строку для всех экземпляров")
+        return
+    
     # Инициализация бота и диспетчера
     try:
         bot = Bot(token=BOT_TOKEN)
@@ -44,9 +126,23 @@ async def main():
         logger.error(f"❌ Ошибка при создании бота: {e}")
         logger.error("💡 Проверьте правильность токена в файле .env")
         return
-    storage = MemoryStorage()  # Хранилище состояний в памяти
+    # Хранилище состояний диалога; закрывается диспетчером при остановке
+    try:
+        storage = create_fsm_storage(FSM_STORAGE, FSM_DB_PATH, FSM_REDIS_URL, FSM_CACHE_SIZE)
+    except Exception as e:
+        logger.error(f"❌ Ошибка хранилища состояний FSM_STORAGE={FSM_STORAGE}: {e}")
+        await bot.session.close()
+        return
     dp = Dispatcher(storage=storage)
     
+    # Корзина вернувшегося пользователя читается из хранилища до обработчика, вне event loop
+    @dp.update.outer_middleware()
+    async def preload_cart(handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None:
+            await cart_service.preload(user.id)
+        return await handler(event, data)
+    
     # Регистрируем роутеры
     dp.include_router(start.router)
     dp.include_router(categories.router)
@@ -54,14 +150,45 @@ async def main():
     dp.include_router(order.router)
     dp.include_router(admin.router)  # Команды администратора
     
+    # Итоги продаж для /stats: заказы текущего месяца читаются один раз при запуске
+    loaded = await order_service.load_analytics()
+    logger.info("Аналитика продаж: учтено заказов %d", loaded)
+    
+    # Меню из снимка сверяем с Sanity в фоне, не задерживая старт
+    background_tasks = [asyncio.create_task(revalidate_menu())]
+    
+    # Периодическое обновление меню
+    if MENU_REFRESH_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(run_menu_refresher(MENU_REFRESH_INTERVAL)))
+    
+    # Пакетная запись изменений корзин в хранилище
+    background_tasks.append(asyncio.create_task(cart_service.run_flusher(CART_FLUSH_INTERVAL)))
+    
+    # Доставка уведомлений администраторам, в том числе оставшихся с прошлого запуска
+    background_tasks.append(asyncio.create_task(admin_notifier.run(bot)))
+    
+    if BOT_MODE not in ("polling", "webhook"):
+        logger.warning("Неизвестный BOT_MODE=%s, используется polling", BOT_MODE)
+    
     logger.info("Бот запущен и готов к работе!")
     
-    # Запускаем polling
+    # Запускаем polling или webhook
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if BOT_MODE == "webhook":
+            await _run_webhook(bot, dp)
+        else:
+            # Webhook, оставшийся от запуска в режиме webhook, мешает getUpdates
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
+        for task in background_tasks:
+            task.cancel()
+        # Дописываем несохранённые изменения корзин
+        cart_service.close()
+        order_service.close()
+        await close_sanity_session()
         await bot.session.close()
 
 
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Аналитика продаж для /stats
+Выручка, количество заказов и проданные блюда копятся в корзинах по часам и по дням
+при создании заказа; отмена заказа вычитает его из корзин.
+Ответ собирается из не более чем 31 дневной корзины, поэтому не зависит
+от числа заказов; старые корзины удаляются
+"""
+import heapq
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Дневные корзины храним с запасом на календарный месяц, часовые — за двое суток
+DAY_RETENTION = 40
+HOUR_RETENTION = 48
+
+
+class PeriodStats(NamedTuple):
+    """Итоги за период"""
+    revenue: int
+    orders: int
+    top: List[Tuple[str, int]]  # [(блюдо, количество)], по убыванию
+
+    @property
+    def average(self) -> float:
+        """Средний чек"""
+        return self.revenue / self.orders if self.orders else 0.0
+
+
+class _Bucket:
+    """Итоги за час или день; products заполняется только для дней"""
+    __slots__ = ("revenue", "orders", "products")
+
+    def __init__(self):
+        self.revenue = 0
+        self.orders = 0
+        self.products: Counter = Counter()
+
+
+class SalesAnalytics:
+    """Инкрементальные итоги продаж по часам и дням"""
+
+    def __init__(self):
+        self._days: Dict[date, _Bucket] = {}
+        self._hours: Dict[datetime, _Bucket] = {}
+
+    def record(self, order: dict, sign: int = 1) -> None:
+        """Учесть заказ (sign=-1 — вычесть, например при отмене)"""
+        timestamp = order['timestamp']
+        day = self._days.get(timestamp.date())
+        if day is None:
+            day = self._days[timestamp.date()] = _Bucket()
+        hour_key = timestamp.replace(minute=0, second=0, microsecond=0)
+        hour = self._hours.get(hour_key)
+        if hour is None:
+            hour = self._hours[hour_key] = _Bucket()
+        for bucket in (day, hour):
+            bucket.revenue += sign * order['total_sum']
+            bucket.orders += sign
+        for name, quantity, _ in order['items']:
+            day.products[name] += sign * quantity
+            if day.products[name] <= 0:
+                del day.products[name]
+        self._prune(datetime.now())
+
+    def remove(self, order: dict) -> None:
+        """Вычесть ранее учтённый заказ"""
+        self.record(order, -1)
+
+    def clear(self) -> None:
+        self._days.clear()
+        self._hours.clear()
+
+    def _prune(self, now: datetime) -> None:
+        """Удалить корзины старше срока хранения"""
+        oldest_day = now.date() - timedelta(days=DAY_RETENTION)
+        if self._days and min(self._days) < oldest_day:
+            for key in [key for key in self._days if key < oldest_day]:
+                del self._days[key]
+        oldest_hour = now - timedelta(hours=HOUR_RETENTION)
+        if self._hours and min(self._hours) < oldest_hour:
+            for key in [key for key in self._hours if key < oldest_hour]:
+                del self._hours[key]
+
+    def period(self, start: date, end: date, top_n: int = 5) -> PeriodStats:
+        """Итоги за дни [start, end]"""
+        revenue = orders = 0
+        products: Counter = Counter()
+        day = start
+        while day <= end:
+            bucket = self._days.get(day)
+            if bucket is not None:
+                revenue += bucket.revenue
+                orders += bucket.orders
+                products.update(bucket.products)
+            day += timedelta(days=1)
+        top = heapq.nlargest(top_n, products.items(), key=lambda item: item[1])
+        return PeriodStats(revenue, orders, top)
+
+    def last_hours(self, hours: int, now: Optional[datetime] = None) -> PeriodStats:
+        """Выручка и заказы за последние hours часов (включая текущий)"""
+        now = now or datetime.now()
+        current = now.replace(minute=0, second=0, microsecond=0)
+        revenue = orders = 0
+        for offset in range(min(hours, HOUR_RETENTION)):
+            bucket = self._hours.get(current - timedelta(hours=offset))
+            if bucket is not None:
+                revenue += bucket.revenue
+                orders += bucket.orders
+        return PeriodStats(revenue, orders, [])
+
+    def summary(self, top_n: int = 5, now: Optional[datetime] = None) -> Dict[str, PeriodStats]:
+        """Итоги за сегодня, текущую неделю (с понедельника) и текущий месяц"""
+        today = (now or datetime.now()).date()
+        return {
+            'today': self.period(today, today, top_n),
+            'week': self.period(today - timedelta(days=today.weekday()), today, top_n),
+            'month': self.period(today.replace(day=1), today, top_n),
+        }
+
+
+def analytics_start(now: Optional[datetime] = None) -> datetime:
+    """Начало периода, заказы которого нужны для /stats (загрузка при запуске)"""
+    now = now or datetime.now()
+    today = datetime.combine(now.date(), datetime.min.time())
+    return min(
+        today.replace(day=1),
+        today - timedelta(days=today.weekday()),
+        now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=HOUR_RETENTION),
+    )
+
+
+# Глобальная аналитика продаж
+sales_analytics = SalesAnalytics()
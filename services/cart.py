@@ -1,80 +1,502 @@
 # -*- coding: utf-8 -*-
 """
 Сервис для управления корзиной пользователя
-Корзина хранится в памяти (словарь)
+Корзины живут в памяти (словарь) и сохраняются в хранилище (services/cart_store.py):
+изменения копятся и записываются пачками раз в CART_FLUSH_INTERVAL секунд,
+корзина загружается из хранилища при первом обращении пользователя после перезапуска
+или вытеснения: чтение идёт в фоновом потоке до обработчика (preload)
+В памяти держатся только недавно активные пользователи: корзины, не тронутые дольше
+CART_IDLE_TTL секунд, и самые старые сверх CART_MAX_RESIDENT вытесняются (данные
+остаются в хранилище)
 Товары идентифицируются по slug из Sanity
+Строки корзины запоминают цену и название товара при добавлении (единицы, добавленные
+после смены цены в меню, идут по новой цене, прежние — по своей), итоговая сумма
+поддерживается при добавлении и удалении, поэтому показ корзины и оформление заказа
+проходят по строкам один раз без обращений к меню
 """
-from typing import Dict, List, Tuple
-from data import get_product_price, get_product_name_by_slug
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from config import CART_BACKEND, CART_DB_PATH, CART_IDLE_TTL, CART_MAX_RESIDENT
+from data import get_catalog
+from services.cart_store import CartItems, CartStore, create_cart_store
+from services.catalog import Catalog
+
+logger = logging.getLogger(__name__)
+
+# Позиция корзины для заказа: (product_name, quantity, total_price)
+CartItem = Tuple[str, int, int]
+
+
+class CartLine:
+    """
+    Строка корзины: название и цена запоминаются при добавлении товара,
+    поэтому итог не меняется от обновления меню между выбором и оформлением
+    price — цена последних добавленных единиц; единицы, добавленные до смены цены,
+    лежат в earlier как [price, quantity] (обычно пусто)
+    """
+    
+    __slots__ = ("name", "price", "quantity", "product_id", "earlier")
+    
+    def __init__(
+        self,
+        name: str,
+        price: int,
+        quantity: int,
+        product_id: int,
+        earlier: Optional[List[List[int]]] = None,
+    ):
+        self.name = name
+        self.price = price
+        # Всего единиц в строке, включая earlier
+        self.quantity = quantity
+        # Стабильный ID товара для кнопок +/− в корзине (0 — неизвестен)
+        self.product_id = product_id
+        self.earlier = earlier or []
+    
+    @property
+    def total(self) -> int:
+        total = self.price * self.quantity
+        for price, quantity in self.earlier:
+            total += (price - self.price) * quantity
+        return total
+    
+    @property
+    def prices(self) -> List[int]:
+        """Все цены единиц строки, от ранних к последней"""
+        return [price for price, _ in self.earlier] + [self.price]
+    
+    def add(self, price: int) -> None:
+        """Добавить единицу по цене price; прежние единицы сохраняют свою цену"""
+        if price != self.price and self.quantity:
+            self.earlier.append([self.price, self.quantity - sum(q for _, q in self.earlier)])
+        self.price = price
+        self.quantity += 1
+    
+    def remove(self) -> None:
+        """Убрать последнюю добавленную единицу"""
+        self.quantity -= 1
+        if self.earlier and self.quantity == sum(q for _, q in self.earlier):
+            self.price = self.earlier.pop()[0]
+    
+    def as_item(self) -> CartItem:
+        return (self.name, self.quantity, self.total)
+    
+    def to_stored(self) -> list:
+        """Строка для хранилища: [quantity, price, name, product_id(, earlier)]"""
+        stored = [self.quantity, self.price, self.name, self.product_id]
+        if self.earlier:
+            stored.append(self.earlier)
+        return stored
+
+
+class _Cart:
+    """Корзина одного пользователя со строками и итогом"""
+    
+    __slots__ = ("lines", "total")
+    
+    def __init__(self):
+        # {product_slug: CartLine} в порядке добавления
+        self.lines: Dict[str, CartLine] = {}
+        self.total = 0
+    
+    @classmethod
+    def from_stored(cls, items: CartItems, catalog: Catalog) -> "_Cart":
+        """Корзина из хранилища; для записей старого формата {slug: quantity} цена берётся из меню"""
+        cart = cls()
+        for slug, stored in items.items():
+            if isinstance(stored, int):
+                line = CartLine(
+                    catalog.names.get(slug, slug),
+                    catalog.prices.get(slug, 0),
+                    stored,
+                    catalog.slug_ids.get(slug, 0),
+                )
+            else:
+                quantity, price, name = stored[:3]
+                # ID из текущего меню: сохранённый мог быть выдан по старой схеме
+                product_id = catalog.slug_ids.get(slug, stored[3] if len(stored) > 3 else 0)
+                earlier = [list(tier) for tier in stored[4]] if len(stored) > 4 else None
+                line = CartLine(name, price, quantity, product_id, earlier)
+            cart.lines[slug] = line
+            cart.total += line.total
+        return cart
+    
+    def to_stored(self) -> CartItems:
+        return {slug: line.to_stored() for slug, line in self.lines.items()}
+    
+    def add(self, catalog: Catalog, product_slug: str) -> None:
+        """
+        Добавить единицу товара по цене из текущего меню (товар выбран по кнопке с этой ценой)
+        Единицы, добавленные раньше, сохраняют цену на момент своего добавления
+        """
+        line = self.lines.get(product_slug)
+        if line is None:
+            line = self.lines[product_slug] = CartLine("", 0, 0, 0)
+        price = catalog.prices.get(product_slug, 0)
+        line.name = catalog.names.get(product_slug, product_slug)
+        line.product_id = catalog.slug_ids.get(product_slug, line.product_id)
+        line.add(price)
+        self.total += price
+    
+    def repeat(self, product_slug: str) -> None:
+        """Ещё одна единица по цене последней добавленной (кнопка ➕ в корзине)"""
+        line = self.lines[product_slug]
+        line.add(line.price)
+        self.total += line.price
+    
+    def remove(self, product_slug: str) -> None:
+        """Убрать последнюю добавленную единицу товара по её цене"""
+        line = self.lines[product_slug]
+        self.total -= line.price
+        line.remove()
+        if line.quantity <= 0:
+            del self.lines[product_slug]
+    
+    def delete(self, product_slug: str) -> None:
+        """Удалить строку товара целиком"""
+        line = self.lines.pop(product_slug)
+        self.total -= line.total
+    
+    def find_slug(self, product_id: int) -> Optional[str]:
+        """Slug строки по ID товара (строк в корзине немного, поэтому перебором)"""
+        for slug, line in self.lines.items():
+            if line.product_id == product_id:
+                return slug
+        return None
+
+
+class CartStats:
+    """Счётчики памяти корзин"""
+
+    def __init__(self):
+        self.evicted_idle = 0  # вытеснены по CART_IDLE_TTL
+        self.evicted_cap = 0  # вытеснены по CART_MAX_RESIDENT
+        self.restored = 0  # загружены из хранилища
 
 
 class CartService:
     """Сервис для работы с корзиной"""
     
-    def __init__(self):
-        # Структура: {user_id: {product_slug: quantity}}
-        self._carts: Dict[int, Dict[str, int]] = {}
+    def __init__(
+        self,
+        store: Optional[CartStore] = None,
+        idle_ttl: float = CART_IDLE_TTL,
+        max_resident: int = CART_MAX_RESIDENT,
+    ):
+        self._store = store or CartStore()
+        self._idle_ttl = idle_ttl
+        self._max_resident = max_resident
+        # Структура: {user_id: _Cart}
+        self._carts: Dict[int, _Cart] = {}
+        # Пользователи в памяти (их корзины уже искали в хранилище): {user_id: last_touch}
+        # Порядок — от давно не активных к недавним, поэтому вытеснение идёт с начала
+        self._touched: "OrderedDict[int, float]" = OrderedDict()
+        # Пользователи с изменениями, ещё не записанными в хранилище
+        self._dirty: Set[int] = set()
+        # Незаписанные изменения вытесненных пользователей: {user_id: items или None}
+        self._evicted_changes: Dict[int, Optional[CartItems]] = {}
+        # Изменения, забранные на запись, пока save_many не завершился:
+        # хранилище до этого отдаёт старые корзины
+        self._flushing: Dict[int, Optional[CartItems]] = {}
+        self.stats = CartStats()
+    
+    def _touch(self, user_id: int) -> None:
+        """Отметить обращение пользователя и соблюсти CART_MAX_RESIDENT"""
+        self._touched[user_id] = time.monotonic()
+        self._touched.move_to_end(user_id)
+        while len(self._touched) > self._max_resident:
+            oldest, _ = self._touched.popitem(last=False)
+            self._evict(oldest)
+            self.stats.evicted_cap += 1
+    
+    def _evict(self, user_id: int) -> None:
+        """Убрать пользователя из памяти, сохранив незаписанные изменения до записи"""
+        cart = self._carts.pop(user_id, None)
+        if user_id in self._dirty:
+            self._dirty.discard(user_id)
+            self._evicted_changes[user_id] = cart.to_stored() if cart is not None else None
+    
+    async def preload(self, user_id: int) -> None:
+        """
+        Загрузить корзину пользователя из хранилища в фоновом потоке
+        Вызывается до обработчика (middleware в main.py), чтобы синхронные методы
+        не читали БД в event loop
+        """
+        if not self._store.persistent or not self._needs_load(user_id):
+            return
+        items = await asyncio.to_thread(self._store.load, user_id)
+        # Пока шло чтение, пользователя могли загрузить или изменить — их данные новее
+        if self._needs_load(user_id):
+            self._restore(user_id, items)
+    
+    def _needs_load(self, user_id: int) -> bool:
+        """Корзину можно взять только из хранилища: в памяти нет ни её, ни незаписанных изменений"""
+        return (
+            user_id not in self._touched
+            and user_id not in self._evicted_changes
+            and user_id not in self._flushing
+        )
+    
+    def _restore(self, user_id: int, items: Optional[CartItems]) -> Optional[_Cart]:
+        """Поместить пользователя в память с корзиной items"""
+        self._touch(user_id)
+        if not items:
+            return None
+        cart = self._carts[user_id] = _Cart.from_stored(items, get_catalog())
+        self.stats.restored += 1
+        return cart
+    
+    def _get_cart(self, user_id: int) -> Optional[_Cart]:
+        """Корзина пользователя; если её не загрузил preload — загружается из хранилища"""
+        if user_id in self._touched:
+            self._touch(user_id)
+            return self._carts.get(user_id)
+        
+        if user_id in self._evicted_changes:
+            # Вытеснен до записи изменений: берём их, а не устаревшее хранилище
+            items = self._evicted_changes.pop(user_id)
+            self._dirty.add(user_id)
+        elif user_id in self._flushing:
+            # Изменения ещё записываются: в хранилище пока старая корзина
+            items = self._flushing[user_id]
+        else:
+            # Без preload (вызов вне обработчика или вытеснен сразу после загрузки):
+            # одно чтение по первичному ключу
+            items = self._store.load(user_id)
+        return self._restore(user_id, items)
+    
+    def evict_idle(self) -> int:
+        """
+        Вытеснить пользователей, не активных дольше CART_IDLE_TTL
+        Просматривает только вытесняемых: порядок _touched — по времени обращения
+        """
+        deadline = time.monotonic() - self._idle_ttl
+        evicted = 0
+        for user_id, last_touch in self._touched.items():
+            if last_touch > deadline:
+                break
+            evicted += 1
+        for _ in range(evicted):
+            user_id, _ = self._touched.popitem(last=False)
+            self._evict(user_id)
+        self.stats.evicted_idle += evicted
+        return evicted
+    
+    def resident_count(self) -> int:
+        """Сколько корзин сейчас в памяти"""
+        return len(self._carts)
+    
+    def tracked_count(self) -> int:
+        """Сколько пользователей сейчас в памяти (с корзиной и без)"""
+        return len(self._touched)
     
     def add_product(self, user_id: int, product_slug: str) -> None:
         """Добавить товар в корзину по slug"""
-        if user_id not in self._carts:
-            self._carts[user_id] = {}
-        
-        if product_slug in self._carts[user_id]:
-            self._carts[user_id][product_slug] += 1
+        cart = self._get_cart(user_id)
+        if cart is None:
+            cart = self._carts[user_id] = _Cart()
+        cart.add(get_catalog(), product_slug)
+        self._dirty.add(user_id)
+    
+    def remove_product(self, user_id: int, product_slug: str) -> bool:
+        """Убрать одну единицу товара из корзины; False — товара нет в корзине"""
+        cart = self._get_cart(user_id)
+        if cart is None or product_slug not in cart.lines:
+            return False
+        cart.remove(product_slug)
+        if not cart.lines:
+            del self._carts[user_id]
+        self._dirty.add(user_id)
+        return True
+    
+    def change_line(self, user_id: int, product_id: int, delta: int) -> bool:
+        """
+        Кнопки корзины: delta=1 — ещё одна единица, -1 — на одну меньше, 0 — удалить строку
+        False — строки нет в корзине или товара больше нет в меню (для +1)
+        ➕ добавляет единицу по цене строки, а не меню: пользователь видел в корзине её,
+        изменение цены по-прежнему показывается при оформлении
+        """
+        cart = self._get_cart(user_id)
+        product_slug = cart.find_slug(product_id) if cart is not None else None
+        if product_slug is None:
+            return False
+        if delta > 0:
+            if product_slug not in get_catalog().prices:
+                return False
+            cart.repeat(product_slug)
+        elif delta < 0:
+            cart.remove(product_slug)
         else:
-            self._carts[user_id][product_slug] = 1
+            cart.delete(product_slug)
+        if not cart.lines:
+            del self._carts[user_id]
+        self._dirty.add(user_id)
+        return True
+    
+    def get_cart_lines(self, user_id: int) -> List[CartLine]:
+        """Строки корзины в порядке добавления (для кнопок корзины)"""
+        cart = self._get_cart(user_id)
+        return list(cart.lines.values()) if cart is not None else []
     
     def get_cart(self, user_id: int) -> Dict[str, int]:
         """Получить корзину пользователя {slug: quantity}"""
-        return self._carts.get(user_id, {})
+        cart = self._get_cart(user_id)
+        if cart is None:
+            return {}
+        return {slug: line.quantity for slug, line in cart.lines.items()}
     
-    def get_cart_items(self, user_id: int) -> List[Tuple[str, int, int]]:
+    def get_cart_items(self, user_id: int) -> List[CartItem]:
         """
         Получить список товаров корзины с ценами
         Возвращает: [(product_name, quantity, total_price), ...]
         """
-        cart = self.get_cart(user_id)
-        items = []
-        for product_slug, quantity in cart.items():
-            price = get_product_price(product_slug)
-            product_name = get_product_name_by_slug(product_slug)
-            total_price = price * quantity
-            items.append((product_name, quantity, total_price))
-        return items
+        cart = self._get_cart(user_id)
+        return [line.as_item() for line in cart.lines.values()] if cart is not None else []
     
     def get_total_sum(self, user_id: int) -> int:
         """Получить итоговую сумму корзины"""
-        items = self.get_cart_items(user_id)
-        return sum(total_price for _, _, total_price in items)
+        cart = self._get_cart(user_id)
+        return cart.total if cart is not None else 0
+    
+    def get_cart_summary(self, user_id: int) -> Tuple[List[CartItem], int]:
+        """Строки корзины и итоговая сумма за одно обращение"""
+        cart = self._get_cart(user_id)
+        if cart is None:
+            return [], 0
+        return [line.as_item() for line in cart.lines.values()], cart.total
+    
+    def get_price_changes(self, user_id: int) -> List[Tuple[str, int, Optional[int]]]:
+        """
+        Строки, цена которых в меню изменилась после добавления в корзину
+        Возвращает: [(product_name, cart_price, menu_price), ...], menu_price None — товара нет в меню
+        """
+        cart = self._get_cart(user_id)
+        if cart is None:
+            return []
+        prices = get_catalog().prices
+        changes = []
+        for slug, line in cart.lines.items():
+            menu_price = prices.get(slug)
+            for cart_price in dict.fromkeys(line.prices):
+                if cart_price != menu_price:
+                    changes.append((line.name, cart_price, menu_price))
+        return changes
+    
+    def format_price_changes(self, user_id: int) -> str:
+        """Предупреждение об изменившихся ценах для оформления заказа ('' — изменений нет)"""
+        changes = self.get_price_changes(user_id)
+        if not changes:
+            return ""
+        
+        lines = ["⚠️ После добавления в корзину меню обновилось:"]
+        for product_name, cart_price, menu_price in changes:
+            if menu_price is None:
+                lines.append(f"• {product_name}: больше нет в меню")
+            else:
+                lines.append(f"• {product_name}: {cart_price} TL → {menu_price} TL")
+        lines.append("В заказе указаны цены на момент добавления.")
+        
+        return "\n".join(lines)
     
     def clear_cart(self, user_id: int) -> None:
         """Очистить корзину пользователя"""
-        if user_id in self._carts:
-            del self._carts[user_id]
+        # Корзина могла быть только в хранилище, поэтому удаляем и там
+        self._touch(user_id)
+        self._evicted_changes.pop(user_id, None)
+        self._carts.pop(user_id, None)
+        self._dirty.add(user_id)
     
     def is_empty(self, user_id: int) -> bool:
         """Проверить, пуста ли корзина"""
-        cart = self.get_cart(user_id)
-        return len(cart) == 0
+        cart = self._get_cart(user_id)
+        return cart is None or not cart.lines
     
     def format_cart_message(self, user_id: int) -> str:
         """Форматировать корзину для отображения"""
-        items = self.get_cart_items(user_id)
-        if not items:
+        cart = self._get_cart(user_id)
+        if cart is None or not cart.lines:
             return "Корзина пуста"
         
         lines = ["📦 Ваш заказ:\n"]
-        for product_name, quantity, total_price in items:
+        for line in cart.lines.values():
             lines.append(
-                f"• {product_name} x{quantity} = {total_price} TL"
+                f"• {line.name} x{line.quantity} = {line.total} TL"
             )
         
-        total_sum = self.get_total_sum(user_id)
-        lines.append(f"\n💰 Итого: {total_sum} TL")
+        lines.append(f"\n💰 Итого: {cart.total} TL")
         
         return "\n".join(lines)
+    
+    def _take_changes(self) -> Dict[int, Optional[CartItems]]:
+        """
+        Забрать накопленные изменения: {user_id: items}, None — корзина удалена
+        До конца записи они остаются видны в _flushing
+        """
+        changes = self._evicted_changes
+        for user_id in self._dirty:
+            cart = self._carts.get(user_id)
+            changes[user_id] = cart.to_stored() if cart is not None else None
+        self._dirty = set()
+        self._evicted_changes = {}
+        self._flushing = changes
+        return changes
+    
+    def _return_changes(self, changes: Dict[int, Optional[CartItems]]) -> None:
+        """Вернуть незаписанные изменения, чтобы повторить запись в следующий раз"""
+        for user_id, items in changes.items():
+            if user_id in self._touched:
+                self._dirty.add(user_id)
+            else:
+                self._evicted_changes.setdefault(user_id, items)
+    
+    def flush(self) -> None:
+        """Синхронно записать накопленные изменения (при остановке бота)"""
+        changes = self._take_changes()
+        if not changes:
+            return
+        try:
+            self._store.save_many(changes)
+        except Exception as e:
+            self._return_changes(changes)
+            logger.error("Не удалось сохранить корзины: %s", e)
+        finally:
+            self._flushing = {}
+    
+    async def flush_async(self) -> None:
+        """Записать накопленные изменения одной пачкой в фоновом потоке"""
+        # Снимок изменений берётся в потоке бота, запись — вне event loop
+        changes = self._take_changes()
+        if not changes:
+            return
+        try:
+            await asyncio.to_thread(self._store.save_many, changes)
+        except asyncio.CancelledError:
+            # Остановка бота: запись могла не завершиться, close() повторит её
+            self._return_changes(changes)
+            raise
+        except Exception as e:
+            self._return_changes(changes)
+            logger.error("Не удалось сохранить корзины: %s", e)
+        finally:
+            self._flushing = {}
+    
+    async def run_flusher(self, interval: float) -> None:
+        """Фоновая запись изменений корзин и вытеснение неактивных раз в interval секунд"""
+        while True:
+            await asyncio.sleep(interval)
+            evicted = self.evict_idle()
+            if evicted:
+                logger.debug("Вытеснено неактивных корзин: %s", evicted)
+            await self.flush_async()
+    
+    def close(self) -> None:
+        """Записать изменения и закрыть хранилище"""
+        self.flush()
+        self._store.close()
 
 
 # Глобальный экземпляр сервиса корзины
-cart_service = CartService()
+cart_service = CartService(create_cart_store(CART_BACKEND, CART_DB_PATH))
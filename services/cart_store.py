@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилища корзин для CartService
+memory — только в памяти процесса (корзины теряются при перезапуске)
+sqlite — встроенная БД SQLite в режиме WAL
+Хранилище получает изменения пачками от CartService и не вызывается на каждое нажатие
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Mapping, Optional
+
+from services.sqlite_db import connect
+
+logger = logging.getLogger(__name__)
+
+# Содержимое корзины для хранения: {product_slug: [quantity, price, name, product_id]}
+# (в записях до сохранения цены — {product_slug: quantity})
+CartItems = Dict[str, list]
+
+
+class CartStore:
+    """Хранилище корзин в памяти: ничего не сохраняет"""
+
+    # Есть ли что загружать (чтение стоит выносить из event loop)
+    persistent = False
+
+    def load(self, user_id: int) -> Optional[CartItems]:
+        """Загрузить корзину пользователя (None — корзины нет)"""
+        return None
+
+    def save_many(self, changes: Mapping[int, Optional[CartItems]]) -> None:
+        """Сохранить пачку изменений {user_id: items}, None — удалить корзину"""
+
+    def close(self) -> None:
+        """Закрыть хранилище"""
+
+
+class SQLiteCartStore(CartStore):
+    """
+    Хранилище корзин в SQLite (WAL)
+    Чтение идёт из потока предзагрузки (см. CartService.preload), запись пачек — из фонового,
+    поэтому у них отдельные соединения
+    """
+
+    persistent = True
+
+    def __init__(self, path: str):
+        self._path = path
+        self._writer = connect(path, check_same_thread=False)
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS carts ("
+            " user_id INTEGER PRIMARY KEY,"
+            " items TEXT NOT NULL,"
+            " updated_at REAL NOT NULL"
+            ")"
+        )
+        self._writer.commit()
+        self._reader = connect(path, check_same_thread=False)
+        # Соединение не годится для одновременного использования из нескольких потоков:
+        # предзагрузки идут параллельно в потоках asyncio.to_thread
+        self._read_lock = threading.Lock()
+        # Запись из фонового потока и финальная запись при остановке не пересекаются
+        self._write_lock = threading.Lock()
+
+    def load(self, user_id: int) -> Optional[CartItems]:
+        try:
+            with self._read_lock:
+                row = self._reader.execute(
+                    "SELECT items FROM carts WHERE user_id = ?", (user_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error("Не удалось загрузить корзину %s: %s", user_id, e)
+            return None
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            logger.warning("Повреждённая корзина %s в %s", user_id, self._path)
+            return None
+
+    def save_many(self, changes: Mapping[int, Optional[CartItems]]) -> None:
+        now = time.time()
+        upserts = []
+        deletes = []
+        for user_id, items in changes.items():
+            if items:
+                upserts.append((user_id, json.dumps(items, ensure_ascii=False), now))
+            else:
+                deletes.append((user_id,))
+        # Одна транзакция на пачку
+        with self._write_lock, self._writer:
+            if upserts:
+                self._writer.executemany(
+                    "INSERT INTO carts (user_id, items, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET "
+                    "items = excluded.items, updated_at = excluded.updated_at",
+                    upserts,
+                )
+            if deletes:
+                self._writer.executemany("DELETE FROM carts WHERE user_id = ?", deletes)
+
+    def close(self) -> None:
+        with self._write_lock, self._read_lock:
+            self._reader.close()
+            self._writer.close()
+
+
+def create_cart_store(backend: str, path: str) -> CartStore:
+    """Хранилище корзин по имени бэкенда из конфигурации"""
+    if backend == "sqlite":
+        try:
+            return SQLiteCartStore(path)
+        except sqlite3.Error as e:
+            logger.error("Не удалось открыть %s, корзины хранятся только в памяти: %s", path, e)
+            return CartStore()
+    if backend != "memory":
+        logger.warning("Неизвестный CART_BACKEND=%r, корзины хранятся только в памяти", backend)
+    return CartStore()
@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+"""
+Неизменяемый снимок меню (каталог)
+Каталог собирается целиком «в стороне» и подменяется одной операцией
+присваивания, поэтому обработчики никогда не видят меню наполовину
+"""
+import hashlib
+import json
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+# Язык для меню
+LANG = "ru"
+
+# Категории Sanity, которые не показываются в меню
+HIDDEN_CATEGORIES = ("utensils",)
+
+Product = Mapping[str, Any]
+ProductList = Tuple[Product, ...]
+CategoryData = Union[ProductList, Mapping[str, ProductList]]
+
+
+def _get_display_name(name_obj: Any) -> str:
+    """Извлекает имя на языке LANG из объекта name Sanity"""
+    if not name_obj:
+        return ""
+    if isinstance(name_obj, str):
+        return name_obj
+    return name_obj.get(LANG) or name_obj.get("ru") or name_obj.get("en") or ""
+
+
+def _to_slug(val: Any) -> str:
+    """Извлекает slug-строку из category/subcategory (может быть строка, reference или slug-объект Sanity)"""
+    if val is None:
+        return ""
+    if isinstance(val, str):
+        return val.strip()
+    if isinstance(val, dict):
+        # Sanity slug: {"_type": "slug", "current": "sets"} или reference с полем slug
+        slug = val.get("current") or val.get("slug")
+        if isinstance(slug, dict):
+            slug = slug.get("current") or slug.get("slug")
+        if isinstance(slug, str):
+            return slug.strip()
+    return ""
+
+
+# ID товара — первые 6 байт BLAKE2b от _id документа (до 10 знаков base36 в callback_data)
+_PRODUCT_ID_BYTES = 6
+
+
+def product_id_for(doc_id: str, attempt: int = 0) -> int:
+    """
+    Числовой ID товара, вычисленный из _id документа Sanity.
+    Не зависит от снимка меню, порядка товаров и экземпляра бота;
+    attempt > 0 — следующий кандидат при совпадении ID двух документов
+    """
+    key = doc_id if not attempt else f"{doc_id}#{attempt}"
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=_PRODUCT_ID_BYTES).digest()
+    return int.from_bytes(digest, "big")
+
+
+class _ProductIds:
+    """
+    Выдача стабильных числовых ID товаров.
+    ID вычисляется из _id документа; товар сохраняет ID предыдущей версии каталога
+    (важно только при совпадении хэшей), ID уже известных товаров не переиспользуются.
+    """
+
+    def __init__(self, previous: Mapping[str, Product]):
+        self._previous = previous
+        # 0 — «нет товара» в строках корзины
+        self._taken = {0}
+        self._taken.update(product["id"] for product in previous.values())
+
+    def get(self, doc_id: str) -> int:
+        """ID товара по _id документа"""
+        product = self._previous.get(doc_id)
+        if product is not None:
+            return product["id"]
+        attempt = 0
+        product_id = product_id_for(doc_id)
+        while product_id in self._taken:
+            attempt += 1
+            product_id = product_id_for(doc_id, attempt)
+        self._taken.add(product_id)
+        return product_id
+
+
+def _normalize_product(
+    raw: Mapping[str, Any],
+    category_refs: Mapping[str, str],
+    ids: _ProductIds,
+) -> Optional[Product]:
+    """
+    Документ товара Sanity -> неизменяемый словарь товара каталога.
+    Категория — slug (category) или ссылка на документ категории (categoryRef).
+    """
+    slug = _to_slug(raw.get("slug")) or (raw.get("_id") or "")
+    if not slug:
+        return None
+    doc_id = raw.get("_id") or slug
+    category = _to_slug(raw.get("category")) or category_refs.get(raw.get("categoryRef") or "", "")
+    return MappingProxyType({
+        "id": ids.get(doc_id),
+        "_id": doc_id,
+        "slug": slug,
+        "name": _get_display_name(raw.get("name")) or slug,
+        "price": int(raw.get("price") or 0),
+        "category": category,
+        "subcategory": _to_slug(raw.get("subcategory")),
+    })
+
+
+def _group_category(items: List[Product]) -> CategoryData:
+    """
+    Разложить товары категории по подкатегориям.
+    Товары упорядочены по slug, подкатегории — по первому товару;
+    категория только с пустой подкатегорией '' становится списком.
+    """
+    groups: Dict[str, List[Product]] = OrderedDict()
+    for product in sorted(items, key=lambda p: p["slug"]):
+        groups.setdefault(product["subcategory"], []).append(product)
+    if not groups or list(groups) == [""]:
+        return tuple(groups.get("", ()))
+    return MappingProxyType(OrderedDict((sub, tuple(products)) for sub, products in groups.items()))
+
+
+def _category_items(data: CategoryData) -> List[Product]:
+    """Все товары категории одним списком"""
+    if isinstance(data, Mapping):
+        return [product for products in data.values() for product in products]
+    return list(data)
+
+
+class Catalog(NamedTuple):
+    """
+    Версия меню: иерархия товаров, цены, названия и индексы.
+    Все вложенные коллекции неизменяемы (tuple / MappingProxyType).
+    """
+    version: int
+    # {category: (products)} или {category: {subcategory: (products)}}
+    products: Mapping[str, CategoryData]
+    # slug -> цена
+    prices: Mapping[str, int]
+    # slug -> display name (ru)
+    names: Mapping[str, str]
+    # индекс -> категория и обратно
+    categories: Tuple[str, ...]
+    category_indexes: Mapping[str, int]
+    # индекс категории -> (подкатегории) и обратно
+    subcategories: Mapping[int, Tuple[str, ...]]
+    subcategory_indexes: Mapping[int, Mapping[str, int]]
+    # _id документа Sanity -> товар (включая товары без категории)
+    documents: Mapping[str, Product]
+    # Стабильный числовой ID товара -> товар (для callback_data)
+    by_id: Mapping[int, Product]
+    # slug -> стабильный числовой ID товара
+    slug_ids: Mapping[str, int]
+    # _id категории Sanity -> _updatedAt
+    category_stamps: Mapping[str, str]
+    # _id категории Sanity -> slug (для ссылок category._ref у товаров)
+    category_refs: Mapping[str, str]
+    # Наибольший _updatedAt среди загруженных документов (отметка для синхронизации изменений)
+    watermark: str
+    # Хэш ответа Sanity, из которого собран каталог ('' — собран из изменений)
+    content_hash: str
+
+    def product_count(self) -> int:
+        """Количество товаров в меню"""
+        return sum(
+            len(v) if isinstance(v, tuple) else sum(len(sub) for sub in v.values())
+            for v in self.products.values()
+        )
+
+    def get_category_name(self, category_index: int) -> str:
+        """Название категории по индексу"""
+        if 0 <= category_index < len(self.categories):
+            return self.categories[category_index]
+        return ""
+
+    def get_subcategory_name(self, category_index: int, subcategory_index: int) -> str:
+        """Название подкатегории по индексам"""
+        subcategories = self.subcategories.get(category_index, ())
+        if 0 <= subcategory_index < len(subcategories):
+            return subcategories[subcategory_index]
+        return ""
+
+    def has_subcategories(self, category: str) -> bool:
+        """Есть ли у категории подкатегории"""
+        return isinstance(self.products.get(category), Mapping)
+
+    def get_subcategories(self, category: str) -> List[str]:
+        """Подкатегории категории (пустая '' — товары без подкатегории)"""
+        category_data = self.products.get(category)
+        if isinstance(category_data, Mapping):
+            return list(category_data.keys())
+        return []
+
+    def get_products(self, category: str, subcategory: str = None) -> ProductList:
+        """Товары категории или её подкатегории"""
+        category_data = self.products.get(category)
+        if isinstance(category_data, Mapping):
+            return category_data.get(subcategory, ()) if subcategory is not None else ()
+        if subcategory:
+            return ()
+        return category_data or ()
+
+    def same_menu(self, other: "Catalog") -> bool:
+        """Совпадает ли меню с other: товары, их раскладка и категории (версия и хэш не важны)"""
+        return (
+            self.categories == other.categories
+            and self.products == other.products
+            and dict(self.documents) == dict(other.documents)
+            and self.category_stamps == other.category_stamps
+            and self.category_refs == other.category_refs
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Компактное представление для снимка на диске:
+        порядок категорий и плоский список документов.
+        """
+        return {
+            "version": self.version,
+            "watermark": self.watermark,
+            "content_hash": self.content_hash,
+            "categories": list(self.categories),
+            "category_stamps": dict(self.category_stamps),
+            "category_refs": dict(self.category_refs),
+            "documents": [dict(p) for p in self.documents.values()],
+        }
+
+
+def _assemble(
+    version: int,
+    products: Mapping[str, CategoryData],
+    documents: Mapping[str, Product],
+    prices: Mapping[str, int],
+    names: Mapping[str, str],
+    category_stamps: Mapping[str, str],
+    category_refs: Mapping[str, str],
+    watermark: str,
+    content_hash: str = "",
+) -> Catalog:
+    """Собрать каталог из готовой иерархии, построив индексы"""
+    categories = tuple(products.keys())
+    subcategories: Dict[int, Tuple[str, ...]] = {}
+    subcategory_indexes: Dict[int, Mapping[str, int]] = {}
+    for cat_idx, category in enumerate(categories):
+        data = products[category]
+        if isinstance(data, Mapping):
+            subcategories[cat_idx] = tuple(data.keys())
+            subcategory_indexes[cat_idx] = MappingProxyType(
+                {sub: sub_idx for sub_idx, sub in enumerate(data.keys())}
+            )
+
+    return Catalog(
+        version=version,
+        products=MappingProxyType(products),
+        prices=MappingProxyType(prices),
+        names=MappingProxyType(names),
+        categories=categories,
+        category_indexes=MappingProxyType({cat: idx for idx, cat in enumerate(categories)}),
+        subcategories=MappingProxyType(subcategories),
+        subcategory_indexes=MappingProxyType(subcategory_indexes),
+        documents=MappingProxyType(documents),
+        by_id=MappingProxyType({p["id"]: p for p in documents.values()}),
+        slug_ids=MappingProxyType({p["slug"]: p["id"] for p in documents.values()}),
+        category_stamps=MappingProxyType(dict(category_stamps)),
+        category_refs=MappingProxyType(dict(category_refs)),
+        watermark=watermark,
+        content_hash=content_hash,
+    )
+
+
+EMPTY_CATALOG = _assemble(0, {}, {}, {}, {}, {}, {}, "")
+
+
+def make_catalog(
+    version: int,
+    category_order: List[str],
+    documents: Mapping[str, Product],
+    category_stamps: Mapping[str, str],
+    category_refs: Mapping[str, str],
+    watermark: str,
+    content_hash: str = "",
+) -> Catalog:
+    """
+    Собрать каталог из документов товаров.
+    Категории идут в порядке category_order (даже пустые),
+    неизвестные категории товаров добавляются в конец.
+    """
+    by_category: Dict[str, List[Product]] = OrderedDict((cat, []) for cat in category_order)
+    prices: Dict[str, int] = {}
+    names: Dict[str, str] = {}
+    for product in documents.values():
+        prices[product["slug"]] = product["price"]
+        names[product["slug"]] = product["name"]
+        if product["category"]:
+            by_category.setdefault(product["category"], []).append(product)
+
+    products = OrderedDict((cat, _group_category(items)) for cat, items in by_category.items())
+    return _assemble(
+        version, products, dict(documents), prices, names,
+        category_stamps, category_refs, watermark, content_hash,
+    )
+
+
+def hash_payload(raw_products: List[Dict], raw_categories: List[Dict]) -> str:
+    """Хэш ответа Sanity: совпадает — меню не изменилось и пересборка не нужна"""
+    payload = json.dumps(
+        [raw_categories, raw_products],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def build_catalog(
+    raw_products: List[Dict],
+    raw_categories: List[Dict],
+    version: int,
+    content_hash: str = "",
+    previous: Optional[Catalog] = None,
+) -> Catalog:
+    """
+    Строит каталог из категорий и продуктов Sanity.
+    Категории берутся из *[_type == "category"], продукты — из products.
+    Все категории из Sanity отображаются, даже без товаров.
+    ID товаров вычисляются из _id документов (см. product_id_for)
+    и сохраняются из предыдущей версии каталога previous.
+    """
+    # Сначала категории в порядке из Sanity (исключаем служебные)
+    category_order: List[str] = []
+    category_stamps: Dict[str, str] = {}
+    category_refs: Dict[str, str] = {}
+    stamps: List[str] = []
+    for c in raw_categories or []:
+        category_stamps[c.get("_id") or ""] = c.get("_updatedAt") or ""
+        stamps.append(c.get("_updatedAt") or "")
+        slug = _to_slug(c.get("slug"))
+        if c.get("_id") and slug:
+            category_refs[c["_id"]] = slug
+        if slug and slug not in HIDDEN_CATEGORIES and slug not in category_order:
+            category_order.append(slug)
+
+    ids = _ProductIds(previous.documents if previous else {})
+    documents: Dict[str, Product] = OrderedDict()
+    for raw in raw_products or []:
+        product = _normalize_product(raw, category_refs, ids)
+        if product is None:
+            continue
+        documents[product["_id"]] = product
+        stamps.append(raw.get("_updatedAt") or "")
+
+    return make_catalog(
+        version, category_order, documents, category_stamps, category_refs,
+        max(stamps, default=""), content_hash,
+    )
+
+
+def apply_delta(catalog: Catalog, delta: Mapping[str, Any], version: int) -> Optional[Catalog]:
+    """
+    Применить к каталогу изменения из services.sanity.fetch_menu_delta_async.
+    Пересобираются только затронутые категории, остальные переиспользуются как есть.
+    Возвращает тот же каталог, если изменений нет, новую версию каталога,
+    либо None, если изменения нельзя применить инкрементально
+    (изменились категории, новая категория, расхождение в составе товаров).
+    """
+    category_stamps = {c.get("_id") or "": c.get("_updatedAt") or "" for c in delta["categories"]}
+    if category_stamps != dict(catalog.category_stamps):
+        return None
+
+    live_ids = set(delta["productIds"])
+    changed: Dict[str, Product] = {}
+    watermark = catalog.watermark
+    ids = _ProductIds(catalog.documents)
+    for raw in delta["products"]:
+        product = _normalize_product(raw, catalog.category_refs, ids)
+        if product is None or product["_id"] not in live_ids:
+            continue
+        watermark = max(watermark, raw.get("_updatedAt") or "")
+        if catalog.documents.get(product["_id"]) != product:
+            changed[product["_id"]] = product
+    removed = [doc_id for doc_id in catalog.documents if doc_id not in live_ids]
+
+    if not changed and not removed:
+        return catalog
+
+    documents = dict(catalog.documents)
+    prices = dict(catalog.prices)
+    names = dict(catalog.names)
+    touched = set()
+    for doc_id in list(changed) + removed:
+        old = documents.pop(doc_id, None)
+        if old is not None:
+            prices.pop(old["slug"], None)
+            names.pop(old["slug"], None)
+            touched.add(old["category"])
+    for doc_id, product in changed.items():
+        if product["category"] and product["category"] not in catalog.products:
+            return None
+        documents[doc_id] = product
+        prices[product["slug"]] = product["price"]
+        names[product["slug"]] = product["name"]
+        touched.add(product["category"])
+    touched.discard("")
+
+    if len(documents) != len(live_ids):
+        return None
+
+    affected = set(changed) | set(removed)
+    products = OrderedDict(catalog.products)
+    for category in touched:
+        items = [p for p in _category_items(products[category]) if p["_id"] not in affected]
+        items.extend(p for p in changed.values() if p["category"] == category)
+        if not items:
+            # Опустевшая категория может исчезнуть из меню — это решает полная пересборка
+            return None
+        products[category] = _group_category(items)
+
+    return _assemble(
+        version, products, documents, prices, names,
+        catalog.category_stamps, catalog.category_refs, watermark,
+    )
+
+
+def catalog_from_dict(payload: Mapping[str, Any]) -> Catalog:
+    """Восстановить каталог из результата Catalog.to_dict()"""
+    documents: Dict[str, Product] = OrderedDict()
+    for doc in payload["documents"]:
+        documents[doc["_id"]] = MappingProxyType({
+            "id": int(doc["id"]),
+            "_id": doc["_id"],
+            "slug": doc["slug"],
+            "name": doc["name"],
+            "price": int(doc["price"]),
+            "category": doc["category"],
+            "subcategory": doc["subcategory"],
+        })
+    return make_catalog(
+        int(payload["version"]),
+        list(payload["categories"]),
+        documents,
+        payload["category_stamps"],
+        payload["category_refs"],
+        payload["watermark"],
+        payload.get("content_hash", ""),
+    )
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилища состояний FSM (OrderStates и данные category/subcategory)
+memory — MemoryStorage aiogram (состояния теряются при перезапуске)
+sqlite — встроенная БД SQLite с кэшем в памяти процесса (один экземпляр бота)
+redis — RedisStorage aiogram: общее состояние для нескольких экземпляров
+(любой Redis-совместимый сервер; пакет redis — requirements-redis.txt)
+"""
+import json
+import logging
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from services.sqlite_db import SQLiteThread
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS fsm ("
+    " key TEXT PRIMARY KEY,"
+    " state TEXT,"
+    " data TEXT NOT NULL DEFAULT '{}'"
+    ")"
+)
+
+
+class SQLiteStorage(SQLiteThread, BaseStorage):
+    """
+    Хранилище FSM в SQLite (WAL)
+    Чтение идёт через кэш (в БД — только при промахе), запись сквозная:
+    кэш и БД обновляются вместе. Обращения к БД выполняются в одном фоновом потоке.
+    Кэш не согласуется между процессами: для нескольких экземпляров нужен redis
+    """
+
+    def __init__(self, path: str, cache_size: int = 10000):
+        self._cache_size = cache_size
+        # {key: (state, data)} в порядке последнего обращения
+        self._cache: "OrderedDict[str, Tuple[Optional[str], Dict[str, Any]]]" = OrderedDict()
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.hits = 0
+        self.misses = 0
+        super().__init__(path, "fsm-store")
+
+    def _setup(self, connection: sqlite3.Connection) -> None:
+        connection.execute(_SCHEMA)
+
+    # Синхронные операции (только в потоке БД)
+
+    def _select(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        row = self._connection.execute(
+            "SELECT state, data FROM fsm WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _save(self, key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        with self._connection:
+            if state is None and not data:
+                self._connection.execute("DELETE FROM fsm WHERE key = ?", (key,))
+            else:
+                self._connection.execute(
+                    "INSERT INTO fsm (key, state, data) VALUES (?, ?, ?)"
+                    " ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data",
+                    (key, state, json.dumps(data, ensure_ascii=False)),
+                )
+
+    # Кэш
+
+    async def _load(self, key: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Запись из кэша или из БД (при промахе попадает в кэш)"""
+        record = self._cache.get(key)
+        if record is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return record
+        self.misses += 1
+        record = await self._run(self._select, key)
+        # Пока шло чтение, запись могла появиться в кэше — она новее
+        record = self._cache.setdefault(key, record)
+        self._trim()
+        return record
+
+    async def _store(self, key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        self._cache[key] = (state, data)
+        self._cache.move_to_end(key)
+        self._trim()
+        await self._run(self._save, key, state, data)
+
+    def _trim(self) -> None:
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    # Интерфейс BaseStorage
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key_builder.build(key)
+        _, data = await self._load(storage_key)
+        await self._store(storage_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self._key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self._key_builder.build(key)
+        state, _ = await self._load(storage_key)
+        await self._store(storage_key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(self._key_builder.build(key))
+        return dict(data)
+
+    async def close(self) -> None:
+        """Дождаться записей и закрыть БД (вызывается при остановке диспетчера)"""
+        if self._connection is None:
+            return
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+
+# Схемы адреса, которые понимает redis.asyncio.from_url
+_REDIS_SCHEMES = ("redis://", "rediss://", "unix://")
+
+
+def create_fsm_storage(backend: str, path: str, redis_url: str, cache_size: int) -> BaseStorage:
+    """Хранилище FSM по имени из конфигурации"""
+    if backend == 'sqlite':
+        return SQLiteStorage(path, cache_size)
+    if backend == 'redis':
+        if not redis_url.startswith(_REDIS_SCHEMES):
+            raise ValueError(
+                f"FSM_REDIS_URL должен начинаться с {', '.join(_REDIS_SCHEMES)}: {redis_url!r}"
+            )
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError(
+                "FSM_STORAGE=redis требует пакет redis: pip install -r requirements-redis.txt"
+            ) from e
+        return RedisStorage.from_url(
+            redis_url, key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        )
+    if backend != 'memory':
+        logger.warning("Неизвестный FSM_STORAGE=%s, используется memory", backend)
+    return MemoryStorage()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Отложенное редактирование сообщений
+Частые нажатия на одно сообщение (например, +/− в корзине) склеиваются:
+за окно в delay секунд уходит один edit_message_text с итоговым состоянием
+"""
+import asyncio
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from config import CART_EDIT_DELAY
+from services.rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Функция, возвращающая актуальные текст и клавиатуру на момент отправки
+Render = Callable[[], Tuple[str, Optional[InlineKeyboardMarkup]]]
+MessageKey = Tuple[int, int]
+
+
+class MessageEditor:
+    """Склеивает правки одного сообщения в одну отправку за окно delay"""
+
+    def __init__(self, delay: float, limiter: Optional[RateLimiter] = None):
+        self._delay = delay
+        # Общий лимит частоты отправок (None — без ограничения)
+        self._limiter = limiter
+        # {(chat_id, message_id): (bot, render)} — последняя запрошенная правка
+        self._pending: Dict[MessageKey, Tuple[Bot, Render]] = {}
+        self._tasks: Dict[MessageKey, asyncio.Task] = {}
+        self.scheduled = 0  # запрошено правок
+        self.sent = 0  # отправлено edit_message_text
+
+    def schedule(self, bot: Bot, chat_id: int, message_id: int, render: Render) -> None:
+        """Запросить правку; отправится последняя запрошенная по истечении окна"""
+        key = (chat_id, message_id)
+        self._pending[key] = (bot, render)
+        self.scheduled += 1
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._flush_later(key))
+
+    def cancel(self, chat_id: int, message_id: int) -> None:
+        """Отменить отложенную правку (сообщение уже изменено другим обработчиком)"""
+        key = (chat_id, message_id)
+        self._pending.pop(key, None)
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    async def _flush_later(self, key: MessageKey) -> None:
+        try:
+            await asyncio.sleep(self._delay)
+            while key in self._pending:
+                bot, render = self._pending.pop(key)
+                text, reply_markup = render()
+                retry_after = await self._edit(bot, key, text, reply_markup)
+                if retry_after:
+                    # Лимит Telegram: после паузы отправляем самое свежее состояние
+                    await asyncio.sleep(retry_after)
+                    self._pending.setdefault(key, (bot, render))
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+    async def _edit(
+        self,
+        bot: Bot,
+        key: MessageKey,
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup],
+    ) -> Optional[float]:
+        """Отправить правку; возвращает паузу, если Telegram ответил 429"""
+        chat_id, message_id = key
+        if self._limiter is not None:
+            await self._limiter.acquire()
+        try:
+            await bot.edit_message_text(
+                text=text,
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=reply_markup,
+            )
+            self.sent += 1
+        except TelegramRetryAfter as e:
+            if self._limiter is not None:
+                self._limiter.pause(e.retry_after)
+            return e.retry_after
+        except TelegramBadRequest as e:
+            # "message is not modified" — итоговое состояние совпало с показанным
+            if "not modified" not in str(e):
+                logger.warning("Не удалось изменить сообщение %s: %s", key, e)
+        except Exception as e:
+            logger.warning("Не удалось изменить сообщение %s: %s", key, e)
+        return None
+
+
+# Глобальный редактор сообщений корзины
+message_editor = MessageEditor(CART_EDIT_DELAY)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Доставка уведомлений администраторам о новых заказах
+Уведомления лежат в очереди в БД заказов (outbox) и отправляются в фоне:
+параллельно, с ограничением частоты и повторами с экспоненциальной паузой
+при 429 и ошибках сервера/сети. Недоставленное после перезапуска досылается
+Отправленные сообщения запоминаются, и при смене статуса заказа все копии
+правятся на месте через MessageEditor (частые смены склеиваются)
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from config import (
+    NOTIFY_CONCURRENCY,
+    NOTIFY_MAX_ATTEMPTS,
+    NOTIFY_RATE,
+    ORDER_CARD_EDIT_DELAY,
+)
+from services.message_editor import MessageEditor
+from services.order import OrderService, order_service
+from services.order_store import Notification
+from services.rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Паузы между повторами: 1, 2, 4 ... секунд, не больше 5 минут
+_BACKOFF_BASE = 1.0
+_BACKOFF_MAX = 300.0
+# Проверка очереди, если будить некому (например, после ошибки БД)
+_IDLE_INTERVAL = 60.0
+
+
+class AdminNotifier:
+    """Фоновая доставка очереди уведомлений о заказах"""
+
+    def __init__(
+        self,
+        orders: OrderService,
+        limiter: RateLimiter,
+        editor: MessageEditor,
+        concurrency: int,
+        max_attempts: int,
+    ):
+        self._orders = orders
+        self._limiter = limiter
+        self._editor = editor
+        self._concurrency = concurrency
+        self._max_attempts = max_attempts
+        # Создаются в работающем event loop (см. _primitives)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.sent = 0  # доставлено
+        self.retried = 0  # отложено для повтора
+        self.dropped = 0  # не доставлено окончательно
+
+    def wake(self) -> None:
+        """Разбудить доставку (в очередь добавлены уведомления)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _primitives(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+    async def run(self, bot: Bot) -> None:
+        """Цикл доставки; запускается фоновой задачей"""
+        self._primitives()
+        while True:
+            try:
+                delay = await self.deliver_due(bot)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Ошибка очереди уведомлений: %s", e)
+                delay = _IDLE_INTERVAL
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay or _IDLE_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+
+    async def deliver_due(self, bot: Bot) -> Optional[float]:
+        """
+        Отправить все уведомления, время которых наступило
+        Возвращает паузу до следующей попытки (None — очередь пуста)
+        """
+        self._primitives()
+        store = self._orders.store
+        while True:
+            self._wakeup.clear()
+            due = await store.get_due_notifications()
+            if not due:
+                break
+            # Ошибка одного уведомления не прерывает доставку остальных
+            results = await asyncio.gather(
+                *(self._deliver(bot, notification) for notification in due),
+                return_exceptions=True,
+            )
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors:
+                # Не удалось даже отложить уведомление (например, недоступна БД):
+                # без паузы цикл выбирал бы те же строки снова
+                raise errors[0]
+        next_at = await store.next_notification_at()
+        return None if next_at is None else max(0.0, next_at - time.time())
+
+    async def _deliver(self, bot: Bot, notification: Notification) -> None:
+        """Доставить уведомление; любая ошибка засчитывается как попытка"""
+        try:
+            await self._send(bot, notification)
+        except Exception as e:
+            logger.error(
+                "Ошибка доставки уведомления о заказе #%s для %s: %s",
+                notification.order_id, notification.chat_id, e,
+            )
+            await self._retry(notification, None, e)
+
+    async def _send(self, bot: Bot, notification: Notification) -> None:
+        store = self._orders.store
+        text = await self._orders.render_admin_notification(notification.order_id)
+        if text is None:
+            await store.delete_notification(notification.id)
+            return
+        async with self._semaphore:
+            await self._limiter.acquire()
+            try:
+                sent = await bot.send_message(chat_id=notification.chat_id, text=text)
+            except TelegramRetryAfter as e:
+                self._limiter.pause(e.retry_after)
+                await self._retry(notification, e.retry_after, e)
+                return
+            except (TelegramServerError, TelegramNetworkError) as e:
+                await self._retry(notification, None, e)
+                return
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат не найден и т. п. — повтор не поможет
+                logger.error(
+                    "Уведомление о заказе #%s для %s не доставлено: %s",
+                    notification.order_id, notification.chat_id, e,
+                )
+                self.dropped += 1
+                await store.delete_notification(notification.id)
+                return
+        self.sent += 1
+        await store.notification_sent(notification.id, sent.message_id)
+
+    async def update_cards(self, bot: Bot, order_id: int) -> int:
+        """
+        Обновить все отправленные администраторам сообщения о заказе
+        Возвращает количество запрошенных правок
+        """
+        messages = await self._orders.store.get_order_messages(order_id)
+        if not messages:
+            return 0
+        text = await self._orders.render_admin_notification(order_id)
+        if text is None:
+            return 0
+
+        def render():
+            return text, None
+
+        for chat_id, message_id in messages:
+            self._editor.schedule(bot, chat_id, message_id, render)
+        return len(messages)
+
+    async def _retry(
+        self,
+        notification: Notification,
+        retry_after: Optional[float],
+        error: Exception,
+    ) -> None:
+        """Отложить уведомление или отказаться от него после NOTIFY_MAX_ATTEMPTS попыток"""
+        store = self._orders.store
+        attempts = notification.attempts + 1
+        if attempts >= self._max_attempts:
+            logger.error(
+                "Уведомление о заказе #%s для %s не доставлено после %d попыток: %s",
+                notification.order_id, notification.chat_id, attempts, error,
+            )
+            self.dropped += 1
+            await store.delete_notification(notification.id)
+            return
+        delay = retry_after or min(_BACKOFF_MAX, _BACKOFF_BASE * 2 ** notification.attempts)
+        logger.warning(
+            "Уведомление о заказе #%s для %s: повтор через %.0f с (%s)",
+            notification.order_id, notification.chat_id, delay, error,
+        )
+        self.retried += 1
+        await store.postpone_notification(notification.id, time.time() + delay)
+
+
+# Общий лимит отправок и правок сообщений администраторам
+_limiter = RateLimiter(NOTIFY_RATE)
+
+# Правки карточек заказов у администраторов
+order_card_editor = MessageEditor(ORDER_CARD_EDIT_DELAY, _limiter)
+
+# Глобальная очередь уведомлений администраторам
+admin_notifier = AdminNotifier(
+    order_service, _limiter, order_card_editor, NOTIFY_CONCURRENCY, NOTIFY_MAX_ATTEMPTS
+)
@@ -1,112 +1,253 @@
 # -*- coding: utf-8 -*-
 """
 Сервис для работы с заказами
+Заказы хранятся в SQLite (services/order_store.py), запросы к БД не блокируют event loop
+Оформление заказа идемпотентно: повтор той же попытки оформления (токен, выданный
+при подтверждении корзины) в пределах ORDER_DEDUP_WINDOW возвращает уже созданный заказ
 """
-from typing import Dict, Optional, List
-from datetime import datetime
+import asyncio
+import hashlib
+import json
+import secrets
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, Optional, List, Tuple
+from datetime import datetime, timedelta
+from config import EXPORT_CHUNK_SIZE, ORDER_DB_PATH, ORDER_DEDUP_WINDOW, ORDERS_PAGE_SIZE
+from services.analytics import analytics_start, sales_analytics
 from services.cart import cart_service
+from services.order_store import ORDER_STATUSES, OrdersPage, SQLiteOrderStore
+
+# Допустимые переходы статусов: завершённый или отменённый заказ не меняется
+ORDER_TRANSITIONS = {
+    'new': ('processing', 'completed', 'cancelled'),
+    'processing': ('completed', 'cancelled'),
+    'completed': (),
+    'cancelled': (),
+}
 
 
 class OrderService:
     """Сервис для работы с заказами"""
     
-    def __init__(self):
-        # Хранилище заказов: {order_id: order_data}
-        # order_data = {
-        #     'order_id': int,
-        #     'user_id': int,
-        #     'username': str,
-        #     'first_name': str,
-        #     'phone': str,
-        #     'items': [(product_name, quantity, total_price), ...],
-        #     'total_sum': int,
-        #     'timestamp': datetime,
-        #     'status': str  # 'new', 'processing', 'completed', 'cancelled'
-        # }
-        self._orders: Dict[int, dict] = {}
-        self._next_order_id = 1
-    
-    def create_order(
+    def __init__(self, store: SQLiteOrderStore):
+        # Заказы в SQLite; схема — _SCHEMA в services/order_store.py,
+        # формат словаря заказа — _row_to_order там же
+        self._store = store
+        # {user_id: [lock, число ожидающих]} — оформление заказа по одному на пользователя
+        self._checkout_locks: Dict[int, list] = {}
+    
+    @asynccontextmanager
+    async def _checkout_lock(self, user_id: int):
+        """Последовательное оформление заказов одного пользователя"""
+        entry = self._checkout_locks.get(user_id)
+        if entry is None:
+            entry = self._checkout_locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._checkout_locks[user_id]
+    
+    @staticmethod
+    def new_checkout_token() -> str:
+        """Токен попытки оформления: выдаётся при подтверждении корзины"""
+        return secrets.token_urlsafe(16)
+    
+    @staticmethod
+    def idempotency_key(user_id: int, checkout_token: str) -> str:
+        """Ключ заказа: пользователь и попытка оформления"""
+        payload = json.dumps([user_id, checkout_token], ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()[:32]
+    
+    async def create_order(
         self,
         user_id: int,
         username: Optional[str],
         first_name: Optional[str],
         phone: Optional[str],
-    ) -> int:
+        checkout_token: str,
+        notify: Iterable[int] = (),
+    ) -> Tuple[Optional[int], bool]:
         """
-        Создает новый заказ и возвращает его ID
+        Создает заказ из корзины, очищает корзину и возвращает (ID заказа, создан ли он)
+        Повтор с тем же checkout_token в пределах ORDER_DEDUP_WINDOW возвращает
+        (ID уже созданного заказа, False); (None, False) — корзина пуста и заказа нет
+        notify — чаты администраторов, которым ставится в очередь уведомление о заказе
         """
-        # Получаем данные корзины
-        items = cart_service.get_cart_items(user_id)
-        total_sum = cart_service.get_total_sum(user_id)
-        
-        order_id = self._next_order_id
-        self._next_order_id += 1
-        
+        key = self.idempotency_key(user_id, checkout_token)
+        since = datetime.now() - timedelta(seconds=ORDER_DEDUP_WINDOW)
+        async with self._checkout_lock(user_id):
+            # Строки корзины и итог уже посчитаны, берём их за одно обращение
+            items, total_sum = cart_service.get_cart_summary(user_id)
+            if not items:
+                # Корзина очищена заказом, оформленным этой же попыткой
+                return await self._store.find_by_key(user_id, key, since), False
+            order_id, created = await self._insert_order(
+                user_id, username, first_name, phone, items, total_sum, key, since, notify
+            )
+            # Очистка под блокировкой: повтор увидит пустую корзину и найдёт заказ по ключу
+            cart_service.clear_cart(user_id)
+            return order_id, created
+    
+    async def _insert_order(
+        self,
+        user_id: int,
+        username: Optional[str],
+        first_name: Optional[str],
+        phone: Optional[str],
+        items: List[tuple],
+        total_sum: int,
+        key: str,
+        since: datetime,
+        notify: Iterable[int],
+    ) -> Tuple[int, bool]:
+        now = datetime.now()
         order_data = {
-            'order_id': order_id,
             'user_id': user_id,
             'username': username or "не указан",
             'first_name': first_name or "не указано",
             'phone': phone or "не указан",
             'items': items,
             'total_sum': total_sum,
-            'timestamp': datetime.now(),
+            'timestamp': now,
             'status': 'new',
         }
         
-        self._orders[order_id] = order_data
-        return order_id
+        order_id, created = await self._store.add_once(order_data, key, since, notify)
+        if created:
+            sales_analytics.record(order_data)
+        return order_id, created
     
-    def get_order(self, order_id: int) -> Optional[dict]:
+    @property
+    def store(self) -> SQLiteOrderStore:
+        """Хранилище заказов (в нём же очередь уведомлений администраторам)"""
+        return self._store
+    
+    async def get_order(self, order_id: int) -> Optional[dict]:
         """Получить заказ по ID"""
-        return self._orders.get(order_id)
-    
-    def get_all_orders(self) -> List[dict]:
-        """Получить все заказы, отсортированные по времени (новые первыми)"""
-        return sorted(
-            self._orders.values(),
-            key=lambda x: x['timestamp'],
-            reverse=True
+        return await self._store.get(order_id)
+    
+    async def render_admin_notification(self, order_id: int) -> Optional[str]:
+        """Текст уведомления администратора о заказе с текущим статусом (None — заказа нет)"""
+        order = await self._store.get(order_id)
+        if order is None:
+            return None
+        return (
+            self.format_order_for_admin(order)
+            + f"\n\n🆔 ID заказа: #{order_id}"
+            + f"\n📊 Статус: {self.get_status_emoji(order['status'])} {order['status']}"
         )
     
-    def update_order_status(self, order_id: int, status: str) -> bool:
-        """Обновить статус заказа"""
-        if order_id in self._orders:
-            self._orders[order_id]['status'] = status
-            return True
-        return False
+    async def get_orders_page(
+        self,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        status: Optional[str] = None,
+    ) -> OrdersPage:
+        """
+        Получить страницу заказов (новые первыми) по курсору order_id:
+        before — следующая страница (старше), after — предыдущая (новее),
+        status — только заказы в этом статусе
+        """
+        page = await self._store.get_page(before, after, ORDERS_PAGE_SIZE, status)
+        if not page.orders and after is not None:
+            # Новее курсора ничего нет — показываем первую страницу
+            page = await self._store.get_page(limit=ORDERS_PAGE_SIZE, status=status)
+        return page
+    
+    def count_orders(self, status: Optional[str] = None) -> int:
+        """Количество заказов (всего или в статусе) по счётчикам, без запроса к БД"""
+        counts = self._store.status_counts()
+        return counts.get(status, 0) if status is not None else sum(counts.values())
+    
+    def get_status_counts(self) -> Dict[str, int]:
+        """Количество заказов по статусам"""
+        return self._store.status_counts()
     
-    def format_order_for_admin(
+    async def iter_orders(
         self,
-        user_id: int,
-        username: Optional[str],
-        first_name: Optional[str],
-        phone: Optional[str],
-    ) -> str:
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        status: Optional[str] = None,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+    ) -> AsyncIterator[List[dict]]:
         """
-        Форматирует заказ для отправки администратору
+        Заказы за период [start, end) пачками по chunk_size, в порядке времени
+        В памяти одновременно только одна пачка
         """
-        # Получаем данные корзины
-        items = cart_service.get_cart_items(user_id)
-        total_sum = cart_service.get_total_sum(user_id)
-        
-        # Формируем сообщение
+        cursor = None
+        while True:
+            orders = await self._store.get_range(start, end, status, cursor, chunk_size)
+            if not orders:
+                return
+            yield orders
+            if len(orders) < chunk_size:
+                return
+            last = orders[-1]
+            cursor = (last['timestamp'].timestamp(), last['order_id'])
+    
+    async def update_order_status(self, order_id: int, status: str) -> bool:
+        """
+        Обновить статус заказа
+        False — неизвестный статус, заказа нет или переход запрещён
+        """
+        if status not in ORDER_STATUSES:
+            return False
+        # Статусы, из которых можно перейти в status; проверка и запись идут в потоке БД
+        allowed_from = [
+            current for current, targets in ORDER_TRANSITIONS.items() if status in targets
+        ]
+        if not await self._store.set_status(order_id, status, allowed_from):
+            return False
+        if status == 'cancelled':
+            # Отменённый заказ не входит в выручку
+            order = await self._store.get(order_id)
+            if order is not None:
+                sales_analytics.remove(order)
+        return True
+    
+    async def load_analytics(self) -> int:
+        """
+        Заполнить аналитику продаж заказами текущего месяца и недели (при запуске)
+        Возвращает количество учтённых заказов
+        """
+        sales_analytics.clear()
+        count = 0
+        async for orders in self.iter_orders(start=analytics_start()):
+            for order in orders:
+                if order['status'] != 'cancelled':
+                    sales_analytics.record(order)
+                    count += 1
+        return count
+    
+    def close(self) -> None:
+        """Закрыть хранилище заказов"""
+        self._store.close()
+    
+    def format_order_for_admin(self, order: dict) -> str:
+        """
+        Форматирует созданный заказ для отправки администратору
+        """
+        # Формируем сообщение по данным заказа, без повторного обхода корзины
         lines = ["🆕 Новый заказ!\n"]
         lines.append("👤 Клиент:")
-        lines.append(f"   ID: {user_id}")
-        if first_name:
-            lines.append(f"   Имя: {first_name}")
-        if username:
-            lines.append(f"   Username: @{username}")
-        if phone:
-            lines.append(f"   Телефон: {phone}")
+        lines.append(f"   ID: {order['user_id']}")
+        # Пропускаем поля, которые клиент не указал (заглушки из create_order)
+        if order['first_name'] != "не указано":
+            lines.append(f"   Имя: {order['first_name']}")
+        if order['username'] != "не указан":
+            lines.append(f"   Username: @{order['username']}")
+        if order['phone'] != "не указан":
+            lines.append(f"   Телефон: {order['phone']}")
         
         lines.append("\n📦 Заказ:")
-        for product_name, quantity, total_price in items:
+        for product_name, quantity, total_price in order['items']:
             lines.append(f"   • {product_name} x{quantity} = {total_price} TL")
         
-        lines.append(f"\n💰 Итого: {total_sum} TL")
+        lines.append(f"\n💰 Итого: {order['total_sum']} TL")
         
         return "\n".join(lines)
     
@@ -131,12 +272,24 @@ class OrderService:
         
         return "\n".join(lines)
     
-    def format_orders_list(self, orders: List[dict]) -> str:
-        """Форматирует список заказов"""
+    def format_orders_list(
+        self,
+        orders: List[dict],
+        total: int,
+        status: Optional[str] = None,
+    ) -> str:
+        """Форматирует страницу списка заказов (status — активный фильтр)"""
         if not orders:
             return "📭 Заказов пока нет"
         
-        lines = [f"📋 Всего заказов: {len(orders)}\n"]
+        counts = self.get_status_counts()
+        if status is None:
+            lines = [f"📋 Всего заказов: {total}"]
+        else:
+            lines = [f"📋 Заказов {self.get_status_emoji(status)} {status}: {total}"]
+        lines.append(" | ".join(
+            f"{self.get_status_emoji(name)} {counts.get(name, 0)}" for name in ORDER_STATUSES
+        ) + "\n")
         
         for order in orders:
             status_emoji = self.get_status_emoji(order['status'])
@@ -161,4 +314,4 @@ class OrderService:
 
 
 # Глобальный экземпляр сервиса заказов
-order_service = OrderService()
+order_service = OrderService(SQLiteOrderStore(ORDER_DB_PATH))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Выгрузка заказов в CSV или JSONL
+Заказы читаются из БД пачками и сразу дописываются в файл,
+поэтому память не растёт с размером истории
+"""
+import asyncio
+import csv
+import json
+from datetime import datetime
+from typing import IO, List, Optional
+
+from services.order import order_service
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+_CSV_HEADER = (
+    "order_id", "timestamp", "status", "user_id", "username",
+    "first_name", "phone", "items", "total_sum",
+)
+
+
+def _write_csv(file: IO[str], orders: List[dict]) -> None:
+    writer = csv.writer(file)
+    for order in orders:
+        items = "; ".join(
+            f"{name} x{quantity} = {total}" for name, quantity, total in order['items']
+        )
+        writer.writerow((
+            order['order_id'],
+            order['timestamp'].isoformat(sep=" ", timespec="seconds"),
+            order['status'],
+            order['user_id'],
+            order['username'],
+            order['first_name'],
+            order['phone'],
+            items,
+            order['total_sum'],
+        ))
+
+
+def _write_jsonl(file: IO[str], orders: List[dict]) -> None:
+    for order in orders:
+        record = dict(order)
+        record['timestamp'] = order['timestamp'].isoformat(timespec="seconds")
+        record['items'] = [
+            {'name': name, 'quantity': quantity, 'total': total}
+            for name, quantity, total in order['items']
+        ]
+        file.write(json.dumps(record, ensure_ascii=False))
+        file.write("\n")
+
+
+async def export_orders(
+    path: str,
+    fmt: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    status: Optional[str] = None,
+) -> int:
+    """
+    Записать заказы за период [start, end) в файл path, вернуть их количество
+    fmt — 'csv' или 'jsonl'; запись в файл идёт вне event loop
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    write = _write_csv if fmt == 'csv' else _write_jsonl
+    count = 0
+    # utf-8-sig: Excel распознаёт кодировку CSV по BOM
+    encoding = "utf-8-sig" if fmt == 'csv' else "utf-8"
+    with open(path, "w", encoding=encoding, newline="") as file:
+        if fmt == 'csv':
+            csv.writer(file).writerow(_CSV_HEADER)
+        async for orders in order_service.iter_orders(start, end, status):
+            await asyncio.to_thread(write, file, orders)
+            count += len(orders)
+    return count
@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище заказов в SQLite (WAL)
+Все обращения к БД идут через один фоновый поток, поэтому не блокируют event loop
+и не требуют блокировок: поток владеет соединением
+Индексы: (status, order_id), timestamp, user_id
+Списки заказов листаются курсором по order_id (ID растут в порядке создания),
+поэтому страница читает только свои строки, в том числе при фильтре по статусу
+Количество заказов по статусам считается один раз при открытии и дальше
+поддерживается при создании заказов и смене статуса
+Выгрузка читает заказы за период пачками по курсору (timestamp, order_id)
+Уведомления администраторам о заказе (outbox) записываются в той же транзакции,
+что и заказ, и удаляются после доставки, поэтому переживают перезапуск;
+доставленные сообщения запоминаются в order_messages для правки при смене статуса
+Повтор той же попытки оформления (ключ идемпотентности) в пределах окна
+находится в потоке БД перед вставкой и возвращает уже созданный заказ
+"""
+import json
+import sqlite3
+import time
+from datetime import datetime
+from typing import Collection, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from services.sqlite_db import SQLiteThread
+
+# Статусы заказа; индекс статуса передаётся в callback_data кнопок администратора
+ORDER_STATUSES = ('new', 'processing', 'completed', 'cancelled')
+
+# Колонки заказа в порядке SELECT
+_COLUMNS = (
+    "order_id, user_id, username, first_name, phone, items, total_sum, timestamp, status"
+)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS orders ("
+    " order_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " user_id INTEGER NOT NULL,"
+    " username TEXT NOT NULL,"
+    " first_name TEXT NOT NULL,"
+    " phone TEXT NOT NULL,"
+    " items TEXT NOT NULL,"
+    " total_sum INTEGER NOT NULL,"
+    " timestamp REAL NOT NULL,"
+    " status TEXT NOT NULL,"
+    " idempotency_key TEXT"
+    ")",
+    # Фильтр по статусу с листанием по order_id читает только нужные строки индекса
+    "DROP INDEX IF EXISTS idx_orders_status",
+    "CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders (status, order_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_timestamp ON orders (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders (user_id)",
+    "CREATE TABLE IF NOT EXISTS order_notifications ("
+    " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " order_id INTEGER NOT NULL,"
+    " chat_id INTEGER NOT NULL,"
+    " attempts INTEGER NOT NULL DEFAULT 0,"
+    " next_attempt_at REAL NOT NULL"
+    ")",
+    "CREATE INDEX IF NOT EXISTS idx_order_notifications_due"
+    " ON order_notifications (next_attempt_at)",
+    "CREATE TABLE IF NOT EXISTS order_messages ("
+    " order_id INTEGER NOT NULL,"
+    " chat_id INTEGER NOT NULL,"
+    " message_id INTEGER NOT NULL,"
+    " PRIMARY KEY (order_id, chat_id)"
+    ")",
+)
+
+
+class Notification(NamedTuple):
+    """Недоставленное уведомление администратора о заказе"""
+    id: int
+    order_id: int
+    chat_id: int
+    attempts: int
+
+
+class OrdersPage(NamedTuple):
+    """Страница списка заказов, новые первыми"""
+    orders: List[dict]
+    has_newer: bool
+    has_older: bool
+
+
+def _row_to_order(row: tuple) -> dict:
+    """Строка таблицы -> словарь заказа в формате OrderService"""
+    order_id, user_id, username, first_name, phone, items, total_sum, timestamp, status = row
+    return {
+        'order_id': order_id,
+        'user_id': user_id,
+        'username': username,
+        'first_name': first_name,
+        'phone': phone,
+        'items': [tuple(item) for item in json.loads(items)],
+        'total_sum': total_sum,
+        'timestamp': datetime.fromtimestamp(timestamp),
+        'status': status,
+    }
+
+
+def _order_to_row(order: dict) -> tuple:
+    """Словарь заказа (без order_id) -> значения колонок"""
+    return (
+        order['user_id'],
+        order['username'],
+        order['first_name'],
+        order['phone'],
+        json.dumps(order['items'], ensure_ascii=False),
+        order['total_sum'],
+        order['timestamp'].timestamp(),
+        order['status'],
+    )
+
+
+class SQLiteOrderStore(SQLiteThread):
+    """Репозиторий заказов; async-методы выполняются в потоке БД"""
+
+    def __init__(self, path: str):
+        # {status: количество заказов}; меняется только в потоке БД
+        self._counts: Dict[str, int] = dict.fromkeys(ORDER_STATUSES, 0)
+        super().__init__(path, "order-store")
+
+    def _setup(self, connection: sqlite3.Connection) -> None:
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        # БД, созданные до появления ключа идемпотентности
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(orders)")}
+        if "idempotency_key" not in columns:
+            connection.execute("ALTER TABLE orders ADD COLUMN idempotency_key TEXT")
+        connection.commit()
+        for status, count in connection.execute(
+            "SELECT status, COUNT(*) FROM orders GROUP BY status"
+        ):
+            self._counts[status] = count
+
+    # Синхронные операции (только в потоке БД)
+
+    def _insert(self, order: dict, notify: List[int], key: Optional[str] = None) -> int:
+        with self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO orders (user_id, username, first_name, phone, items,"
+                " total_sum, timestamp, status, idempotency_key)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*_order_to_row(order), key),
+            )
+            if notify:
+                self._connection.executemany(
+                    "INSERT INTO order_notifications (order_id, chat_id, next_attempt_at)"
+                    " VALUES (?, ?, ?)",
+                    [(cursor.lastrowid, chat_id, time.time()) for chat_id in notify],
+                )
+        self._counts[order['status']] = self._counts.get(order['status'], 0) + 1
+        return cursor.lastrowid
+
+    def _insert_once(
+        self,
+        order: dict,
+        notify: List[int],
+        key: str,
+        since: float,
+    ) -> Tuple[int, bool]:
+        # Проверка и вставка в одном потоке БД: параллельные запросы не создадут дубль
+        order_id = self._select_by_key(order['user_id'], key, since)
+        if order_id is not None:
+            return order_id, False
+        return self._insert(order, notify, key), True
+
+    def _select_by_key(self, user_id: int, key: str, since: float) -> Optional[int]:
+        row = self._connection.execute(
+            "SELECT order_id FROM orders WHERE user_id = ? AND idempotency_key = ?"
+            " AND timestamp >= ? ORDER BY order_id DESC LIMIT 1",
+            (user_id, key, since),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _insert_many(self, orders: List[dict]) -> None:
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO orders (user_id, username, first_name, phone, items,"
+                " total_sum, timestamp, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [_order_to_row(order) for order in orders],
+            )
+        for order in orders:
+            self._counts[order['status']] = self._counts.get(order['status'], 0) + 1
+
+    def _select_one(self, order_id: int) -> Optional[dict]:
+        row = self._connection.execute(
+            f"SELECT {_COLUMNS} FROM orders WHERE order_id = ?", (order_id,)
+        ).fetchone()
+        return _row_to_order(row) if row is not None else None
+
+    def _page_query(self, status: Optional[str], condition: str, order: str) -> tuple:
+        """SQL страницы и начальные параметры с учётом фильтра по статусу"""
+        where = ["status = ?"] if status is not None else []
+        params = [status] if status is not None else []
+        if condition:
+            where.append(condition)
+        sql = f"SELECT {_COLUMNS} FROM orders"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return sql + f" ORDER BY order_id {order} LIMIT ?", params
+
+    def _exists(self, status: Optional[str], condition: str, order_id: int) -> bool:
+        sql, params = self._page_query(status, f"order_id {condition} ?", "ASC")
+        return self._connection.execute(sql, (*params, order_id, 1)).fetchone() is not None
+
+    def _select_page(
+        self,
+        before: Optional[int],
+        after: Optional[int],
+        limit: int,
+        status: Optional[str],
+    ) -> OrdersPage:
+        if after is not None:
+            # Страница новее курсора: читаем по возрастанию и разворачиваем
+            sql, params = self._page_query(status, "order_id > ?", "ASC")
+            rows = self._connection.execute(sql, (*params, after, limit + 1)).fetchall()
+            has_newer = len(rows) > limit
+            rows = rows[:limit]
+            rows.reverse()
+            has_older = bool(rows) and self._exists(status, "<", rows[-1][0])
+        else:
+            if before is None:
+                sql, params = self._page_query(status, "", "DESC")
+            else:
+                sql, params = self._page_query(status, "order_id < ?", "DESC")
+                params.append(before)
+            rows = self._connection.execute(sql, (*params, limit + 1)).fetchall()
+            has_older = len(rows) > limit
+            rows = rows[:limit]
+            has_newer = bool(rows) and self._exists(status, ">", rows[0][0])
+        return OrdersPage([_row_to_order(row) for row in rows], has_newer, has_older)
+
+    def _select_by_user(self, user_id: int, limit: int) -> List[dict]:
+        rows = self._connection.execute(
+            f"SELECT {_COLUMNS} FROM orders WHERE user_id = ?"
+            " ORDER BY timestamp DESC LIMIT ?",
+            (user_id, limit),
+        ).fetchall()
+        return [_row_to_order(row) for row in rows]
+
+    def _select_range(
+        self,
+        start: Optional[float],
+        end: Optional[float],
+        status: Optional[str],
+        cursor: Optional[tuple],
+        limit: int,
+    ) -> List[dict]:
+        where, params = [], []
+        if start is not None:
+            where.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("timestamp < ?")
+            params.append(end)
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        if cursor is not None:
+            where.append("(timestamp, order_id) > (?, ?)")
+            params.extend(cursor)
+        sql = f"SELECT {_COLUMNS} FROM orders"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self._connection.execute(
+            sql + " ORDER BY timestamp, order_id LIMIT ?", (*params, limit)
+        ).fetchall()
+        return [_row_to_order(row) for row in rows]
+
+    def _set_status(self, order_id: int, status: str, allowed_from: Collection[str]) -> bool:
+        # Запись идёт только из этого потока, поэтому чтение и обновление не разделить
+        row = self._connection.execute(
+            "SELECT status FROM orders WHERE order_id = ?", (order_id,)
+        ).fetchone()
+        if row is None or row[0] not in allowed_from:
+            return False
+        with self._connection:
+            self._connection.execute(
+                "UPDATE orders SET status = ? WHERE order_id = ?", (status, order_id)
+            )
+        self._counts[row[0]] -= 1
+        self._counts[status] = self._counts.get(status, 0) + 1
+        return True
+
+    def _count(self, status: Optional[str]) -> int:
+        if status is None:
+            row = self._connection.execute("SELECT COUNT(*) FROM orders").fetchone()
+        else:
+            row = self._connection.execute(
+                "SELECT COUNT(*) FROM orders WHERE status = ?", (status,)
+            ).fetchone()
+        return row[0]
+
+    def _select_due_notifications(self, now: float, limit: int) -> List[Notification]:
+        rows = self._connection.execute(
+            "SELECT id, order_id, chat_id, attempts FROM order_notifications"
+            " WHERE next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+            (now, limit),
+        ).fetchall()
+        return [Notification(*row) for row in rows]
+
+    def _next_notification_at(self) -> Optional[float]:
+        row = self._connection.execute(
+            "SELECT MIN(next_attempt_at) FROM order_notifications"
+        ).fetchone()
+        return row[0]
+
+    def _delete_notification(self, notification_id: int) -> None:
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM order_notifications WHERE id = ?", (notification_id,)
+            )
+
+    def _mark_notification_sent(self, notification_id: int, message_id: int) -> None:
+        # Удаление из очереди и запись сообщения — одной транзакцией
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO order_messages (order_id, chat_id, message_id)"
+                " SELECT order_id, chat_id, ? FROM order_notifications WHERE id = ?",
+                (message_id, notification_id),
+            )
+            self._connection.execute(
+                "DELETE FROM order_notifications WHERE id = ?", (notification_id,)
+            )
+
+    def _select_order_messages(self, order_id: int) -> List[tuple]:
+        return self._connection.execute(
+            "SELECT chat_id, message_id FROM order_messages WHERE order_id = ?", (order_id,)
+        ).fetchall()
+
+    def _postpone_notification(self, notification_id: int, next_attempt_at: float) -> None:
+        with self._connection:
+            self._connection.execute(
+                "UPDATE order_notifications SET attempts = attempts + 1, next_attempt_at = ?"
+                " WHERE id = ?",
+                (next_attempt_at, notification_id),
+            )
+
+    # Асинхронный интерфейс
+
+    async def add(self, order: dict, notify: Iterable[int] = ()) -> int:
+        """
+        Сохранить заказ (без order_id) и вернуть присвоенный ID
+        notify — чаты, которым в той же транзакции ставится уведомление о заказе
+        """
+        return await self._run(self._insert, order, list(notify))
+
+    async def add_once(
+        self,
+        order: dict,
+        key: str,
+        since: datetime,
+        notify: Iterable[int] = (),
+    ) -> Tuple[int, bool]:
+        """
+        Сохранить заказ, если у пользователя нет заказа с ключом key не раньше since
+        Возвращает (order_id, создан ли новый заказ)
+        """
+        return await self._run(self._insert_once, order, list(notify), key, since.timestamp())
+
+    async def find_by_key(self, user_id: int, key: str, since: datetime) -> Optional[int]:
+        """ID заказа пользователя с ключом key не раньше since (None — такого нет)"""
+        return await self._run(self._select_by_key, user_id, key, since.timestamp())
+
+    async def add_many(self, orders: Iterable[dict]) -> None:
+        """Сохранить пачку заказов одной транзакцией (импорт, бенчмарки)"""
+        await self._run(self._insert_many, list(orders))
+
+    async def get(self, order_id: int) -> Optional[dict]:
+        return await self._run(self._select_one, order_id)
+
+    async def get_page(
+        self,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        limit: int = 10,
+        status: Optional[str] = None,
+    ) -> OrdersPage:
+        """
+        Страница заказов, новые первыми
+        before — заказы старше order_id, after — новее order_id, без курсора — самые новые;
+        status — только заказы в этом статусе
+        """
+        return await self._run(self._select_page, before, after, limit, status)
+
+    async def get_by_user(self, user_id: int, limit: int = 10) -> List[dict]:
+        """Последние заказы пользователя"""
+        return await self._run(self._select_by_user, user_id, limit)
+
+    async def get_range(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        status: Optional[str] = None,
+        cursor: Optional[tuple] = None,
+        limit: int = 1000,
+    ) -> List[dict]:
+        """
+        Пачка заказов за период [start, end) в порядке времени
+        cursor — (timestamp, order_id) последнего заказа предыдущей пачки
+        """
+        return await self._run(
+            self._select_range,
+            start.timestamp() if start is not None else None,
+            end.timestamp() if end is not None else None,
+            status,
+            cursor,
+            limit,
+        )
+
+    async def set_status(self, order_id: int, status: str, allowed_from: Collection[str]) -> bool:
+        """Сменить статус, если текущий статус заказа входит в allowed_from"""
+        return await self._run(self._set_status, order_id, status, allowed_from)
+
+    def status_counts(self) -> Dict[str, int]:
+        """Количество заказов по статусам (без обращения к БД)"""
+        return dict(self._counts)
+
+    async def count(self, status: Optional[str] = None) -> int:
+        return await self._run(self._count, status)
+
+    async def get_due_notifications(self, limit: int = 100) -> List[Notification]:
+        """Уведомления, время попытки которых наступило"""
+        return await self._run(self._select_due_notifications, time.time(), limit)
+
+    async def next_notification_at(self) -> Optional[float]:
+        """Время ближайшей попытки (time.time()), None — очередь пуста"""
+        return await self._run(self._next_notification_at)
+
+    async def delete_notification(self, notification_id: int) -> None:
+        """Убрать уведомление из очереди (доставлено или доставка невозможна)"""
+        await self._run(self._delete_notification, notification_id)
+
+    async def notification_sent(self, notification_id: int, message_id: int) -> None:
+        """Убрать доставленное уведомление из очереди и запомнить его сообщение"""
+        await self._run(self._mark_notification_sent, notification_id, message_id)
+
+    async def get_order_messages(self, order_id: int) -> List[tuple]:
+        """Сообщения администраторам о заказе: [(chat_id, message_id)]"""
+        return await self._run(self._select_order_messages, order_id)
+
+    async def postpone_notification(self, notification_id: int, next_attempt_at: float) -> None:
+        """Отложить уведомление до next_attempt_at и увеличить счётчик попыток"""
+        await self._run(self._postpone_notification, notification_id, next_attempt_at)
+
+    def close(self) -> None:
+        """Дождаться записей и закрыть БД"""
+        self._shutdown()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Ограничение частоты запросов к Telegram
+Один ограничитель делят отправка уведомлений и правка карточек заказов
+"""
+import asyncio
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """Ограничение частоты: не больше rate событий в секунду (token bucket)"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self._rate = rate
+        self._capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        """Дождаться разрешения на одно событие"""
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        # Токен берётся сразу; отрицательный остаток — очередь ожидающих
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self._rate)
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать разрешений seconds секунд (Telegram ответил 429)"""
+        self._tokens = min(self._tokens, -seconds * self._rate)
@@ -1,62 +1,177 @@
 # -*- coding: utf-8 -*-
 """
 Сервис для загрузки категорий и товаров из Sanity CMS
+Категории и товары загружаются одним запросом (MENU_QUERY) с минимальной проекцией:
+только поля, которые использует бот
+Синхронный клиент (requests) используется только при старте без снимка меню,
+асинхронный (aiohttp) — внутри event loop бота
 """
+import asyncio
+import json
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+
+import aiohttp
 import requests
 
-from config import SANITY_PROJECT_ID, SANITY_DATASET, SANITY_API_VERSION
+from config import (
+    SANITY_PROJECT_ID,
+    SANITY_DATASET,
+    SANITY_API_VERSION,
+    SANITY_TIMEOUT,
+    SANITY_POOL_SIZE,
+    SANITY_API_URL,
+)
 
 logger = logging.getLogger(__name__)
 
-CATEGORIES_QUERY = '''*[_type == "category"] | order(order asc, slug asc) {
-  _id,
-  slug,
-  name,
-  order
+# Поля товара, которые читает бот. Категория передаётся ссылкой (_ref) и
+# сопоставляется со slug категории на нашей стороне — без разыменования на каждый товар.
+# Имя сразу сводится к строке на языке меню (ru, затем en).
+PRODUCT_PROJECTION = '''{
+    _id,
+    _updatedAt,
+    "slug": slug.current,
+    "name": coalesce(name.ru, name.en, name),
+    "categoryRef": category._ref,
+    subcategory,
+    price
+  }'''
+
+# Меню целиком одним запросом: категории в порядке отображения и все товары
+MENU_QUERY = '''{
+  "categories": *[_type == "category"] | order(order asc, slug.current asc) {
+    _id,
+    _updatedAt,
+    "slug": slug.current
+  },
+  "products": *[_type == "product"] | order(_id asc) ''' + PRODUCT_PROJECTION + '''
 }'''
 
-PRODUCTS_QUERY = '''*[_type == "product"] | order(category->order asc, category->slug asc, slug asc) {
-  _id,
-  slug,
-  name,
-  description,
-  "category": category->slug,
-  subcategory,
-  price,
-  weight,
-  image,
-  badge,
-  "recommendations": recommendations[]->slug
+# Изменения с момента $since одним запросом: товары, изменённые не раньше отметки,
+# _id всех товаров (для поиска удалённых) и отметки всех категорий
+DELTA_QUERY = '''{
+  "categories": *[_type == "category"] { _id, _updatedAt },
+  "products": *[_type == "product" && _updatedAt >= $since] ''' + PRODUCT_PROJECTION + ''',
+  "productIds": *[_type == "product"]._id
 }'''
 
+# Общая HTTP-сессия с пулом keep-alive соединений (создаётся лениво внутри event loop)
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _query_url() -> str:
+    """URL эндпоинта GROQ-запросов (SANITY_API_URL — для локальной замены Sanity)"""
+    base_url = SANITY_API_URL or f"https://{SANITY_PROJECT_ID}.api.sanity.io"
+    return f"{base_url}/v{SANITY_API_VERSION}/data/query/{SANITY_DATASET}"
+
 
-def _run_query(query: str) -> List[Dict[str, Any]]:
-    """Выполнить GROQ-запрос к Sanity"""
-    url = (
-        f"https://{SANITY_PROJECT_ID}.api.sanity.io"
-        f"/v{SANITY_API_VERSION}/data/query/{SANITY_DATASET}"
+def _query_params(query: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """Параметры HTTP-запроса: сам запрос и GROQ-параметры ($name=JSON)"""
+    http_params = {"query": query}
+    for name, value in (params or {}).items():
+        http_params[f"${name}"] = json.dumps(value)
+    return http_params
+
+
+def _split_menu(result: Any) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Разобрать ответ на MENU_QUERY в (categories, products)"""
+    if not isinstance(result, dict):
+        return [], []
+    categories = result.get("categories")
+    products = result.get("products")
+    return (
+        categories if isinstance(categories, list) else [],
+        products if isinstance(products, list) else [],
     )
+
+
+def _fetch_result(query: str) -> Any:
+    """
+    Выполнить GROQ-запрос к Sanity (блокирующий вариант).
+    Возвращает поле result ответа или None при ошибке.
+    """
     try:
-        response = requests.get(url, params={"query": query}, timeout=30)
+        response = requests.get(_query_url(), params=_query_params(query), timeout=SANITY_TIMEOUT)
         response.raise_for_status()
         data = response.json()
-        result = data.get("result", [])
-        return result if isinstance(result, list) else []
+        return data.get("result")
     except requests.RequestException as e:
         logger.error("Ошибка запроса к Sanity: %s", e)
-        return []
-    except (ValueError, KeyError) as e:
+        return None
+    except (ValueError, KeyError, AttributeError) as e:
+        logger.error("Ошибка парсинга ответа Sanity: %s", e)
+        return None
+
+
+def fetch_menu() -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Загружает категории и товары одним запросом.
+    Возвращает (categories, products).
+    """
+    return _split_menu(_fetch_result(MENU_QUERY))
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """Вернуть общую aiohttp-сессию, создав её при первом обращении"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=SANITY_POOL_SIZE,
+            keepalive_timeout=60,
+            ttl_dns_cache=300,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=SANITY_TIMEOUT),
+        )
+    return _session
+
+
+async def _fetch_result_async(query: str, params: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Выполнить GROQ-запрос к Sanity, не блокируя event loop.
+    Возвращает поле result ответа или None при ошибке.
+    """
+    try:
+        session = _get_session()
+        async with session.get(_query_url(), params=_query_params(query, params)) as response:
+            response.raise_for_status()
+            data = await response.json()
+        return data.get("result")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error("Ошибка запроса к Sanity: %s", e)
+        return None
+    except (ValueError, KeyError, AttributeError) as e:
         logger.error("Ошибка парсинга ответа Sanity: %s", e)
-        return []
+        return None
+
+
+async def fetch_menu_async() -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Асинхронно загружает категории и товары одним запросом.
+    Возвращает (categories, products).
+    """
+    return _split_menu(await _fetch_result_async(MENU_QUERY))
 
 
-def fetch_categories() -> List[Dict[str, Any]]:
-    """Загружает категории из Sanity (*[_type == "category"])"""
-    return _run_query(CATEGORIES_QUERY)
+async def fetch_menu_delta_async(since: str) -> Optional[Dict[str, Any]]:
+    """
+    Загружает изменения меню начиная с отметки since (_updatedAt).
+    Возвращает {"categories", "products", "productIds"} или None при ошибке.
+    """
+    result = await _fetch_result_async(DELTA_QUERY, {"since": since})
+    if not isinstance(result, dict):
+        return None
+    if not all(isinstance(result.get(key), list) for key in ("categories", "products", "productIds")):
+        logger.error("Неожиданный формат ответа Sanity на запрос изменений")
+        return None
+    return result
 
 
-def fetch_products() -> List[Dict[str, Any]]:
-    """Загружает products из Sanity CMS"""
-    return _run_query(PRODUCTS_QUERY)
+async def close_session() -> None:
+    """Закрыть общую HTTP-сессию (при остановке бота)"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
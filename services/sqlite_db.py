@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Общие части хранилищ SQLite
+connect — соединение в режиме WAL (synchronous=NORMAL: запись без fsync на каждую транзакцию)
+SQLiteThread — основа хранилища, соединением которого владеет один фоновый поток:
+обращения из async-кода не блокируют event loop и не требуют блокировок
+"""
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+def connect(path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    """Открыть БД в режиме WAL"""
+    connection = sqlite3.connect(path, check_same_thread=check_same_thread)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class SQLiteThread:
+    """
+    Соединение с БД в собственном потоке
+    Наследник создаёт схему в _setup, синхронные операции обращаются к self._connection
+    и вызываются только в потоке БД — через _run из async-кода
+    """
+
+    def __init__(self, path: str, thread_name: str):
+        self._path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=thread_name)
+        self._connection: Optional[sqlite3.Connection] = None
+        # Соединение создаётся в потоке БД, схема — до первого запроса
+        self._executor.submit(self._open).result()
+
+    def _open(self) -> None:
+        connection = connect(self._path)
+        self._setup(connection)
+        connection.commit()
+        self._connection = connection
+
+    def _setup(self, connection: sqlite3.Connection) -> None:
+        """Создать схему (в потоке БД при открытии)"""
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Выполнить func в потоке БД"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _shutdown(self) -> None:
+        """Дождаться начатых операций, закрыть БД и остановить поток"""
+        self._executor.submit(self._close).result()
+        self._executor.shutdown(wait=True)
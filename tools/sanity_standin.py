@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная замена Sanity для проверки загрузки и синхронизации меню без сети
+
+Отвечает на GROQ-запросы бота (services.sanity) по документам из JSON-файла.
+Файл перечитывается при изменении, поэтому правка, добавление или удаление
+документа в нём имитирует изменение в CMS.
+
+Запуск:
+    python -m tools.sanity_standin documents.json --port 8765
+    SANITY_API_URL=http://127.0.0.1:8765 python main.py
+
+Формат файла — список документов Sanity:
+    {"_id": "c1", "_type": "category", "slug": {"current": "rolls"}, "order": 1}
+    {"_id": "p1", "_type": "product", "slug": {"current": "philadelphia"},
+     "name": {"ru": "Филадельфия"}, "category": {"_ref": "c1"}, "price": 450}
+Отсутствующий _updatedAt берётся из времени изменения файла.
+"""
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from services.sanity import MENU_QUERY, DELTA_QUERY
+
+
+class DocumentStore:
+    """Документы из JSON-файла, перечитываемые при изменении"""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._mtime: Optional[float] = None
+        self._documents: List[Dict[str, Any]] = []
+
+    def documents(self) -> List[Dict[str, Any]]:
+        """Актуальный список документов"""
+        mtime = os.path.getmtime(self._path)
+        if mtime != self._mtime:
+            with open(self._path, encoding="utf-8") as f:
+                documents = json.load(f)
+            stamp = datetime.fromtimestamp(mtime, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            for doc in documents:
+                doc.setdefault("_updatedAt", stamp)
+            self._documents = documents
+            self._mtime = mtime
+        return self._documents
+
+
+def _slug_value(slug: Any) -> str:
+    """Строковое значение slug-объекта"""
+    if isinstance(slug, dict):
+        return slug.get("current") or ""
+    return slug or ""
+
+
+def _project(doc: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """Проекция документа на перечисленные поля (отсутствующие — null)"""
+    return {field: doc.get(field) for field in fields}
+
+
+def _product(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Проекция товара как в services.sanity.PRODUCT_PROJECTION"""
+    name = doc.get("name")
+    if isinstance(name, dict):
+        name = name.get("ru") or name.get("en") or name
+    return {
+        "_id": doc.get("_id"),
+        "_updatedAt": doc.get("_updatedAt"),
+        "slug": _slug_value(doc.get("slug")) or None,
+        "name": name,
+        "categoryRef": (doc.get("category") or {}).get("_ref"),
+        "subcategory": doc.get("subcategory"),
+        "price": doc.get("price"),
+    }
+
+
+class SanityStandIn:
+    """Вычисление ответов на известные запросы бота"""
+
+    def __init__(self, store: DocumentStore):
+        self._store = store
+
+    def _of_type(self, doc_type: str) -> List[Dict[str, Any]]:
+        return [doc for doc in self._store.documents() if doc.get("_type") == doc_type]
+
+    def menu(self) -> Dict[str, Any]:
+        """MENU_QUERY"""
+        categories = sorted(
+            self._of_type("category"),
+            key=lambda c: (c.get("order") is None, c.get("order") or 0, _slug_value(c.get("slug"))),
+        )
+        products = sorted(self._of_type("product"), key=lambda p: p.get("_id") or "")
+        return {
+            "categories": [
+                {"_id": c.get("_id"), "_updatedAt": c.get("_updatedAt"), "slug": _slug_value(c.get("slug")) or None}
+                for c in categories
+            ],
+            "products": [_product(doc) for doc in products],
+        }
+
+    def delta(self, since: str) -> Dict[str, Any]:
+        """DELTA_QUERY"""
+        products = self._of_type("product")
+        return {
+            "categories": [_project(c, ["_id", "_updatedAt"]) for c in self._of_type("category")],
+            "products": [_product(doc) for doc in products if (doc.get("_updatedAt") or "") >= since],
+            "productIds": [doc["_id"] for doc in products],
+        }
+
+    def run(self, query: str, params: Dict[str, Any]) -> Any:
+        """Ответ на запрос; KeyError — запрос не поддерживается"""
+        if query == MENU_QUERY:
+            return self.menu()
+        if query == DELTA_QUERY:
+            return self.delta(params["since"])
+        raise KeyError(query)
+
+
+def create_app(path: str) -> web.Application:
+    """aiohttp-приложение с эндпоинтом /v{version}/data/query/{dataset}"""
+    standin = SanityStandIn(DocumentStore(path))
+
+    async def handle_query(request: web.Request) -> web.Response:
+        query = request.query.get("query", "")
+        try:
+            params = {
+                name[1:]: json.loads(value)
+                for name, value in request.query.items()
+                if name.startswith("$")
+            }
+            result = standin.run(query, params)
+        except (KeyError, ValueError):
+            return web.json_response(
+                {"error": {"description": "unsupported query", "type": "queryParseError"}},
+                status=400,
+            )
+        return web.json_response({"ms": 0, "query": query, "result": result})
+
+    app = web.Application()
+    app.router.add_get("/{version}/data/query/{dataset}", handle_query)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальная замена Sanity для бота")
+    parser.add_argument("documents", help="JSON-файл со списком документов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    web.run_app(create_app(args.documents), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()